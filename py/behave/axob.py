@@ -18,13 +18,18 @@
     * 访问次数
     * save/load
 """
+from array import array
+from bisect import bisect_left
 from enum import Enum
+from itertools import compress
+import pickle
+import struct
 from tool.msg_util import (
     axsbe_base,
     axsbe_exe,
     axsbe_order,
     axsbe_snap_stock,
-    price_level,
+    batch_columns,
     CYB_cage_upper,
     CYB_cage_lower,
     bitSizeOf,
@@ -37,8 +42,13 @@ from tool.axsbe_base import (
     SecurityIDSource_SZSE,
     INSTRUMENT_TYPE,
     MsgType_exe_sse_bond,
+    MsgTypes_exe,
+    MsgTypes_order,
+    TPM,
 )
+from behave.level_tree import LEVEL_TREE_TYPE, cage_levels, new_level_tree, top_levels
 from copy import deepcopy
+from time import perf_counter
 
 import logging
 
@@ -98,6 +108,11 @@ class TYPE(Enum):  # 2bit
     UNKNOWN = -1  # 仅用于测试
 
 
+# 按value下标取枚举，避免在订单表的热路径上构造Enum；UNKNOWN(-1)落在末项
+SIDE_OF_VALUE = (SIDE.BID, SIDE.ASK, SIDE.UNKNOWN)
+TYPE_OF_VALUE = (TYPE.LIMIT, TYPE.MARKET, TYPE.SIDE, TYPE.UNKNOWN)
+
+
 # 用于将原始精度转换到ob精度
 SZSE_STOCK_PRICE_RD = msg_util.PRICE_SZSE_INCR_PRECISION // PRICE_INTER_STOCK_PRECISION
 SZSE_FUND_PRICE_RD = msg_util.PRICE_SZSE_INCR_PRECISION // PRICE_INTER_FUND_PRECISION
@@ -105,6 +120,255 @@ SZSE_KZZ_PRICE_RD = msg_util.PRICE_SZSE_INCR_PRECISION // PRICE_INTER_KZZ_PRECIS
 SSE_STOCK_PRICE_RD = msg_util.PRICE_SSE_PRECISION // PRICE_INTER_STOCK_PRECISION
 # SSE_FUND_PRICE_RD = msg_util.PRICE_SSE_PRECISION // PRICE_INTER_FUND_PRECISION TODO:确认精度 [low priority]
 
+PRICE_RD = {
+    (SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK): SZSE_STOCK_PRICE_RD,  # 深圳 N13(4)，实际股票精度为分
+    (SecurityIDSource_SZSE, INSTRUMENT_TYPE.FUND): SZSE_FUND_PRICE_RD,  # 深圳 N13(4)，实际基金精度为厘
+    (SecurityIDSource_SZSE, INSTRUMENT_TYPE.KZZ): SZSE_KZZ_PRICE_RD,  # 深圳 N13(4)，实际可转债精度为厘
+    (SecurityIDSource_SSE, INSTRUMENT_TYPE.STOCK): SSE_STOCK_PRICE_RD,  # 上海 原始数据3位小数
+    (SecurityIDSource_SSE, INSTRUMENT_TYPE.BOND): 1,  # 上海 原始数据3位小数，债券需要3位小数
+}
+
+
+class EXEC_TYPE(Enum):  # 逐笔成交的执行类型
+    TRADE = 0  # 成交：深圳F；上海逐笔成交(内外盘标志B/S/N)均为成交
+    CANCEL = 1  # 撤单：深圳4
+
+
+def _byte_lut(mapping):
+    """原始字节(委托方向/委托类型/执行类型)到内部枚举的查找表，非法值为None"""
+    lut = [None] * 256
+    for k, v in mapping.items():
+        lut[ord(k)] = v
+    return lut
+
+
+SIDE_LUT = {
+    SecurityIDSource_SZSE: _byte_lut(
+        {"1": SIDE.BID, "2": SIDE.ASK, "G": SIDE.UNKNOWN, "F": SIDE.UNKNOWN}
+    ),  # G=借入 F=出借
+    SecurityIDSource_SSE: _byte_lut({"B": SIDE.BID, "S": SIDE.ASK}),
+}
+ORDTYPE_LUT = {
+    SecurityIDSource_SZSE: _byte_lut(
+        {"1": TYPE.MARKET, "2": TYPE.LIMIT, "U": TYPE.SIDE}
+    ),
+    SecurityIDSource_SSE: _byte_lut(
+        {"A": TYPE.LIMIT, "D": TYPE.UNKNOWN}
+    ),  # A=新增 D=删除(撤单)
+}
+EXECTYPE_LUT = {
+    SecurityIDSource_SZSE: _byte_lut({"F": EXEC_TYPE.TRADE, "4": EXEC_TYPE.CANCEL}),
+    SecurityIDSource_SSE: _byte_lut(
+        {"B": EXEC_TYPE.TRADE, "S": EXEC_TYPE.TRADE, "N": EXEC_TYPE.TRADE}
+    ),
+}
+NULL_LUT = [None] * 256
+
+
+class msg_decoder:
+    """
+    逐笔原始字段解码：按(交易所, 证券类型)预先选好查找表与价格精度转换系数，
+    替代逐条比较Side_str/Type_str/ExecType_str及按交易所、证券类型分支
+    """
+
+    __slots__ = [
+        "SecurityIDSource",
+        "side_lut",
+        "ordtype_lut",
+        "exectype_lut",
+        "price_rd",  # 原始精度//price_rd=内部精度，None=不支持
+    ]
+
+    def __init__(self, SecurityIDSource, instrument_type: INSTRUMENT_TYPE):
+        self.SecurityIDSource = SecurityIDSource
+        self.side_lut = SIDE_LUT.get(SecurityIDSource, NULL_LUT)
+        self.ordtype_lut = ORDTYPE_LUT.get(SecurityIDSource, NULL_LUT)
+        self.exectype_lut = EXECTYPE_LUT.get(SecurityIDSource, NULL_LUT)
+        self.price_rd = PRICE_RD.get((SecurityIDSource, instrument_type))
+
+    def side(self, order: axsbe_order):
+        return self.side_of(order.Side)
+
+    def ordtype(self, order: axsbe_order):
+        return self.ordtype_of(order.OrdType)
+
+    def exectype(self, exec: axsbe_exe):
+        return self.exectype_of(exec.ExecType)
+
+    def side_of(self, Side):
+        """同side，参数为原始字段值，供批量入口不经消息对象解码"""
+        side = self.side_lut[Side]
+        if side is None:
+            raise RuntimeError(
+                f"非法委托方向:{Side} SecurityIDSource={self.SecurityIDSource}"
+            )
+        return side
+
+    def ordtype_of(self, OrdType):
+        type = self.ordtype_lut[OrdType]
+        if type is None:
+            raise RuntimeError(
+                f"非法委托类型:{OrdType} SecurityIDSource={self.SecurityIDSource}"
+            )
+        return type
+
+    def exectype_of(self, ExecType):
+        type = self.exectype_lut[ExecType]
+        if type is None:
+            raise RuntimeError(
+                f"非法执行类型:{ExecType} SecurityIDSource={self.SecurityIDSource}"
+            )
+        return type
+
+
+msg_decoders = {}  # (SecurityIDSource, instrument_type) : msg_decoder
+
+
+def get_msg_decoder(SecurityIDSource, instrument_type: INSTRUMENT_TYPE):
+    key = (SecurityIDSource, instrument_type)
+    decoder = msg_decoders.get(key)
+    if decoder is None:
+        decoder = msg_decoders[key] = msg_decoder(SecurityIDSource, instrument_type)
+    return decoder
+
+
+# 内部精度*SNAP_PRICE_RD=快照价格精度
+SNAP_PRICE_RD = {
+    (SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK): msg_util.PRICE_SZSE_SNAP_PRECISION
+    // PRICE_INTER_STOCK_PRECISION,  # 内部2位，输出6位
+    (SecurityIDSource_SZSE, INSTRUMENT_TYPE.FUND): msg_util.PRICE_SZSE_SNAP_PRECISION
+    // PRICE_INTER_FUND_PRECISION,  # 内部3位，输出6位
+    (SecurityIDSource_SZSE, INSTRUMENT_TYPE.KZZ): msg_util.PRICE_SZSE_SNAP_PRECISION
+    // PRICE_INTER_KZZ_PRECISION,  # 内部3位，输出6位
+    (SecurityIDSource_SSE, INSTRUMENT_TYPE.STOCK): msg_util.PRICE_SSE_PRECISION
+    // PRICE_INTER_STOCK_PRECISION,  # 内部2位，输出3位
+    (SecurityIDSource_SSE, INSTRUMENT_TYPE.FUND): msg_util.PRICE_SSE_PRECISION
+    // PRICE_INTER_FUND_PRECISION,  # 内部3位，输出3位
+}
+
+# 内部精度*PRECLOSE_RD=快照昨收精度；0=快照不带昨收
+PRECLOSE_RD = {
+    (SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK): msg_util.PRICE_SZSE_SNAP_PRECLOSE_PRECISION
+    // PRICE_INTER_STOCK_PRECISION,  # 深圳昨收4位小数
+    (SecurityIDSource_SZSE, INSTRUMENT_TYPE.FUND): msg_util.PRICE_SZSE_SNAP_PRECLOSE_PRECISION
+    // PRICE_INTER_FUND_PRECISION,
+    (SecurityIDSource_SZSE, INSTRUMENT_TYPE.KZZ): msg_util.PRICE_SZSE_SNAP_PRECLOSE_PRECISION
+    // PRICE_INTER_KZZ_PRECISION,
+    (SecurityIDSource_SSE, INSTRUMENT_TYPE.STOCK): msg_util.PRICE_SSE_PRECISION
+    // PRICE_INTER_STOCK_PRECISION,
+    (SecurityIDSource_SSE, INSTRUMENT_TYPE.FUND): msg_util.PRICE_SSE_PRECISION
+    // PRICE_INTER_FUND_PRECISION,
+    (SecurityIDSource_SSE, INSTRUMENT_TYPE.BOND): 0,  # 上海债券快照没有带昨收！
+}
+
+# LastQty*LastPx/VALUE_RD=TotalValueTrade精度
+VALUE_RD = {
+    (SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK): QTY_INTER_SZSE_PRECISION
+    * PRICE_INTER_STOCK_PRECISION
+    // msg_util.TOTALVALUETRADE_SZSE_PRECISION,  # 2x2->4
+    (SecurityIDSource_SZSE, INSTRUMENT_TYPE.FUND): QTY_INTER_SZSE_PRECISION
+    * PRICE_INTER_FUND_PRECISION
+    // msg_util.TOTALVALUETRADE_SZSE_PRECISION,  # 2x3->4
+    (SecurityIDSource_SZSE, INSTRUMENT_TYPE.KZZ): QTY_INTER_SZSE_PRECISION
+    * PRICE_INTER_KZZ_PRECISION
+    // msg_util.TOTALVALUETRADE_SZSE_PRECISION,  # 2x3->4
+    (SecurityIDSource_SSE, INSTRUMENT_TYPE.STOCK): QTY_INTER_SSE_PRECISION
+    * PRICE_INTER_STOCK_PRECISION
+    // msg_util.TOTALVALUETRADE_SSE_PRECISION,  # 3x2->5
+    (SecurityIDSource_SSE, INSTRUMENT_TYPE.FUND): QTY_INTER_SSE_PRECISION
+    * PRICE_INTER_FUND_PRECISION
+    // msg_util.TOTALVALUETRADE_SSE_PRECISION,  # 3x3->5
+}
+
+
+class px_converter:
+    """
+    价格/金额/时戳换算：按(交易所, 证券类型)预先选好系数及换算函数，由AXOB构造时绑定，
+    替代逐条消息按SecurityIDSource×instrument_type分支选精度
+    """
+
+    __slots__ = [
+        "SecurityIDSource",
+        "instrument_type",
+        "price_rd",  # 逐笔价格：原始精度//price_rd=内部精度，None=不支持
+        "cancel_price_rd",  # 逐笔撤单价格：同price_rd；0=撤单不带价格(深圳)
+        "snap_rd",  # 快照价格：内部精度*snap_rd=快照精度，None=不支持
+        "preclose_rd",  # 快照昨收：内部精度*preclose_rd=快照精度，0=不带昨收，None=不支持
+        "value_rd",  # 成交金额：LastQty*LastPx/value_rd=TotalValueTrade精度，None=不支持
+        "price_out",  # 内部价格->快照价格，不支持时输出None
+        "preclose_out",  # 内部昨收->快照昨收，None=不填 TODO-SSE
+        "tick_in",  # 逐笔时戳->内部时戳(时-分-秒-10ms 或 上交所原样)
+        "tpm_in",  # 逐笔时戳->市场交易阶段，同逐笔消息的TradingPhaseMarket
+        "date_in",  # 快照时戳->日期，上交所不带日期为0
+        "timestamp_out",  # (日期, 内部时戳)->快照时戳
+    ]
+
+    def __init__(self, SecurityIDSource, instrument_type: INSTRUMENT_TYPE):
+        key = (SecurityIDSource, instrument_type)
+        self.SecurityIDSource = SecurityIDSource
+        self.instrument_type = instrument_type
+        self.price_rd = PRICE_RD.get(key)
+        self.snap_rd = SNAP_PRICE_RD.get(key)
+        self.preclose_rd = PRECLOSE_RD.get(key)
+        self.value_rd = VALUE_RD.get(key)
+
+        snap_rd = self.snap_rd
+        if snap_rd is not None:
+            self.price_out = lambda price: price * snap_rd
+        else:
+            self.price_out = lambda price: None
+
+        if SecurityIDSource == SecurityIDSource_SZSE:
+            self.cancel_price_rd = 0  # 深圳撤单不带价格
+            preclose_rd = self.preclose_rd or 1  # TODO: 未支持的类型原样输出
+            self.preclose_out = lambda price: price * preclose_rd
+            self.tick_in = lambda TransactTime: (
+                TransactTime // SZSE_TICK_MS_TAIL % (SZSE_TICK_CUT // SZSE_TICK_MS_TAIL)
+            )  # 只用逐笔 (10ms精度) 15000000 24b
+            self.date_in = lambda TransactTime: TransactTime // SZSE_TICK_CUT  # 深交所带日期
+            self.tpm_in = lambda TransactTime: TPM.at(TransactTime % SZSE_TICK_CUT)
+            self.timestamp_out = lambda YYMMDD, tick: (
+                YYMMDD * SZSE_TICK_CUT + tick * SZSE_TICK_MS_TAIL
+            )  # 深交所显示精度到ms，多补1位
+        else:
+            self.cancel_price_rd = self.price_rd
+            self.preclose_out = None  # TODO-SSE
+            self.tick_in = lambda TransactTime: TransactTime  # 上交所(1ms精度) 150000000
+            self.date_in = lambda TransactTime: 0  # 上交所不带日期
+            if instrument_type in (
+                INSTRUMENT_TYPE.BOND,
+                INSTRUMENT_TYPE.KZZ,
+                INSTRUMENT_TYPE.NHG,
+            ):
+                self.timestamp_out = lambda YYMMDD, tick: tick  # 债券精确到ms
+                self.tpm_in = TPM.at  # 债券逐笔精度ms
+            else:
+                self.timestamp_out = (
+                    lambda YYMMDD, tick: tick // 100
+                )  # 上交所只显示到秒，去掉10ms和100ms两位
+                self.tpm_in = lambda TransactTime: TPM.at(TransactTime * 10)  # 股票逐笔精度10ms
+
+    def preclose_in(self, PrevClosePx):
+        """快照昨收->内部精度"""
+        if self.preclose_rd is None:
+            raise Exception(
+                f"SecurityIDSource={self.SecurityIDSource} instrument_type={self.instrument_type} is not ready!"
+            )  # TODO:
+        if self.preclose_rd == 0:
+            return 0
+        return PrevClosePx // self.preclose_rd
+
+
+px_converters = {}  # (SecurityIDSource, instrument_type) : px_converter
+
+
+def get_px_converter(SecurityIDSource, instrument_type: INSTRUMENT_TYPE):
+    key = (SecurityIDSource, instrument_type)
+    conv = px_converters.get(key)
+    if conv is None:
+        conv = px_converters[key] = px_converter(SecurityIDSource, instrument_type)
+    return conv
+
 
 class ob_order:
     """专注于内部使用的字段格式与位宽"""
@@ -120,132 +384,125 @@ class ob_order:
         "TransactTime",
     ]
 
-    def __init__(self, order: axsbe_order, instrument_type: INSTRUMENT_TYPE):
-        # self.securityID = order.SecurityID
-        self.applSeqNum = order.ApplSeqNum
+    def __init__(
+        self,
+        order: axsbe_order,
+        instrument_type: INSTRUMENT_TYPE,
+        decoder: msg_decoder = None,
+    ):
+        """decoder: 由AXOB预先构造；为None时按消息的交易所查找"""
+        if decoder is None:
+            decoder = get_msg_decoder(order.SecurityIDSource, instrument_type)
+        self._load(
+            decoder,
+            instrument_type,
+            order.SecurityID,
+            order.ApplSeqNum,
+            order.Price,
+            order.OrderQty,
+            order.Side,
+            order.OrdType,
+            order.TransactTime,
+        )
 
-        if order.Side_str == "买入":
-            self.side = SIDE.BID
-        elif order.Side_str == "卖出":
-            self.side = SIDE.ASK
-        else:
-            """TODO-SSE"""
-            self.side = SIDE.UNKNOWN
-
-        if order.Type_str == "限价":  # SZ
-            self.type = TYPE.LIMIT
-        elif order.Type_str == "市价":  # SZ
-            self.type = TYPE.MARKET
-        elif order.Type_str == "本方最优":  # SZ
-            self.type = TYPE.SIDE
-        elif order.Type_str == "新增":  # SH
-            self.type = TYPE.LIMIT
-        else:
-            self.type = TYPE.UNKNOWN
+    @classmethod
+    def of_row(
+        cls,
+        decoder: msg_decoder,
+        instrument_type: INSTRUMENT_TYPE,
+        SecurityID,
+        ApplSeqNum,
+        Price,
+        OrderQty,
+        Side,
+        OrdType,
+        TransactTime,
+    ):
+        """由逐笔委托的原始字段构造，不经消息对象，见AXOB.onOrderRow"""
+        self = cls.__new__(cls)
+        self._load(
+            decoder,
+            instrument_type,
+            SecurityID,
+            ApplSeqNum,
+            Price,
+            OrderQty,
+            Side,
+            OrdType,
+            TransactTime,
+        )
+        return self
 
-        if (
-            order.Price == msg_util.ORDER_PRICE_OVERFLOW
-        ):  # 原始价格越界 (不用管是否是LIMIT)
+    def _load(
+        self,
+        decoder,
+        instrument_type,
+        SecurityID,
+        ApplSeqNum,
+        Price,
+        OrderQty,
+        Side,
+        OrdType,
+        TransactTime,
+    ):
+        # self.securityID = SecurityID
+        self.applSeqNum = ApplSeqNum
+
+        self.side = decoder.side_of(Side)  # 借入/出借为UNKNOWN TODO-SSE
+        self.type = decoder.ordtype_of(OrdType)  # 上海删除为UNKNOWN
+
+        if Price == msg_util.ORDER_PRICE_OVERFLOW:  # 原始价格越界 (不用管是否是LIMIT)
             self.price = (
                 PRICE_MAXIMUM  # 本地也按越界处理，本地越界最终只影响到卖出加权价的计算
             )
             axob_logger.warn(
-                f"{order.SecurityID:06d} order ApplSeqNum={order.ApplSeqNum} Price over the maximum!"
+                f"{SecurityID:06d} order ApplSeqNum={ApplSeqNum} Price over the maximum!"
             )
             assert not (
                 self.side == SIDE.BID and self.type == TYPE.LIMIT
-            ), f"{order.SecurityID:06d} BID order price overflow"  # 限价买单不应溢出
+            ), f"{SecurityID:06d} BID order price overflow"  # 限价买单不应溢出
+        elif decoder.price_rd is not None:
+            self.price = Price // decoder.price_rd
+        elif decoder.SecurityIDSource in (SecurityIDSource_SZSE, SecurityIDSource_SSE):
+            axob_logger.error(
+                f"order SecurityIDSource={decoder.SecurityIDSource} ApplSeqNum={ApplSeqNum} instrument_type={instrument_type} not support!"
+            )
         else:
-            if order.SecurityIDSource == SecurityIDSource_SZSE:
-                if instrument_type == INSTRUMENT_TYPE.STOCK:
-                    self.price = (
-                        order.Price // SZSE_STOCK_PRICE_RD
-                    )  # 深圳 N13(4)，实际股票精度为分
-                elif instrument_type == INSTRUMENT_TYPE.FUND:
-                    self.price = (
-                        order.Price // SZSE_FUND_PRICE_RD
-                    )  # 深圳 N13(4)，实际基金精度为厘
-                elif instrument_type == INSTRUMENT_TYPE.KZZ:
-                    self.price = (
-                        order.Price // SZSE_KZZ_PRICE_RD
-                    )  # 深圳 N13(4)，实际基金精度为厘
-                else:
-                    axob_logger.error(
-                        f"order SZSE ApplSeqNum={order.ApplSeqNum} instrument_type={instrument_type} not support!"
-                    )
-            elif order.SecurityIDSource == SecurityIDSource_SSE:
-                if instrument_type == INSTRUMENT_TYPE.STOCK:
-                    self.price = (
-                        order.Price // SSE_STOCK_PRICE_RD
-                    )  # 上海 原始数据3位小数
-                elif instrument_type == INSTRUMENT_TYPE.BOND:
-                    self.price = order.Price  # 上海 原始数据3位小数，债券需要3位小数
-                else:
-                    axob_logger.error(
-                        f"order SSE ApplSeqNum={order.ApplSeqNum} instrument_type={instrument_type} not support!"
-                    )
-            else:
-                self.price = 0
+            self.price = 0
         self.traded = False  # 仅用于测试：市价单，当有成交后，市价单的价格将确定
         self.TransactTime = (
-            order.TransactTime
+            TransactTime
         )  # 仅用于测试：市价单，当有后续消息来而导致插入订单簿时，生成的订单簿用此时戳
 
-        self.qty = order.OrderQty  # 深圳2位小数;上海3位小数
+        self.qty = OrderQty  # 深圳2位小数;上海3位小数
 
         ## 位宽及精度舍入可行性检查
         if (
             self.applSeqNum >= (1 << APPSEQ_BIT_SIZE)
             and self.applSeqNum != 0xFFFFFFFFFFFFFFFF
         ):
-            axob_logger.error(
-                f"{order.SecurityID:06d} order ApplSeqNum={order.ApplSeqNum} ovf!"
-            )
+            axob_logger.error(f"{SecurityID:06d} order ApplSeqNum={ApplSeqNum} ovf!")
 
         if self.price >= (1 << PRICE_BIT_SIZE):
             self.price = (1 << PRICE_BIT_SIZE) - 1
             axob_logger.error(
-                f"{order.SecurityID:06d} order ApplSeqNum={order.ApplSeqNum} Price={order.Price} ovf!"
+                f"{SecurityID:06d} order ApplSeqNum={ApplSeqNum} Price={Price} ovf!"
             )  # 无涨跌停价时可能，即使限价单也可能溢出，且会被前端处理成0x7fff_ffff
 
         if self.qty >= (1 << QTY_BIT_SIZE):
             axob_logger.error(
-                f"{order.SecurityID:06d} order ApplSeqNum={order.ApplSeqNum} Volumn={order.OrderQty} ovf!"
+                f"{SecurityID:06d} order ApplSeqNum={ApplSeqNum} Volumn={OrderQty} ovf!"
             )
 
         if (
-            self.type == TYPE.LIMIT and order.Price != msg_util.ORDER_PRICE_OVERFLOW
+            self.type == TYPE.LIMIT
+            and Price != msg_util.ORDER_PRICE_OVERFLOW
+            and decoder.price_rd
+            and Price % decoder.price_rd
         ):  # 检查限价单价格是否溢出；市价单价格是无效值，不可参与检查
-            if order.SecurityIDSource == SecurityIDSource_SZSE:
-                if (
-                    instrument_type == INSTRUMENT_TYPE.STOCK
-                    and order.Price % SZSE_STOCK_PRICE_RD
-                ):
-                    axob_logger.error(
-                        f"{order.SecurityID:06d} order SZSE STOCK ApplSeqNum={order.ApplSeqNum} Price={order.Price} precision dnf!"
-                    )  # 当被前端处理成0x7fff_ffff时 会有余数
-                elif (
-                    instrument_type == INSTRUMENT_TYPE.FUND
-                    and order.Price % SZSE_FUND_PRICE_RD
-                ):
-                    axob_logger.error(
-                        f"{order.SecurityID:06d} order SZSE FUND ApplSeqNum={order.ApplSeqNum} Price={order.Price} precision dnf!"
-                    )  # 当被前端处理成0x7fff_ffff时 会有余数
-                elif (
-                    instrument_type == INSTRUMENT_TYPE.KZZ
-                    and order.Price % SZSE_KZZ_PRICE_RD
-                ):
-                    axob_logger.error(
-                        f"{order.SecurityID:06d} order SZSE KZZ ApplSeqNum={order.ApplSeqNum} Price={order.Price} precision dnf!"
-                    )  # 当被前端处理成0x7fff_ffff时 会有余数
-            elif order.SecurityIDSource == SecurityIDSource_SSE:
-                if (
-                    instrument_type == INSTRUMENT_TYPE.STOCK
-                    and order.Price % SSE_STOCK_PRICE_RD
-                ):
-                    axob_logger.error(
-                        f"{order.SecurityID:06d} order SSE STOCK ApplSeqNum={order.ApplSeqNum} Price={order.Price} precision dnf!"
-                    )
+            axob_logger.error(
+                f"{SecurityID:06d} order SecurityIDSource={decoder.SecurityIDSource} instrument_type={instrument_type} ApplSeqNum={ApplSeqNum} Price={Price} precision dnf!"
+            )  # 当被前端处理成0x7fff_ffff时 会有余数
 
     def save(self):
         """save/load 用于保存/加载测试时刻"""
@@ -260,6 +517,651 @@ class ob_order:
             setattr(self, attr, data[attr])
 
 
+## 订单容器(order_map)：保持dict风格的接口(in/[]/pop/len/迭代)，以applSeqNum作为索引
+class ORDER_STORE_TYPE(Enum):
+    DICT = 0  # dict of ob_order，约300字节/订单
+    ARRAY = 1  # 按列存储的订单表，约38字节/订单，回放比DICT慢约10%；默认，委托队列(L3)需此实现
+    CHANNEL = 2  # 同一通道的AXOB共用一张按ApplSeqNum下标的订单表，由MU分配，见channel_order_table
+
+
+class ORDER_DELTA_OP:  # 增量检查点中订单的变化类型
+    REMOVE = -1  # 出簿
+    UPDATE = 0  # 就地修改数量/价格/成交标志，委托队列位置不变
+    INSERT = 1  # 新增，或重新入列到队尾
+
+
+class order_dict(dict):
+    """DICT订单容器：dict of ob_order，另提供同order_table的fill/remove"""
+
+    __slots__ = []
+
+    def fill(self, applSeqNum, qty):
+        """成交：扣减剩余数量，全部成交时出簿；返回(价格, 剩余数量)，不在簿时返回None"""
+        order = self.get(applSeqNum)
+        if order is None:
+            return None
+        order.qty -= qty
+        if order.qty <= 0:
+            del self[applSeqNum]
+        return order.price, order.qty
+
+    def remove(self, applSeqNum):
+        """撤单：出簿并返回价格，不在簿时返回None"""
+        order = self.pop(applSeqNum, None)
+        return None if order is None else order.price
+
+
+class order_slot:
+    """
+    订单表中一个槽位的临时视图，接口同ob_order(字段/save)
+    由[]/pop/queue/items按需创建，不随订单保存；订单表在插入时可能整理槽位，视图不宜跨插入持有
+    """
+
+    __slots__ = ["table", "i"]
+
+    def __init__(self, table, i):
+        self.table = table
+        self.i = i
+
+    @property
+    def applSeqNum(self):
+        return self.table.applSeqNums[self.i]
+
+    @property
+    def price(self):
+        return self.table.prices[self.i]
+
+    @price.setter
+    def price(self, price):
+        self.table.prices[self.i] = price
+
+    @property
+    def qty(self):
+        return self.table.qtys[self.i]
+
+    @qty.setter
+    def qty(self, qty):
+        self.table.qtys[self.i] = qty
+
+    @property
+    def side(self):
+        return SIDE_OF_VALUE[self.table.sides[self.i]]
+
+    @property
+    def type(self):
+        return TYPE_OF_VALUE[self.table.types[self.i]]
+
+    @property
+    def traded(self):
+        return bool(self.table.traded[self.i])
+
+    @traded.setter
+    def traded(self, traded):
+        self.table.traded[self.i] = traded
+
+    @property
+    def TransactTime(self):
+        return self.table.TransactTimes[self.i]
+
+    def save(self):
+        """save/load 用于保存/加载测试时刻，格式同ob_order"""
+        return {
+            "applSeqNum": self.applSeqNum,
+            "price": self.price,
+            "qty": self.qty,
+            "side": self.side,
+            "type": self.type,
+            "traded": self.traded,
+            "TransactTime": self.TransactTime,
+        }
+
+
+ORDER_TABLE_COLUMNS = (  # order_table的列，(属性名, typecode)
+    ("applSeqNums", "Q"),
+    ("prices", "q"),
+    ("qtys", "q"),
+    ("sides", "b"),
+    ("types", "b"),
+    ("traded", "b"),
+    ("TransactTimes", "q"),
+)
+ORDER_TABLE_COMPACT_MIN = 64  # 空槽位不少于此数且多于在簿订单数时整理
+
+
+class order_table:
+    """
+    按列存储的订单表，不为每笔订单建Python对象，约36字节/订单(DICT约300字节)：
+      * 各字段存于平行的定长整数数组(ORDER_TABLE_COLUMNS)，下标为槽位号
+      * 槽位按插入顺序追加；同一标的的ApplSeqNum递增到达，applSeqNums列有序，二分查找定位，不另建索引；
+        逆序到达的订单插入到有序位置(少见，O(N))
+      * 出簿只清live标志，空槽位多于在簿订单时在下一次追加前压缩各列，均摊O(1)
+      * 成交/撤单经fill/remove直接读写各列；[]/pop/queue/items返回临时视图(order_slot)
+      * level_queue: 价格档委托队列(L3)，同一(方向,价格)的订单按到达顺序串成侵入式双向链表，
+        入列追加到队尾、撤单/成交从链中摘除均为O(1)；链接存于prevs/nexts(仅L3分配)，队首尾存于queues
+    """
+
+    __slots__ = [
+        "n",  # 在簿订单数
+        "live",  # 各槽位是否在簿
+        "applSeqNums",
+        "prices",
+        "qtys",
+        "sides",
+        "types",
+        "traded",
+        "TransactTimes",
+        "level_queue",
+        "prevs",  # 同档前一订单的槽位号，-1=队首
+        "nexts",  # 同档后一订单的槽位号，-1=队尾
+        "queues",  # (side, price) : [队首槽位号, 队尾槽位号]
+    ]
+
+    def __init__(self, level_queue=False):
+        self.level_queue = level_queue
+        self.n = 0
+        self.live = bytearray()
+        for name, typecode in ORDER_TABLE_COLUMNS:
+            setattr(self, name, array(typecode))
+        self.prevs = array("l")
+        self.nexts = array("l")
+        self.queues = {}
+
+    def _find(self, applSeqNum):
+        """在簿订单的槽位号，不在簿时返回-1"""
+        applSeqNums = self.applSeqNums
+        i = bisect_left(applSeqNums, applSeqNum)
+        if i < len(applSeqNums) and applSeqNums[i] == applSeqNum and self.live[i]:
+            return i
+        return -1
+
+    def __len__(self):
+        return self.n
+
+    def __contains__(self, applSeqNum):
+        return self._find(applSeqNum) >= 0
+
+    def __iter__(self):
+        return compress(self.applSeqNums, self.live)
+
+    def __getitem__(self, applSeqNum):
+        i = self._find(applSeqNum)
+        if i < 0:
+            raise KeyError(applSeqNum)
+        return order_slot(self, i)
+
+    def __setitem__(self, applSeqNum, order):
+        applSeqNums = self.applSeqNums
+        if applSeqNums and applSeqNum <= applSeqNums[-1]:
+            i = bisect_left(applSeqNums, applSeqNum)
+            if applSeqNums[i] != applSeqNum:  # 逆序到达
+                self._insertSlot(i)
+                applSeqNums[i] = applSeqNum
+            elif self.live[i]:  # 在簿：改写，委托队列中移到队尾
+                if self.level_queue:
+                    self._unlink(i)
+                self.n -= 1
+            self.live[i] = 1
+            self.prices[i] = order.price
+            self.qtys[i] = order.qty
+            self.sides[i] = order.side.value
+            self.types[i] = order.type.value
+            self.traded[i] = order.traded
+            self.TransactTimes[i] = order.TransactTime
+        else:  # 追加
+            if len(applSeqNums) - self.n >= max(self.n, ORDER_TABLE_COMPACT_MIN):
+                self._compact()
+            i = len(self.live)
+            self.live.append(1)
+            self.applSeqNums.append(applSeqNum)
+            self.prices.append(order.price)
+            self.qtys.append(order.qty)
+            self.sides.append(order.side.value)
+            self.types.append(order.type.value)
+            self.traded.append(order.traded)
+            self.TransactTimes.append(order.TransactTime)
+            if self.level_queue:
+                self.prevs.append(-1)
+                self.nexts.append(-1)
+        self.n += 1
+        if self.level_queue:
+            self._enqueue(i)
+
+    def _insertSlot(self, i):
+        """在i处插入空槽位，i及之后的槽位号加1"""
+        for name, _ in ORDER_TABLE_COLUMNS:
+            getattr(self, name).insert(i, 0)
+        self.live.insert(i, 0)
+        if self.level_queue:
+            shift = lambda j: j + 1 if j >= i else j
+            self.prevs = array("l", map(shift, self.prevs))
+            self.nexts = array("l", map(shift, self.nexts))
+            self.prevs.insert(i, -1)
+            self.nexts.insert(i, -1)
+            for q in self.queues.values():
+                q[0] = shift(q[0])
+                q[1] = shift(q[1])
+
+    def _compact(self):
+        """去掉空槽位，在簿订单的先后不变"""
+        live = self.live
+        if self.level_queue:
+            remap = array("l", [-1]) * (len(live) + 1)  # remap[-1]为-1
+            for j, i in enumerate(compress(range(len(live)), live)):
+                remap[i] = j
+            self.prevs = array("l", [remap[x] for x in compress(self.prevs, live)])
+            self.nexts = array("l", [remap[x] for x in compress(self.nexts, live)])
+            for q in self.queues.values():
+                q[0] = remap[q[0]]
+                q[1] = remap[q[1]]
+        for name, typecode in ORDER_TABLE_COLUMNS:
+            setattr(self, name, array(typecode, compress(getattr(self, name), live)))
+        self.live = bytearray(b"\x01") * self.n
+
+    def _remove(self, i):
+        self.live[i] = 0
+        self.n -= 1
+        if self.level_queue:
+            self._unlink(i)
+
+    def pop(self, applSeqNum):
+        i = self._find(applSeqNum)
+        if i < 0:
+            raise KeyError(applSeqNum)
+        self._remove(i)
+        return order_slot(self, i)
+
+    def fill(self, applSeqNum, qty):
+        """成交：扣减剩余数量，全部成交时出簿；返回(价格, 剩余数量)，不在簿时返回None"""
+        i = self._find(applSeqNum)
+        if i < 0:
+            return None
+        qty = self.qtys[i] - qty
+        self.qtys[i] = qty
+        if qty <= 0:
+            self._remove(i)
+        return self.prices[i], qty
+
+    def remove(self, applSeqNum):
+        """撤单：出簿并返回价格，不在簿时返回None"""
+        i = self._find(applSeqNum)
+        if i < 0:
+            return None
+        self._remove(i)
+        return self.prices[i]
+
+    def _enqueue(self, i):
+        """追加到所在价格档的队尾"""
+        key = (self.sides[i], self.prices[i])
+        q = self.queues.get(key)
+        self.nexts[i] = -1
+        if q is None:
+            self.prevs[i] = -1
+            self.queues[key] = [i, i]
+        else:
+            self.prevs[i] = q[1]
+            self.nexts[q[1]] = i
+            q[1] = i
+
+    def _unlink(self, i):
+        """从所在价格档的队列中摘除，成交时通常为队首"""
+        prev = self.prevs[i]
+        next = self.nexts[i]
+        if prev < 0 or next < 0:
+            key = (self.sides[i], self.prices[i])
+            q = self.queues[key]
+            if prev < 0 and next < 0:
+                del self.queues[key]
+            elif prev < 0:
+                q[0] = next
+            else:
+                q[1] = prev
+        if prev >= 0:
+            self.nexts[prev] = next
+        if next >= 0:
+            self.prevs[next] = prev
+
+    def queue(self, side, price, order_nb=None):
+        """价格档委托队列的前order_nb个订单(order_slot)，按到达顺序；order_nb=None时返回全部"""
+        q = self.queues.get((side.value, price))
+        i = -1 if q is None else q[0]
+        orders = []
+        while i >= 0 and (order_nb is None or len(orders) < order_nb):
+            orders.append(order_slot(self, i))
+            i = self.nexts[i]
+        return orders
+
+    def items(self):
+        applSeqNums = self.applSeqNums
+        for i in compress(range(len(applSeqNums)), self.live):
+            yield applSeqNums[i], order_slot(self, i)
+
+    def values(self):
+        for i in compress(range(len(self.live)), self.live):
+            yield order_slot(self, i)
+
+    def image(self):
+        """整表的列数组(先去掉空槽位，含委托队列链接)，供全量检查点直接写出，见from_image"""
+        if self.n != len(self.live):
+            self._compact()
+        q_sides = array("b")
+        q_prices = array("q")
+        q_heads = array("l")
+        q_tails = array("l")
+        for (side, price), (head, tail) in self.queues.items():
+            q_sides.append(side)
+            q_prices.append(price)
+            q_heads.append(head)
+            q_tails.append(tail)
+        return [getattr(self, name) for name, _ in ORDER_TABLE_COLUMNS] + [
+            self.prevs,
+            self.nexts,
+            q_sides,
+            q_prices,
+            q_heads,
+            q_tails,
+        ]
+
+    @classmethod
+    def from_image(cls, arrays, level_queue=False):
+        t = cls(level_queue)
+        nb = len(ORDER_TABLE_COLUMNS)
+        for (name, _), v in zip(ORDER_TABLE_COLUMNS, arrays[:nb]):
+            setattr(t, name, v)
+        t.n = len(t.applSeqNums)
+        t.live = bytearray(b"\x01") * t.n
+        if level_queue:
+            prevs, nexts, q_sides, q_prices, q_heads, q_tails = arrays[nb:]
+            if len(prevs) == t.n:
+                t.prevs = prevs
+                t.nexts = nexts
+                t.queues = {
+                    (side, price): [head, tail]
+                    for side, price, head, tail in zip(q_sides, q_prices, q_heads, q_tails)
+                }
+            else:  # 不含委托队列的表(如由DICT转换)，按到达顺序重建
+                t.prevs = array("l", [-1]) * t.n
+                t.nexts = array("l", [-1]) * t.n
+                for i in range(t.n):
+                    t._enqueue(i)
+        return t
+
+
+ORDER_IMAGE_NB = len(ORDER_TABLE_COLUMNS) + 6  # order_table.image的数组个数
+
+
+def order_map_image(order_map):
+    """订单容器转为order_table.image格式；dict按迭代顺序逐个写入"""
+    if isinstance(order_map, order_table):
+        return order_map.image()
+    t = order_table()
+    for applSeqNum, order in order_map.items():
+        t[applSeqNum] = order
+    return t.image()
+
+
+def order_map_from_image(
+    arrays, store_type: ORDER_STORE_TYPE = ORDER_STORE_TYPE.ARRAY, level_queue=False
+):
+    if store_type == ORDER_STORE_TYPE.ARRAY:
+        return order_table.from_image(arrays, level_queue)
+    order_map = new_order_map(store_type, level_queue)
+    t = order_table.from_image(arrays)
+    for applSeqNum, order in t.items():
+        order_map[applSeqNum] = order_from_slot(order)
+    return order_map
+
+
+def order_from_slot(slot: order_slot):
+    """按槽位内容构造独立的ob_order，不经__init__解码"""
+    order = ob_order.__new__(ob_order)
+    order.applSeqNum = slot.applSeqNum
+    order.price = slot.price
+    order.qty = slot.qty
+    order.side = slot.side
+    order.type = slot.type
+    order.traded = slot.traded
+    order.TransactTime = slot.TransactTime
+    return order
+
+
+CHANNEL_PAGE_BITS = 10  # 通道订单表按页分配，每页1024个ApplSeqNum
+CHANNEL_PAGE_MASK = (1 << CHANNEL_PAGE_BITS) - 1
+
+
+class channel_order_page:
+    """
+    通道订单表的一页：连续1<<CHANNEL_PAGE_BITS个ApplSeqNum的列数组，下标 = applSeqNum - base
+    字段接口同order_table，供order_slot访问
+    """
+
+    __slots__ = [
+        "base",  # 下标0对应的applSeqNum
+        "live",  # 页内在簿订单数，为0时整页释放
+        "owners",  # 所属标的在通道内的编号(security slot)，-1=空闲
+        "prices",
+        "qtys",
+        "sides",
+        "types",
+        "traded",
+        "TransactTimes",
+        "prevs",  # 同一标的前一订单的applSeqNum，-1=首个
+        "nexts",  # 同一标的后一订单的applSeqNum，-1=末个
+    ]
+
+    def __init__(self, base):
+        n = 1 << CHANNEL_PAGE_BITS
+        self.base = base
+        self.live = 0
+        self.owners = array("l", [-1]) * n
+        self.prices = array("q", [0]) * n
+        self.qtys = array("q", [0]) * n
+        self.sides = array("b", [0]) * n
+        self.types = array("b", [0]) * n
+        self.traded = array("b", [0]) * n
+        self.TransactTimes = array("q", [0]) * n
+        self.prevs = array("q", [-1]) * n
+        self.nexts = array("q", [-1]) * n
+
+
+class channel_order_table:
+    """
+    通道订单表：深交所ApplSeqNum在通道内稠密递增，同一通道的所有标的共用，
+      * 按页分配(channel_order_page)，页内按applSeqNum直接下标，不需要applSeqNum到槽位的索引
+      * 页内订单全部出簿后整页释放，长期在簿的订单只占住所在的一页
+    """
+
+    __slots__ = [
+        "pages",  # applSeqNum >> CHANNEL_PAGE_BITS : channel_order_page
+    ]
+
+    def __init__(self):
+        self.pages = {}
+
+    def page_of(self, applSeqNum):
+        """为插入定位所在页，没有时新建"""
+        k = applSeqNum >> CHANNEL_PAGE_BITS
+        page = self.pages.get(k)
+        if page is None:
+            page = self.pages[k] = channel_order_page(k << CHANNEL_PAGE_BITS)
+        return page
+
+    def release(self, page, j):
+        """槽位出簿，页内已无订单时释放该页"""
+        page.owners[j] = -1
+        page.live -= 1
+        if not page.live:
+            del self.pages[page.base >> CHANNEL_PAGE_BITS]
+
+
+class channel_order_slot(order_slot):
+    """通道订单表中的一个槽位(table为所在页)，applSeqNum由下标换算"""
+
+    __slots__ = []
+
+    @property
+    def applSeqNum(self):
+        return self.table.base + self.i
+
+
+class channel_order_map:
+    """
+    一只标的在通道订单表中的视图，接口同order_table(不支持level_queue)
+    本标的的订单按插入顺序串成侵入式双向链表(链接存于页内prevs/nexts)，遍历只经过本标的的订单
+    未由MU分配通道订单表时使用私有的一张，attach时把在簿订单搬入共用表
+    """
+
+    __slots__ = [
+        "table",
+        "owner",  # 本标的在通道内的编号
+        "n",  # 在簿订单数
+        "head",  # 首个订单的applSeqNum，-1=无
+        "tail",  # 末个订单的applSeqNum，-1=无
+    ]
+
+    def __init__(self, table=None, owner=0):
+        self.table = channel_order_table() if table is None else table
+        self.owner = owner
+        self.n = 0
+        self.head = -1
+        self.tail = -1
+
+    def attach(self, table, owner):
+        """改用通道共用的订单表，按插入顺序搬入在簿订单"""
+        if table is self.table and owner == self.owner:
+            return
+        orders = [(k, order_from_slot(v)) for k, v in self.items()]
+        self.table = table
+        self.owner = owner
+        self.n = 0
+        self.head = self.tail = -1
+        for k, v in orders:
+            self[k] = v
+
+    def _locate(self, applSeqNum):
+        """本标的的订单所在(页, 下标)；不在簿时页为None"""
+        page = self.table.pages.get(applSeqNum >> CHANNEL_PAGE_BITS)
+        if page is not None:
+            j = applSeqNum & CHANNEL_PAGE_MASK
+            if page.owners[j] == self.owner:
+                return page, j
+        return None, -1
+
+    def __len__(self):
+        return self.n
+
+    def __contains__(self, applSeqNum):
+        return self._locate(applSeqNum)[0] is not None
+
+    def __iter__(self):
+        pages = self.table.pages
+        applSeqNum = self.head
+        while applSeqNum >= 0:
+            next = pages[applSeqNum >> CHANNEL_PAGE_BITS].nexts[applSeqNum & CHANNEL_PAGE_MASK]
+            yield applSeqNum  # 先取出后继，允许出簿当前订单
+            applSeqNum = next
+
+    def __getitem__(self, applSeqNum):
+        page, j = self._locate(applSeqNum)
+        if page is None:
+            raise KeyError(applSeqNum)
+        return channel_order_slot(page, j)
+
+    def __setitem__(self, applSeqNum, order):
+        pages = self.table.pages
+        page = pages.get(applSeqNum >> CHANNEL_PAGE_BITS)
+        if page is None:
+            page = self.table.page_of(applSeqNum)
+        j = applSeqNum & CHANNEL_PAGE_MASK
+        owner = page.owners[j]
+        if owner < 0:  # 新订单追加到链尾
+            page.owners[j] = self.owner
+            page.live += 1
+            self.n += 1
+            tail = self.tail
+            page.prevs[j] = tail
+            page.nexts[j] = -1
+            if tail < 0:
+                self.head = applSeqNum
+            else:
+                pages[tail >> CHANNEL_PAGE_BITS].nexts[tail & CHANNEL_PAGE_MASK] = applSeqNum
+            self.tail = applSeqNum
+        elif owner != self.owner:
+            raise Exception(
+                f"ApplSeqNum={applSeqNum} already owned by security slot {owner} in channel order table"
+            )
+        page.prices[j] = order.price
+        page.qtys[j] = order.qty
+        page.sides[j] = order.side.value
+        page.types[j] = order.type.value
+        page.traded[j] = order.traded
+        page.TransactTimes[j] = order.TransactTime
+
+    def pop(self, applSeqNum):
+        page, j = self._locate(applSeqNum)
+        if page is None:
+            raise KeyError(applSeqNum)
+        self._remove(page, j)
+        return channel_order_slot(page, j)
+
+    def fill(self, applSeqNum, qty):
+        """同order_table.fill"""
+        page, j = self._locate(applSeqNum)
+        if page is None:
+            return None
+        qty = page.qtys[j] - qty
+        page.qtys[j] = qty
+        if qty <= 0:
+            self._remove(page, j)
+        return page.prices[j], qty
+
+    def remove(self, applSeqNum):
+        """同order_table.remove"""
+        page, j = self._locate(applSeqNum)
+        if page is None:
+            return None
+        self._remove(page, j)
+        return page.prices[j]
+
+    def _remove(self, page, j):
+        """从本标的的链表中摘除并归还槽位；页释放后其列数组仍可读"""
+        pages = self.table.pages
+        prev = page.prevs[j]
+        next = page.nexts[j]
+        if prev < 0:
+            self.head = next
+        else:
+            pages[prev >> CHANNEL_PAGE_BITS].nexts[prev & CHANNEL_PAGE_MASK] = next
+        if next < 0:
+            self.tail = prev
+        else:
+            pages[next >> CHANNEL_PAGE_BITS].prevs[next & CHANNEL_PAGE_MASK] = prev
+        self.table.release(page, j)
+        self.n -= 1
+
+    def items(self):
+        for applSeqNum in self:
+            yield applSeqNum, self[applSeqNum]
+
+    def values(self):
+        for applSeqNum in self:
+            yield self[applSeqNum]
+
+
+def new_order_map(
+    store_type: ORDER_STORE_TYPE = ORDER_STORE_TYPE.ARRAY, level_queue=False
+):
+    """level_queue: 维护价格档委托队列(L3)，仅ARRAY支持"""
+    if store_type == ORDER_STORE_TYPE.DICT and not level_queue:
+        return order_dict()
+    if store_type == ORDER_STORE_TYPE.ARRAY:
+        return order_table(level_queue)
+    if store_type == ORDER_STORE_TYPE.CHANNEL and not level_queue:
+        return channel_order_map()
+    raise Exception(
+        f"order store type={store_type} level_queue={level_queue} not support!"
+    )
+
+
 class ob_exec:
     """专注于内部使用的字段格式与位宽"""
 
@@ -273,41 +1175,83 @@ class ob_exec:
         "TransactTime",
     ]
 
-    def __init__(self, exec: axsbe_exe, instrument_type: INSTRUMENT_TYPE):
-        self.BidApplSeqNum = exec.BidApplSeqNum
-        self.OfferApplSeqNum = exec.OfferApplSeqNum
-        self.TradingPhaseMarket = exec.TradingPhaseMarket
-
-        if exec.SecurityIDSource == SecurityIDSource_SZSE:
-            if instrument_type == INSTRUMENT_TYPE.STOCK:
-                self.LastPx = (
-                    exec.LastPx // SZSE_STOCK_PRICE_RD
-                )  # 深圳 N13(4)，实际股票精度为分
-            elif instrument_type == INSTRUMENT_TYPE.FUND:
-                self.LastPx = (
-                    exec.LastPx // SZSE_FUND_PRICE_RD
-                )  # 深圳 N13(4)，实际基金精度为厘
-            elif instrument_type == INSTRUMENT_TYPE.KZZ:
-                self.LastPx = (
-                    exec.LastPx // SZSE_KZZ_PRICE_RD
-                )  # 深圳 N13(4)，实际可转债精度为厘
-            else:
-                axob_logger.error(
-                    f"exec SZSE ApplSeqNum={exec.ApplSeqNum} instrument_type={instrument_type} not support!"
-                )
-        elif exec.SecurityIDSource == SecurityIDSource_SSE:
-            if instrument_type == INSTRUMENT_TYPE.STOCK:
-                self.LastPx = exec.LastPx // SSE_STOCK_PRICE_RD  # 上海 原始数据3位小数
-            else:
-                axob_logger.error(
-                    f"order SSE ApplSeqNum={exec.ApplSeqNum} instrument_type={instrument_type} not support!"
-                )
+    def __init__(
+        self,
+        exec: axsbe_exe,
+        instrument_type: INSTRUMENT_TYPE,
+        decoder: msg_decoder = None,
+    ):
+        """decoder: 由AXOB预先构造；为None时按消息的交易所查找"""
+        if decoder is None:
+            decoder = get_msg_decoder(exec.SecurityIDSource, instrument_type)
+        self._load(
+            decoder,
+            instrument_type,
+            exec.ApplSeqNum,
+            exec.BidApplSeqNum,
+            exec.OfferApplSeqNum,
+            exec.LastPx,
+            exec.LastQty,
+            exec.TransactTime,
+            exec.TradingPhaseMarket,
+        )
+
+    @classmethod
+    def of_row(
+        cls,
+        decoder: msg_decoder,
+        instrument_type: INSTRUMENT_TYPE,
+        ApplSeqNum,
+        BidApplSeqNum,
+        OfferApplSeqNum,
+        LastPx,
+        LastQty,
+        TransactTime,
+        TradingPhaseMarket,
+    ):
+        """由逐笔成交的原始字段构造，不经消息对象，见AXOB.onExecRow"""
+        self = cls.__new__(cls)
+        self._load(
+            decoder,
+            instrument_type,
+            ApplSeqNum,
+            BidApplSeqNum,
+            OfferApplSeqNum,
+            LastPx,
+            LastQty,
+            TransactTime,
+            TradingPhaseMarket,
+        )
+        return self
+
+    def _load(
+        self,
+        decoder,
+        instrument_type,
+        ApplSeqNum,
+        BidApplSeqNum,
+        OfferApplSeqNum,
+        LastPx,
+        LastQty,
+        TransactTime,
+        TradingPhaseMarket,
+    ):
+        self.BidApplSeqNum = BidApplSeqNum
+        self.OfferApplSeqNum = OfferApplSeqNum
+        self.TradingPhaseMarket = TradingPhaseMarket
+
+        if decoder.price_rd is not None:
+            self.LastPx = LastPx // decoder.price_rd
+        elif decoder.SecurityIDSource in (SecurityIDSource_SZSE, SecurityIDSource_SSE):
+            axob_logger.error(
+                f"exec SecurityIDSource={decoder.SecurityIDSource} ApplSeqNum={ApplSeqNum} instrument_type={instrument_type} not support!"
+            )
         else:
             self.LastPx = 0
 
-        self.LastQty = exec.LastQty  # 深圳2位小数;上海3位小数
+        self.LastQty = LastQty  # 深圳2位小数;上海3位小数
 
-        self.TransactTime = exec.TransactTime
+        self.TransactTime = TransactTime
 
         ## 位宽及精度舍入可行性检查
         # 不去检查SeqNum位宽了，SeqNum总能在order list中找到，因此肯定已经检查过了。
@@ -341,21 +1285,20 @@ class ob_cancel:
         SecurityIDSource,
         instrument_type,
         SecurityID,
+        conv: px_converter = None,
     ):
+        """conv: 由AXOB预先构造；为None时按交易所、证券类型查找"""
+        if conv is None:
+            conv = get_px_converter(SecurityIDSource, instrument_type)
         self.applSeqNum = ApplSeqNum  #
         self.qty = Qty
-        if SecurityIDSource == SecurityIDSource_SZSE:
+        if conv.cancel_price_rd:
+            self.price = Price // conv.cancel_price_rd  # 上海 原始数据3位小数
+        elif conv.cancel_price_rd == 0:
             self.price = 0  # 深圳撤单不带价格
-        elif SecurityIDSource == SecurityIDSource_SSE:
-            if instrument_type == INSTRUMENT_TYPE.STOCK:
-                self.price = Price // SSE_STOCK_PRICE_RD  # 上海 原始数据3位小数
-            else:
-                axob_logger.error(
-                    f"{SecurityID:06d} cancel SSE ApplSeqNum={ApplSeqNum} instrument_type={instrument_type} not support!"
-                )
         else:
             axob_logger.error(
-                f"{SecurityID:06d} cancel ApplSeqNum={ApplSeqNum} SecurityIDSource={SecurityIDSource} unknown!"
+                f"{SecurityID:06d} cancel SecurityIDSource={SecurityIDSource} ApplSeqNum={ApplSeqNum} instrument_type={instrument_type} not support!"
             )
         self.side = Side
 
@@ -419,18 +1362,281 @@ class AX_SIGNAL(Enum):  # 发送给AXOB的信号
     ALL_END = 6  # 闭市
 
 
+class SNAP_EMIT(Enum):  # 重建快照的生成时机
+    PER_MSG = 0  # 每条消息处理完都生成，用于验证
+    PER_TICK = 1  # 同一时戳(深交所10ms)内合并，时戳前进或阶段信号时生成一个
+    OFF = 2  # 不生成，只维护订单簿，由query*接口按需读取
+
+
+class VERIFY_POLICY(Enum):  # 逐消息的自检策略，覆盖全簿校验及profile统计
+    FULL = 0  # 每条消息都检查，用于回放回归
+    SAMPLED = 1  # 每interval条消息或每period秒检查一次
+    OFF = 2  # 生产模式，不检查
+
+
+class verifier:
+    """
+    自检采样控制：由AXOB/MU在每条消息处理完后调用due()，决定是否执行自检
+    """
+
+    __slots__ = [
+        "policy",
+        "interval",  # SAMPLED: 消息间隔，0=不按消息数采样
+        "period",  # SAMPLED: 时间间隔(秒)，0=不按时间采样
+        "nb",  # 距上次自检的消息数
+        "t",  # 上次自检的时刻
+    ]
+
+    def __init__(
+        self, policy: VERIFY_POLICY = VERIFY_POLICY.FULL, interval=0, period=0.0
+    ):
+        if policy == VERIFY_POLICY.SAMPLED and not interval and not period:
+            raise Exception("SAMPLED verify policy needs interval or period!")
+        self.policy = policy
+        self.interval = interval
+        self.period = period
+        self.nb = 0
+        self.t = perf_counter()
+
+    def due(self):
+        if self.policy == VERIFY_POLICY.FULL:
+            return True
+        if self.policy == VERIFY_POLICY.OFF:
+            return False
+
+        self.nb += 1
+        if (self.interval and self.nb >= self.interval) or (
+            self.period and perf_counter() - self.t >= self.period
+        ):
+            self.nb = 0
+            self.t = perf_counter()
+            return True
+        return False
+
+    def save(self):
+        """save/load 用于保存/加载测试时刻"""
+        data = {}
+        for attr in self.__slots__:
+            if attr == "t":
+                continue
+            data[attr] = getattr(self, attr)
+        return data
+
+    def load(self, data):
+        for attr in self.__slots__:
+            if attr == "t":
+                continue
+            setattr(self, attr, data[attr])
+        self.t = perf_counter()
+
+
 CHANNELNO_INIT = -1
 
 
+class depth_update:
+    """
+    全档发布的一条输出，价格为快照精度：
+      * full=True: 整簿，sides/prices/qtys为全部价格档(买方从高到低，卖方从低到高)
+      * full=False: 增量，为本条消息变化的价格档，qty=0表示价格档被删除
+      * bid_bound/ask_bound: 价格笼子外的隐藏档边界，买方>=bid_bound、卖方<=ask_bound的档不可见，0=无
+    消费者按seq连续应用即可维护任意深度的镜像
+    """
+
+    __slots__ = [
+        "SecurityID",
+        "seq",  # 从1开始，每个AXOB独立计数
+        "full",
+        "applSeqNum",  # 最近一条逐笔的序号
+        "bid_bound",
+        "ask_bound",
+        "sides",  # array('b'), SIDE.value
+        "prices",  # array('q')
+        "qtys",  # array('q')
+    ]
+
+    def __init__(self, SecurityID, seq, full, applSeqNum, bid_bound, ask_bound):
+        self.SecurityID = SecurityID
+        self.seq = seq
+        self.full = full
+        self.applSeqNum = applSeqNum
+        self.bid_bound = bid_bound
+        self.ask_bound = ask_bound
+        self.sides = array("b")
+        self.prices = array("q")
+        self.qtys = array("q")
+
+    def __str__(self) -> str:
+        s = f"{self.SecurityID:06d} #{self.seq} {'FULL' if self.full else 'DELTA'} @{self.applSeqNum} bound={self.bid_bound}/{self.ask_bound}"
+        for side, price, qty in zip(self.sides, self.prices, self.qtys):
+            s += f" {SIDE(side)}:{price}x{qty}"
+        return s
+
+
+class depth_publisher:
+    """
+    全档发布：首次(及加载后)输出整簿，此后每条消息只输出变化的价格档及笼子边界
+    价格档数量变化时由update记录(同一价格档在一条消息内合并)，publish时生成depth_update
+    输出量只与变化的档数有关，与簿深度无关
+    """
+
+    __slots__ = [
+        "changes",  # (SIDE.value, price) : qty，内部精度
+        "added",  # 本条消息内新建的价格档，其后删除时不必输出
+        "updates",  # 未取走的depth_update
+        "seq",
+        "full_pending",  # 下次publish输出整簿
+        "bid_bound",  # 上次输出的笼子边界，内部精度
+        "ask_bound",
+    ]
+
+    def __init__(self):
+        self.changes = {}
+        self.added = set()
+        self.updates = []
+        self.seq = 0
+        self.full_pending = True
+        self.bid_bound = 0
+        self.ask_bound = 0
+
+    def update(self, side: SIDE, price, qty):
+        """价格档price的数量变为qty，qty=0表示价格档被删除"""
+        self.changes[(side.value, price)] = qty
+
+    def insert(self, side: SIDE, price, qty):
+        """新建价格档price，数量为qty"""
+        key = (side.value, price)
+        if key not in self.changes:  # 本条消息内先删后建的价格档，消费者仍持有
+            self.added.add(key)
+        self.changes[key] = qty
+
+    def publish(self, ob):
+        if self.added:
+            for key in self.added:  # 本条消息内建了又删的价格档，消费者未见过
+                if self.changes[key] == 0:
+                    del self.changes[key]
+            self.added.clear()
+        bid_bound = (
+            ob.bid_cage_upper_ex_min_level_price
+            if ob.bid_cage_upper_ex_min_level_qty
+            else 0
+        )
+        ask_bound = (
+            ob.ask_cage_lower_ex_max_level_price
+            if ob.ask_cage_lower_ex_max_level_qty
+            else 0
+        )
+        if (
+            not self.full_pending
+            and not self.changes
+            and bid_bound == self.bid_bound
+            and ask_bound == self.ask_bound
+        ):
+            return
+        self.bid_bound = bid_bound
+        self.ask_bound = ask_bound
+        price_out = ob.conv.price_out
+        self.seq += 1
+        u = depth_update(
+            ob.SecurityID,
+            self.seq,
+            self.full_pending,
+            ob.last_inc_applSeqNum,
+            price_out(bid_bound),
+            price_out(ask_bound),
+        )
+        if self.full_pending:
+            for side, levels in [
+                (SIDE.BID.value, ob.bid_level_tree.inorder_pq_dec()),
+                (SIDE.ASK.value, ob.ask_level_tree.inorder_pq_inc()),
+            ]:
+                for price, qty in levels:
+                    u.sides.append(side)
+                    u.prices.append(price_out(price))
+                    u.qtys.append(qty)
+            self.full_pending = False
+        else:
+            for (side, price), qty in self.changes.items():
+                u.sides.append(side)
+                u.prices.append(price_out(price))
+                u.qtys.append(qty)
+        self.changes.clear()
+        self.updates.append(u)
+
+    def fetch(self):
+        updates = self.updates
+        self.updates = []
+        return updates
+
+
+class CKPT_KIND(Enum):  # 检查点类型
+    FULL = 0  # 全量：全部订单及价格档
+    DELTA = 1  # 增量：上一检查点以来变化的订单及价格档
+
+
+CKPT_MAGIC = b"AXCK"
+CKPT_VERSION = 4
+CKPT_HEAD = struct.Struct("<4sBBIIII")  # magic, version, kind, seq, base_seq, 标量段长度, 快照段长度(0=无)
+CKPT_ARRAY_HEAD = struct.Struct("<cI")  # typecode, 元素个数
+
+
+def ckpt_pack_arrays(parts, arrays):
+    """数组按(typecode, 个数, 原始字节)依次写入parts"""
+    for v in arrays:
+        parts.append(CKPT_ARRAY_HEAD.pack(v.typecode.encode(), len(v)))
+        parts.append(v.tobytes())
+
+
+def ckpt_unpack_arrays(view, off, nb):
+    """从memoryview的off处读出nb个数组，返回(数组列表, 新偏移)"""
+    arrays = []
+    for _ in range(nb):
+        typecode, n = CKPT_ARRAY_HEAD.unpack_from(view, off)
+        off += CKPT_ARRAY_HEAD.size
+        v = array(typecode.decode())
+        end = off + n * v.itemsize
+        v.frombytes(view[off:end])
+        arrays.append(v)
+        off = end
+    return arrays, off
+
+
+def ckpt_level_image(level_tree):
+    """价格档容器转为(prices, qtys)两列"""
+    prices = array("q")
+    qtys = array("q")
+    for price, qty in level_tree.inorder_pq_inc():
+        prices.append(price)
+        qtys.append(qty)
+    return prices, qtys
+
+
+AXOB_LOAD_DEFAULT = {  # 早期save中没有的字段，加载时按当时的行为补齐
+    "level_tree_type": LEVEL_TREE_TYPE.SORTED,
+    "verifier": verifier().save(),  # 逐消息全簿自检
+    "bid_top_levels": 10,
+    "ask_top_levels": 10,
+    "snap_emit": SNAP_EMIT.PER_MSG,
+    "snap_dirty": False,
+    "order_store_type": ORDER_STORE_TYPE.DICT,
+    "level_queue": False,
+    "full_depth": False,
+}
+
+
 class AXOB:
     __slots__ = [
         "SecurityID",
         "SecurityIDSource",
         "instrument_type",
-        "order_map",  # map of ob_order
+        "order_map",  # map of ob_order，仅含在簿订单(qty为剩余数量)
+        "order_store_type",
+        "level_queue",  # order_map维护价格档委托队列(L3)
         "illegal_order_map",  # map of illegal_order
         "bid_level_tree",  # map of level_node
         "ask_level_tree",  # map of level_node
+        "level_tree_type",
+        "bid_top_levels",  # 买方最优N档缓存
+        "ask_top_levels",  # 卖方最优N档缓存
         "NumTrades",
         "bid_max_level_price",
         "bid_max_level_qty",
@@ -470,6 +1676,10 @@ class AXOB:
         "ask_cage_lower_ex_max_level_qty",
         "bid_cage_ref_px",
         "ask_cage_ref_px",
+        "bid_cage_upper_px",  # 买方笼子上沿，随bid_cage_ref_px更新，见_setBidCageRef；不保存，加载时重算
+        "ask_cage_lower_px",  # 卖方笼子下沿，随ask_cage_ref_px更新
+        "bid_cage_levels",  # 买方笼子外的隐藏档，不保存，加载时由价格档重建
+        "ask_cage_levels",  # 卖方笼子外的隐藏档
         "bid_waiting_for_cage",
         "ask_waiting_for_cage",
         # profile
@@ -483,15 +1693,30 @@ class AXOB:
         "pf_BidWeightValue_max",
         # for test olny
         "msg_nb",
+        "verifier",  # 自检策略
         "rebuilt_snaps",  # list of snap
         "market_snaps",  # list of snap
         "last_snap",
+        "snap_emit",
+        "snap_dirty",  # PER_TICK: 有未生成的快照
+        "full_depth",  # 全档发布，见depth_publisher
         "last_inc_applSeqNum",
+        "decoder",  # 不保存，由_bindMsgHandlers绑定
+        "conv",  # 不保存，由_bindMsgHandlers绑定
+        "msg_handlers",  # 不保存
+        "depth",  # 不保存，depth_publisher，full_depth=False时为None
+        "snap_sink",  # 不保存，每个重建快照生成后的回调，加载后为None
+        "ckpt_seq",  # 不保存，最近一次检查点的序号
+        "ckpt_orders",  # 不保存，上一检查点以来变化的订单{applSeqNum:ORDER_DELTA_OP}，按变化先后排列；None=不记录
+        "ckpt_bid_levels",  # 不保存，上一检查点以来变化的买方价格档{price:qty}，qty=0为已删除
+        "ckpt_ask_levels",  # 不保存，同上，卖方
         "logger",
         "DBG",
         "INFO",
         "WARN",
         "ERR",
+        "DBG_ON",  # 构造/加载时确定，为False时调试信息不格式化
+        "TRACE_ON",  # 导出价格档位访问(EXPORT_LEVEL_ACCESS)
     ]
 
     def __init__(
@@ -500,11 +1725,31 @@ class AXOB:
         SecurityIDSource,
         instrument_type: INSTRUMENT_TYPE,
         load_data=None,
+        level_tree_type: LEVEL_TREE_TYPE = LEVEL_TREE_TYPE.SORTED,
+        verify_policy: VERIFY_POLICY = VERIFY_POLICY.FULL,
+        verify_interval=0,
+        verify_period=0.0,
+        top_level_nb=10,
+        snap_emit: SNAP_EMIT = SNAP_EMIT.PER_MSG,
+        order_store_type: ORDER_STORE_TYPE = ORDER_STORE_TYPE.ARRAY,
+        level_queue=False,
+        full_depth=False,
     ):
         """
+        level_tree_type: 价格档位容器的实现
+        order_store_type: 订单容器的实现
+        level_queue: 维护价格档委托队列(L3)，见queryOrders；需order_store_type=ARRAY
+        top_level_nb: 最优档缓存的档数，0=不缓存（生成快照时遍历价格档）
+        snap_emit: 重建快照的生成时机
+        full_depth: 全档发布，输出整簿及逐消息的价格档增量，见fetchDepth
+        verify_policy/verify_interval/verify_period: 逐消息自检策略，见verifier
         TODO: holding_order的处理是否统一到一处？必须要实现！
         TODO: 增加时戳输入，用于结算各自缓存，如市价单
         """
+        self.ckpt_seq = 0
+        self.ckpt_orders = None  # 首个检查点后开始记录变化
+        self.ckpt_bid_levels = None
+        self.ckpt_ask_levels = None
         if load_data:
             self.load(load_data)
         else:
@@ -513,10 +1758,15 @@ class AXOB:
             self.instrument_type = instrument_type
 
             ## 结构数据：
-            self.order_map = {}  # 订单队列，以applSeqNum作为索引
+            self.order_store_type = order_store_type
+            self.level_queue = level_queue
+            self.order_map = new_order_map(order_store_type, level_queue)  # 订单队列，以applSeqNum作为索引
             self.illegal_order_map = {}  #
-            self.bid_level_tree = {}  # 买方价格档，以价格作为索引
-            self.ask_level_tree = {}  # 卖方价格档
+            self.level_tree_type = level_tree_type
+            self.bid_level_tree = new_level_tree(level_tree_type)  # 买方价格档，以价格作为索引
+            self.ask_level_tree = new_level_tree(level_tree_type)  # 卖方价格档
+            self.bid_top_levels = top_levels(top_level_nb, True)
+            self.ask_top_levels = top_levels(top_level_nb, False)
 
             self.NumTrades = 0
             self.bid_max_level_price = 0
@@ -571,8 +1821,10 @@ class AXOB:
                 0  # 卖方价格笼子下沿之外的最高价，低于卖出基准价的98%
             )
             self.ask_cage_lower_ex_max_level_qty = 0
-            self.bid_cage_ref_px = 0  # 买方价格笼子基准价格 卖方一档价格 -> 买方一档价格 -> 最近成交价 -> 前收盘价，小于等于基准价的102%的在笼子内，大于的在笼子外（被隐藏）
-            self.ask_cage_ref_px = 0  # 卖方价格笼子基准价格 买方一档价格 -> 卖方一档价格 -> 最近成交价 -> 前收盘价，大于等于基准价的98%的在笼子内，小于的在笼子外（被隐藏）
+            self._setBidCageRef(0)  # 买方价格笼子基准价格 卖方一档价格 -> 买方一档价格 -> 最近成交价 -> 前收盘价，小于等于基准价的102%的在笼子内，大于的在笼子外（被隐藏）
+            self._setAskCageRef(0)  # 卖方价格笼子基准价格 买方一档价格 -> 卖方一档价格 -> 最近成交价 -> 前收盘价，大于等于基准价的98%的在笼子内，小于的在笼子外（被隐藏）
+            self.bid_cage_levels = cage_levels(True)
+            self.ask_cage_levels = cage_levels(False)
             self.bid_waiting_for_cage = False
             self.ask_waiting_for_cage = False
 
@@ -587,9 +1839,13 @@ class AXOB:
             self.pf_BidWeightValue_max = 0
 
             self.msg_nb = 0
+            self.verifier = verifier(verify_policy, verify_interval, verify_period)
             self.rebuilt_snaps = {}
             self.market_snaps = {}
             self.last_snap = None
+            self.snap_emit = snap_emit
+            self.snap_dirty = False
+            self.full_depth = full_depth
             self.last_inc_applSeqNum = 0
 
             ## 日志
@@ -607,140 +1863,260 @@ class AXOB:
             self.INFO = self.logger.info
             self.WARN = self.logger.warning
             self.ERR = self.logger.error
+            self.DBG_ON = self.logger.isEnabledFor(logging.DEBUG)
+            self.TRACE_ON = EXPORT_LEVEL_ACCESS and self.DBG_ON
+
+        self._bindMsgHandlers()
 
     def onMsg(self, msg):
-        """处理总入口"""
-        if isinstance(msg, (axsbe_order, axsbe_exe, axsbe_snap_stock)):
-            if msg.SecurityID != self.SecurityID:
-                return
+        """处理总入口：按消息类型查表分发，见_bindMsgHandlers"""
+        if not self.msg_handlers.get(type(msg), self._onOtherMsg)(msg):
+            return  # 非本标的，或重复/乱序的逐笔，不计数
+        if self.depth is not None:
+            self.depth.publish(self)
 
-            # 深交所：始终逐笔序列号递增，这里做检查
-            # 上交所：非合并流逐笔会乱序，不检查
-            if (
-                self.SecurityIDSource == SecurityIDSource_SZSE
-                and isinstance(msg, (axsbe_order, axsbe_exe))
-                and msg.ApplSeqNum <= self.last_inc_applSeqNum
-            ):
-                self.ERR(
-                    f"ApplSeqNum={msg.ApplSeqNum} <= last_inc_applSeqNum={self.last_inc_applSeqNum} repeated or outOfOrder!"
+        # if self.TradingPhaseMarket>=axsbe_base.TPM.Ending:
+        # if self.msg_nb>=885:
+        #    self._print_levels()
+
+        ## 调试数据，仅用于测试算法是否正确：
+        self.msg_nb += 1
+        if self.verifier.due():
+            self.profile()
+            self._verify()
+
+    def onBatch(self, batch, start=0, stop=None):
+        """
+        批量入口：已解码的逐笔按字段排成并列数组，格式见msg_util.BATCH_DTYPE/batch_msgs；
+        逐行从各列取字段直接交给onOrderRow/onExecRow，不构造消息对象，
+        出快照、全档发布及自检的时机与逐条调用一致。快照行情和SIGNAL仍走onMsg。
+        start/stop: 只处理[start, stop)行，见MU.onBatch
+        """
+        cols = batch_columns(batch)
+        MsgType = cols["MsgType"]
+        SecurityID = cols["SecurityID"]
+        ApplSeqNum = cols["ApplSeqNum"]
+        TransactTime = cols["TransactTime"]
+        Price = cols["Price"]
+        Qty = cols["Qty"]
+        Side = cols["Side"]
+        OrdType = cols["OrdType"]
+        ExecType = cols["ExecType"]
+        BidApplSeqNum = cols["BidApplSeqNum"]
+        OfferApplSeqNum = cols["OfferApplSeqNum"]
+        OrderNo = cols["OrderNo"]
+        if stop is None:
+            stop = len(MsgType)
+
+        order_types = frozenset(MsgTypes_order)
+        exe_types = frozenset(MsgTypes_exe)
+        by_seq = self.SecurityIDSource == SecurityIDSource_SZSE  # 同_onOrderMsg，深交所记录逐笔序列号
+        on_inc = self._onInc
+        on_order = self.onOrderRow
+        on_exec = self.onExecRow
+        depth = self.depth
+        due = self.verifier.due
+        for i in range(start, stop):
+            t = MsgType[i]
+            if t in order_types:
+                is_order = True
+            elif t in exe_types:
+                is_order = False
+            else:
+                raise Exception(f"Not support batch MsgType={t}")
+            seq = ApplSeqNum[i]
+            ts = TransactTime[i]
+            if not on_inc(SecurityID[i], seq, ts):
+                continue
+            if self.DBG_ON:
+                self.DBG(
+                    f"msg#{self.msg_nb} onBatch row#{i}: MsgType={t} ApplSeqNum={seq}"
                 )
-                return
+            if is_order:
+                on_order(seq, Price[i], Qty[i], Side[i], OrdType[i], ts, OrderNo[i])
+            else:
+                on_exec(
+                    seq,
+                    ExecType[i],
+                    BidApplSeqNum[i],
+                    OfferApplSeqNum[i],
+                    Price[i],
+                    Qty[i],
+                    ts,
+                )
+            if by_seq:
+                self.last_inc_applSeqNum = seq
+            if depth is not None:
+                depth.publish(self)
+            self.msg_nb += 1
+            if due():
+                self.profile()
+                self._verify()
+
+    def _bindMsgHandlers(self):
+        """构造/加载时绑定：解码表、精度换算及各消息类型的处理函数，不保存；全档发布从整簿重新开始"""
+        self.depth = depth_publisher() if self.full_depth else None
+        self.snap_sink = None
+        self.decoder = get_msg_decoder(self.SecurityIDSource, self.instrument_type)
+        self.conv = get_px_converter(self.SecurityIDSource, self.instrument_type)
+        self.msg_handlers = {
+            axsbe_order: self._onOrderMsg,
+            axsbe_exe: self._onExecMsg,
+            axsbe_snap_stock: self._onSnapMsg,
+            AX_SIGNAL: self._onSignal,
+        }
+
+    def _onIncMsg(self, msg):
+        return self._onInc(msg.SecurityID, msg.ApplSeqNum, msg.TransactTime)
+
+    def _onInc(self, SecurityID, ApplSeqNum, TransactTime):
+        """逐笔公共部分：过滤、时戳及交易阶段；返回False时丢弃"""
+        if SecurityID != self.SecurityID:
+            return False
 
-            if isinstance(msg, (axsbe_order, axsbe_exe)):
-                # if self.market_subtype==MARKET_SUBTYPE.SZSE_STK_GEM and self.TradingPhaseMarket==axsbe_base.TPM.PMTrading and msg.TradingPhaseMarket==axsbe_base.TPM.CloseCall:
-                #     # 创业板进入收盘集合竞价，敞开价格笼子，将外面的隐藏订单放进来
-                #     self.openCage()
-                #     self.genSnap()
+        # 深交所：始终逐笔序列号递增，这里做检查
+        # 上交所：非合并流逐笔会乱序，不检查
+        if (
+            self.SecurityIDSource == SecurityIDSource_SZSE
+            and ApplSeqNum <= self.last_inc_applSeqNum
+        ):
+            self.ERR(
+                f"ApplSeqNum={ApplSeqNum} <= last_inc_applSeqNum={self.last_inc_applSeqNum} repeated or outOfOrder!"
+            )
+            return False
 
-                assert (
-                    self.constantValue_ready
-                ), f"{self.SecurityID:06d} constant values not ready!"
+        # if self.market_subtype==MARKET_SUBTYPE.SZSE_STK_GEM and self.TradingPhaseMarket==axsbe_base.TPM.PMTrading and msg.TradingPhaseMarket==axsbe_base.TPM.CloseCall:
+        #     # 创业板进入收盘集合竞价，敞开价格笼子，将外面的隐藏订单放进来
+        #     self.openCage()
+        #     self.genSnap()
+
+        assert (
+            self.constantValue_ready
+        ), f"{self.SecurityID:06d} constant values not ready!"
+
+        self._useTimestamp(TransactTime)
+
+        if self.TradingPhaseMarket != axsbe_base.TPM.VolatilityBreaking:
+            self.TradingPhaseMarket = self.conv.tpm_in(
+                TransactTime
+            )  # 只用逐笔，在阶段切换期间，逐笔和快照的速率不同，可能快照切了逐笔没切，或反过来，
+            # 由于我们重建完全基于逐笔，快照仅用来做检查，故阶段切换基于逐笔。
+            # 几个例外情况：
+            #   在开盘集合竞价结束时可能没有成交；在进入中午休市时，没有逐笔。
+            # 此时由更高层触发SIGNAL。
+        # else:
+        #     if self.VolatilityBreaking_end_tick==0: #波动性中断期间，逐笔成交到来说明中断结束
+        #         if isinstance(msg, axsbe_exe) and msg.ExecType_str=='成交':
+        #             self.VolatilityBreaking_end_tick = self.current_inc_tick
+        #     else:
+        #         if not(isinstance(msg, axsbe_exe) and msg.ExecType_str=='成交'): #中断结束后，有非逐笔成交
+        #             self.TradingPhaseMarket = msg.TradingPhaseMarket
+
+        return True
+
+    def _onOrderMsg(self, msg: axsbe_order):
+        if not self._onIncMsg(msg):
+            return False
+        self.onOrder(msg)
+        # 深交所：始终逐笔序列号递增，这里做记录
+        # 上交所：非合并流逐笔会乱序，不记录
+        if self.SecurityIDSource == SecurityIDSource_SZSE:
+            self.last_inc_applSeqNum = msg.ApplSeqNum
+        return True
 
-                self._useTimestamp(msg.TransactTime)
+    def _onExecMsg(self, msg: axsbe_exe):
+        if not self._onIncMsg(msg):
+            return False
+        self.onExec(msg)
+        if self.SecurityIDSource == SecurityIDSource_SZSE:
+            self.last_inc_applSeqNum = msg.ApplSeqNum
+        return True
 
-                if self.TradingPhaseMarket != axsbe_base.TPM.VolatilityBreaking:
-                    self.TradingPhaseMarket = (
-                        msg.TradingPhaseMarket
-                    )  # 只用逐笔，在阶段切换期间，逐笔和快照的速率不同，可能快照切了逐笔没切，或反过来，
-                    # 由于我们重建完全基于逐笔，快照仅用来做检查，故阶段切换基于逐笔。
-                    # 几个例外情况：
-                    #   在开盘集合竞价结束时可能没有成交；在进入中午休市时，没有逐笔。
-                    # 此时由更高层触发SIGNAL。
-                # else:
-                #     if self.VolatilityBreaking_end_tick==0: #波动性中断期间，逐笔成交到来说明中断结束
-                #         if isinstance(msg, axsbe_exe) and msg.ExecType_str=='成交':
-                #             self.VolatilityBreaking_end_tick = self.current_inc_tick
-                #     else:
-                #         if not(isinstance(msg, axsbe_exe) and msg.ExecType_str=='成交'): #中断结束后，有非逐笔成交
-                #             self.TradingPhaseMarket = msg.TradingPhaseMarket
-
-            if isinstance(msg, axsbe_order):
-                self.onOrder(msg)
-            elif isinstance(msg, axsbe_exe):
-                self.onExec(msg)
-            elif isinstance(msg, axsbe_snap_stock):
-                self.onSnap(msg)
-
-            # 深交所：始终逐笔序列号递增，这里做记录
-            # 上交所：非合并流逐笔会乱序，不记录
-            if self.SecurityIDSource == SecurityIDSource_SZSE and isinstance(
-                msg, (axsbe_order, axsbe_exe)
-            ):
-                self.last_inc_applSeqNum = msg.ApplSeqNum
+    def _onSnapMsg(self, msg: axsbe_snap_stock):
+        if msg.SecurityID != self.SecurityID:
+            return False
+        self.flushSnap()  # 先出合并中的快照，再与市场快照比对
+        self.onSnap(msg)
+        return True
 
-        elif isinstance(msg, AX_SIGNAL):
-            if msg == AX_SIGNAL.OPENCALL_END:
+    def _onOtherMsg(self, msg):
+        return True
+
+    def _onSignal(self, msg: AX_SIGNAL):
+        self.flushSnap()  # 阶段切换前先出合并中的快照，切换时的快照立即生成
+        if msg == AX_SIGNAL.OPENCALL_END:
+            if (
+                self.bid_max_level_price < self.ask_min_level_price
+                and self.TradingPhaseMarket == axsbe_base.TPM.OpenCall
+            ):  # 双方最优价无法成交，否则等成交
+                self.TradingPhaseMarket = (
+                    axsbe_base.TPM.PreTradingBreaking
+                )  # 自行修改交易阶段，使生成的快照为交易快照
+                self.genSnap(force=True)
+        elif msg == AX_SIGNAL.AMTRADING_BGN:
+            if self.TradingPhaseMarket == axsbe_base.TPM.PreTradingBreaking:
+                self.TradingPhaseMarket = axsbe_base.TPM.AMTrading
+                self.AskWeightSize += self.AskWeightSizeEx
+                self.AskWeightValue += self.AskWeightValueEx
+                self.genSnap(force=True)
+                self.bid_level_tree.drop_prefix_sum()  # 连续竞价不需要集合竞价的前缀和
+                self.ask_level_tree.drop_prefix_sum()
+        elif msg == AX_SIGNAL.AMTRADING_END:
+            if self.TradingPhaseMarket == axsbe_base.TPM.AMTrading:
+                if self.holding_nb and self.holding_order.type == TYPE.MARKET:
+                    self.insertOrder(self.holding_order)
+                    self.holding_nb = 0
+                if self.holding_nb == 0:  # 不再有缓存单
+                    self.TradingPhaseMarket = axsbe_base.TPM.Breaking
+                    self.genSnap(force=True)
+        elif msg == AX_SIGNAL.PMTRADING_END:
+            if self.TradingPhaseMarket == axsbe_base.TPM.PMTrading:
+                if self.holding_nb and self.holding_order.type == TYPE.MARKET:
+                    self.insertOrder(self.holding_order)
+                    self.holding_nb = 0
+                if self.holding_nb == 0:  # 不再有缓存单
+                    self.genSnap(force=True)  # 先生成最后一个快照
+
+                    self.TradingPhaseMarket = (
+                        axsbe_base.TPM.CloseCall
+                    )  # 自行修改交易阶段，使生成的快照为集合竞价快照
+                    self.openCage()  # 开笼子，再生成集合竞价
+                    self.genSnap(force=True)
+        elif msg == AX_SIGNAL.ALL_END:
+            # 收盘集合竞价结束，收盘价：
+            #  沪市收盘价为当日该证券最后一笔交易前一分钟所有交易的成交量加权平均价（含最后一笔交易）。当日无成交的，以前收盘价为当日收盘价。
+            #  深市的收盘价通过集合竞价的方式产生。收盘集合竞价不能产生收盘价的，以当日该证券最后一笔交易前一分钟所有交易的成交量加权平均价(含最后一笔交易)为收盘价。当日无成交的，以前收盘价为当日收盘价。
+            if self.SecurityIDSource == SecurityIDSource_SZSE:
                 if (
                     self.bid_max_level_price < self.ask_min_level_price
-                    and self.TradingPhaseMarket == axsbe_base.TPM.OpenCall
+                    and self.TradingPhaseMarket == axsbe_base.TPM.CloseCall
                 ):  # 双方最优价无法成交，否则等成交
                     self.TradingPhaseMarket = (
-                        axsbe_base.TPM.PreTradingBreaking
+                        axsbe_base.TPM.Ending
                     )  # 自行修改交易阶段，使生成的快照为交易快照
-                    self.genSnap()
-            elif msg == AX_SIGNAL.AMTRADING_BGN:
-                if self.TradingPhaseMarket == axsbe_base.TPM.PreTradingBreaking:
-                    self.TradingPhaseMarket = axsbe_base.TPM.AMTrading
-                    self.AskWeightSize += self.AskWeightSizeEx
-                    self.AskWeightValue += self.AskWeightValueEx
-                    self.genSnap()
-            elif msg == AX_SIGNAL.AMTRADING_END:
-                if self.TradingPhaseMarket == axsbe_base.TPM.AMTrading:
-                    if self.holding_nb and self.holding_order.type == TYPE.MARKET:
-                        self.insertOrder(self.holding_order)
-                        self.holding_nb = 0
-                    if self.holding_nb == 0:  # 不再有缓存单
-                        self.TradingPhaseMarket = axsbe_base.TPM.Breaking
-                        self.genSnap()
-            elif msg == AX_SIGNAL.PMTRADING_END:
-                if self.TradingPhaseMarket == axsbe_base.TPM.PMTrading:
-                    if self.holding_nb and self.holding_order.type == TYPE.MARKET:
-                        self.insertOrder(self.holding_order)
-                        self.holding_nb = 0
-                    if self.holding_nb == 0:  # 不再有缓存单
-                        self.genSnap()  # 先生成最后一个快照
-
-                        self.TradingPhaseMarket = (
-                            axsbe_base.TPM.CloseCall
-                        )  # 自行修改交易阶段，使生成的快照为集合竞价快照
-                        self.openCage()  # 开笼子，再生成集合竞价
-                        self.genSnap()
-            elif msg == AX_SIGNAL.ALL_END:
-                # 收盘集合竞价结束，收盘价：
-                #  沪市收盘价为当日该证券最后一笔交易前一分钟所有交易的成交量加权平均价（含最后一笔交易）。当日无成交的，以前收盘价为当日收盘价。
-                #  深市的收盘价通过集合竞价的方式产生。收盘集合竞价不能产生收盘价的，以当日该证券最后一笔交易前一分钟所有交易的成交量加权平均价(含最后一笔交易)为收盘价。当日无成交的，以前收盘价为当日收盘价。
-                if self.SecurityIDSource == SecurityIDSource_SZSE:
-                    if (
-                        self.bid_max_level_price < self.ask_min_level_price
-                        and self.TradingPhaseMarket == axsbe_base.TPM.CloseCall
-                    ):  # 双方最优价无法成交，否则等成交
-                        self.TradingPhaseMarket = (
-                            axsbe_base.TPM.Ending
-                        )  # 自行修改交易阶段，使生成的快照为交易快照
-                        self.closePx_ready = False  # 等快照的价格作为最后价格
-                    else:
-                        self.closePx_ready = True  # 直接生成快照
-                        self.genSnap()
-                else:
-                    if (
-                        self.bid_max_level_price < self.ask_min_level_price
-                        and self.TradingPhaseMarket == axsbe_base.TPM.CloseCall
-                    ):  # 双方最优价无法成交，否则等成交
-                        self.TradingPhaseMarket = (
-                            axsbe_base.TPM.Ending
-                        )  # 自行修改交易阶段，使生成的快照为交易快照
                     self.closePx_ready = False  # 等快照的价格作为最后价格
-        else:
-            pass
-
-        # if self.TradingPhaseMarket>=axsbe_base.TPM.Ending:
-        # if self.msg_nb>=885:
-        #    self._print_levels()
+                else:
+                    self.closePx_ready = True  # 直接生成快照
+                    self.genSnap(force=True)
+            else:
+                if (
+                    self.bid_max_level_price < self.ask_min_level_price
+                    and self.TradingPhaseMarket == axsbe_base.TPM.CloseCall
+                ):  # 双方最优价无法成交，否则等成交
+                    self.TradingPhaseMarket = (
+                        axsbe_base.TPM.Ending
+                    )  # 自行修改交易阶段，使生成的快照为交易快照
+                self.closePx_ready = False  # 等快照的价格作为最后价格
+        return True
 
-        ## 调试数据，仅用于测试算法是否正确：
-        self.msg_nb += 1
-        self.profile()
+    def set_verify_policy(
+        self, policy: VERIFY_POLICY, interval=0, period=0.0
+    ):
+        """运行中切换自检策略，如加载回归时刻后切到生产模式"""
+        self.verifier = verifier(policy, interval, period)
 
+    def _verify(self):
+        """全簿自检：缓存的最优价、加权统计与价格档逐一核对，O(L)"""
         if len(self.ask_level_tree):
             if (
                 self.market_subtype == MARKET_SUBTYPE.SZSE_STK_GEM
@@ -750,12 +2126,12 @@ class AXOB:
                     self.ask_min_level_price > self.ask_cage_lower_ex_max_level_price
                 ), f"{self.SecurityID:06d} cache ask-min-price/cage-max NG"
             else:
-                assert self.ask_min_level_price == min(
-                    self.ask_level_tree.keys()
+                ask_min_level = self.ask_level_tree.locate_min()
+                assert (
+                    self.ask_min_level_price == ask_min_level.price
                 ), f"{self.SecurityID:06d} cache ask-min-price NG"
                 assert (
-                    self.ask_min_level_qty
-                    == min(self.ask_level_tree.items(), key=lambda x: x[0])[1].qty
+                    self.ask_min_level_qty == ask_min_level.qty
                 ), f"{self.SecurityID:06d} cache ask-min-qty NG"
         if len(self.bid_level_tree):
             if (
@@ -766,14 +2142,39 @@ class AXOB:
                     self.bid_max_level_price < self.bid_cage_upper_ex_min_level_price
                 ), f"{self.SecurityID:06d} cache bid-max-price/cage-min NG"
             else:
-                assert self.bid_max_level_price == max(
-                    self.bid_level_tree.keys()
+                bid_max_level = self.bid_level_tree.locate_max()
+                assert (
+                    self.bid_max_level_price == bid_max_level.price
                 ), f"{self.SecurityID:06d} cache bid-max-price NG"
                 assert (
-                    self.bid_max_level_qty
-                    == max(self.bid_level_tree.items(), key=lambda x: x[0])[1].qty
+                    self.bid_max_level_qty == bid_max_level.qty
                 ), f"{self.SecurityID:06d} ache bid-max-qty NG"
 
+        for hidden, tree, qty, bound, name in [
+            (
+                self.bid_cage_levels,
+                self.bid_level_tree,
+                self.bid_cage_upper_ex_min_level_qty,
+                self.bid_cage_upper_ex_min_level_price,
+                "bid",
+            ),
+            (
+                self.ask_cage_levels,
+                self.ask_level_tree,
+                self.ask_cage_lower_ex_max_level_qty,
+                self.ask_cage_lower_ex_max_level_price,
+                "ask",
+            ),
+        ]:
+            expect = cage_levels(hidden.desc)
+            expect.rebuild(tree, bound if qty else None)
+            assert (
+                hidden.keys == expect.keys
+            ), f"{self.SecurityID:06d} {name} cage levels NG @{self.current_inc_tick}"
+            assert (
+                not qty or hidden.next() == bound
+            ), f"{self.SecurityID:06d} {name} cage bound NG @{self.current_inc_tick}"
+
         if (
             (
                 self.TradingPhaseMarket == axsbe_base.TPM.AMTrading
@@ -835,6 +2236,71 @@ class AXOB:
         for _, ls in self.market_snaps.items():
             assert len(ls) != 0, f"{self.SecurityID:06d} market snap not pop clean"
 
+        if (
+            (
+                self.TradingPhaseMarket == axsbe_base.TPM.OpenCall
+                or self.TradingPhaseMarket == axsbe_base.TPM.CloseCall
+            )
+            and self.holding_nb == 0
+            and self.bid_cage_upper_ex_min_level_qty == 0
+            and self.ask_cage_lower_ex_max_level_qty == 0
+            and self.bid_level_tree.psum is not None
+            and self.ask_level_tree.psum is not None
+        ):  # 前缀和撮合与逐档撮合一致
+            walk = self._callMatchWalk()
+            fast = self._callMatchPrefixSum()
+            assert walk[1] == fast[1] and (
+                walk[1] == 0 or walk == fast
+            ), f"{self.SecurityID:06d} call match walk={walk} prefix_sum={fast} NG @{self.current_inc_tick}"
+
+        for top, tree, bound in [
+            (
+                self.bid_top_levels,
+                self.bid_level_tree,
+                self.bid_cage_upper_ex_min_level_price
+                if self.bid_cage_upper_ex_min_level_qty
+                else None,
+            ),
+            (
+                self.ask_top_levels,
+                self.ask_level_tree,
+                self.ask_cage_lower_ex_max_level_price
+                if self.ask_cage_lower_ex_max_level_qty
+                else None,
+            ),
+        ]:
+            if top.valid and top.bound == bound:
+                n = len(top.prices)
+                if top.desc:
+                    levels = tree.inorder_list_dec(None if bound is None else bound - 1)
+                else:
+                    levels = tree.inorder_list_inc(None if bound is None else bound + 1)
+                static_levels = []
+                for l in levels:
+                    if len(static_levels) > n:
+                        break
+                    static_levels.append((l.price, l.qty))
+                assert static_levels[:n] == list(
+                    zip(top.prices, top.qtys)
+                ), f"{self.SecurityID:06d} top levels cache NG @{self.current_inc_tick}"
+                assert top.tail_open or len(static_levels) == n
+
+        if self.level_queue:  # 委托队列与价格档一致，O(N)
+            queue_nb = 0
+            for side, tree in [
+                (SIDE.BID, self.bid_level_tree),
+                (SIDE.ASK, self.ask_level_tree),
+            ]:
+                for _, l in tree.items():
+                    queue = self.order_map.queue(side, l.price)
+                    queue_nb += len(queue)
+                    assert l.qty == sum(
+                        o.qty for o in queue
+                    ), f"{self.SecurityID:06d} {side} level {l.price} queue qty NG @{self.current_inc_tick}"
+            assert queue_nb == len(
+                self.order_map
+            ), f"{self.SecurityID:06d} level queue size={queue_nb} order_map size={len(self.order_map)} NG"
+
     def openCage(self):
         self.DBG("openCage")
         # self._print_levels()
@@ -843,100 +2309,141 @@ class AXOB:
         if (
             self.UpLimitPx == msg_util.ORDER_PRICE_OVERFLOW
         ):  # 无涨跌停限制=创业板上市头5日 TODO: 更精确
-            ex_p = []
-            self._export_level_access(
-                f"LEVEL_ACCESS ASK inorder_list_inc //remove invalid price"
-            )
-            for p, l in sorted(
-                self.ask_level_tree.items(), key=lambda x: x[0], reverse=False
-            ):  # 从小到大遍历
-                if p > msg_util.CYB_match_upper(
-                    self.LastPx
-                ) or p < msg_util.CYB_match_lower(self.LastPx):
-                    ex_p.append(p)
-                    if (
-                        not self.ask_cage_lower_ex_max_level_qty
-                        or p > self.ask_cage_lower_ex_max_level_price
-                    ):  # 属于被纳入动态统计的价格档
-                        self.AskWeightSize -= l.qty
-                        self.AskWeightValue -= p * l.qty
-            for p in ex_p:
-                self.ask_level_tree.pop(p)
-                self._export_level_access(
-                    f"LEVEL_ACCESS ASK remove {p} //remove invalid price"
-                )  # 二叉树也不能边遍历边修改, TODO: 全部remove后再平衡？
-
-            ex_p = []
-            self._export_level_access(
-                f"LEVEL_ACCESS BID inorder_list_dec //remove invalid price"
-            )
-            for p, l in sorted(
-                self.bid_level_tree.items(), key=lambda x: x[0], reverse=True
-            ):  # 从大到小遍历
-                if p > msg_util.CYB_match_upper(
-                    self.LastPx
-                ) or p < msg_util.CYB_match_lower(self.LastPx):
-                    ex_p.append(p)
-                    if (
-                        not self.bid_cage_upper_ex_min_level_qty
-                        or p < self.bid_cage_upper_ex_min_level_price
-                    ):  # 属于被纳入动态统计的价格档
-                        self.BidWeightSize -= l.qty
-                        self.BidWeightValue -= p * l.qty
-            for p in ex_p:
-                self.bid_level_tree.pop(p)
-                self._export_level_access(
-                    f"LEVEL_ACCESS BID remove {p} //remove invalid price"
-                )  # 二叉树也不能边遍历边修改, TODO: 全部remove后再平衡？
+            lower = msg_util.CYB_match_lower(self.LastPx)
+            upper = msg_util.CYB_match_upper(self.LastPx)
+            qty, value = self._popInvalidLevels(SIDE.ASK, lower, upper)
+            self.AskWeightSize -= qty
+            self.AskWeightValue -= value
+            qty, value = self._popInvalidLevels(SIDE.BID, lower, upper)
+            self.BidWeightSize -= qty
+            self.BidWeightValue -= value
 
         if self.ask_cage_lower_ex_max_level_qty:
-            self._export_level_access(
-                f"LEVEL_ACCESS ASK inorder_list_inc while <={self.ask_cage_lower_ex_max_level_price} //openCage"
-            )
-            for p, l in sorted(
-                self.ask_level_tree.items(), key=lambda x: x[0], reverse=False
-            ):  # 从小到大遍历
-                if p <= self.ask_cage_lower_ex_max_level_price:
-                    self.AskWeightSize += l.qty
-                    self.AskWeightValue += p * l.qty
-                else:
-                    break
+            if self.TRACE_ON:
+                self._export_level_access(
+                    f"LEVEL_ACCESS ASK range_sum <={self.ask_cage_lower_ex_max_level_price} //openCage"
+                )
+            qty, value = self.ask_level_tree.range_sum(
+                None, self.ask_cage_lower_ex_max_level_price
+            )  # 隐藏档纳入统计
+            self.AskWeightSize += qty
+            self.AskWeightValue += value
 
             self.ask_cage_lower_ex_max_level_qty = 0
-            self.ask_min_level_price = min(self.ask_level_tree.keys())
-            self.ask_min_level_qty = self.ask_level_tree[self.ask_min_level_price].qty
-            self._export_level_access(
-                f"LEVEL_ACCESS ASK locate_min //openCage"
-            )  # TODO: 直接在上面遍历时赋值
+            self.ask_min_level_price, self.ask_min_level_qty = self.ask_level_tree.locate_min_pq()
+            if self.TRACE_ON:
+                self._export_level_access(
+                    f"LEVEL_ACCESS ASK locate_min //openCage"
+                )  # TODO: 直接在上面遍历时赋值
 
         if self.bid_cage_upper_ex_min_level_qty:
-            self._export_level_access(
-                f"LEVEL_ACCESS BID inorder_list_dec while >={self.bid_cage_upper_ex_min_level_price} //openCage"
-            )
-            for p, l in sorted(
-                self.bid_level_tree.items(), key=lambda x: x[0], reverse=True
-            ):  # 从大到小遍历
-                if p >= self.bid_cage_upper_ex_min_level_price:
-                    self.BidWeightSize += l.qty
-                    self.BidWeightValue += p * l.qty
-                else:
-                    break
+            if self.TRACE_ON:
+                self._export_level_access(
+                    f"LEVEL_ACCESS BID range_sum >={self.bid_cage_upper_ex_min_level_price} //openCage"
+                )
+            qty, value = self.bid_level_tree.range_sum(
+                self.bid_cage_upper_ex_min_level_price, None
+            )  # 隐藏档纳入统计
+            self.BidWeightSize += qty
+            self.BidWeightValue += value
 
             self.bid_cage_upper_ex_min_level_qty = 0
-            self.bid_max_level_price = max(self.bid_level_tree.keys())
-            self.bid_max_level_qty = self.bid_level_tree[self.bid_max_level_price].qty
-            self._export_level_access(
-                f"LEVEL_ACCESS BID locate_max //openCage"
-            )  # TODO: 直接在上面遍历时赋值
+            self.bid_max_level_price, self.bid_max_level_qty = self.bid_level_tree.locate_max_pq()
+            if self.TRACE_ON:
+                self._export_level_access(
+                    f"LEVEL_ACCESS BID locate_max //openCage"
+                )  # TODO: 直接在上面遍历时赋值
+        self.bid_cage_levels.clear()
+        self.ask_cage_levels.clear()
         # self._print_levels()
 
+    def _popInvalidLevels(self, side: SIDE, lower, upper):
+        """
+        按价格区间删除有效竞价范围[lower, upper]之外的价格档，价格档容器只整理一次
+        返回：被删除的价格档中纳入加权统计的(数量和, 金额和)，笼子外的隐藏档不在统计中
+        """
+        if side == SIDE.BID:
+            tree, top = self.bid_level_tree, self.bid_top_levels
+            hidden = self.bid_cage_upper_ex_min_level_qty
+            bound = self.bid_cage_upper_ex_min_level_price
+            ckpt_levels = self.ckpt_bid_levels
+        else:
+            tree, top = self.ask_level_tree, self.ask_top_levels
+            hidden = self.ask_cage_lower_ex_max_level_qty
+            bound = self.ask_cage_lower_ex_max_level_price
+            ckpt_levels = self.ckpt_ask_levels
+
+        qty = value = 0
+        prices = []
+        for lo, hi in [(None, lower - 1), (upper + 1, None)]:
+            removed, q, v = tree.pop_range(lo, hi)
+            if self.TRACE_ON:
+                self._export_level_access(
+                    f"LEVEL_ACCESS {side} remove_range [{lo},{hi}] x{len(removed)} //remove invalid price"
+                )
+            if not removed:
+                continue
+            qty += q
+            value += v
+            top.invalidate()  # 最优档缓存下次取用时重建
+            for l in removed:
+                prices.append(l.price)
+                if hidden and (
+                    l.price >= bound if side == SIDE.BID else l.price <= bound
+                ):
+                    qty -= l.qty
+                    value -= l.price * l.qty
+                if self.depth is not None:
+                    self.depth.update(side, l.price, 0)
+                if ckpt_levels is not None:
+                    ckpt_levels[l.price] = 0
+        if prices:
+            self._dropLevelOrders(side, prices)
+        return qty, value
+
+    def _dropLevelOrders(self, side: SIDE, prices):
+        """
+        被删除的价格档上的订单移出order_map(及委托队列)，转入illegal_order_map，
+        同收盘集合竞价中超出有效范围的新订单；此后的撤单按无效订单处理
+        """
+        order_map = self.order_map
+        if self.level_queue:
+            applSeqNums = [
+                o.applSeqNum for price in prices for o in order_map.queue(side, price)
+            ]
+        else:  # 无委托队列时遍历一次，每日至多一次
+            prices = set(prices)
+            applSeqNums = [
+                k for k, o in order_map.items() if o.side == side and o.price in prices
+            ]
+        ckpt_orders = self.ckpt_orders
+        for applSeqNum in applSeqNums:
+            order = order_map.pop(applSeqNum)
+            if isinstance(order, order_slot):  # 槽位已归还，取出内容
+                order = order_from_slot(order)
+            self.illegal_order_map[applSeqNum] = order
+            if ckpt_orders is not None:
+                ckpt_orders[applSeqNum] = ORDER_DELTA_OP.REMOVE
+
     def onOrder(self, order: axsbe_order):
         """
         逐笔订单入口，统一提取市价单、限价单的关键字段到内部订单格式
         跳转到处理限价单或处理撤单
         """
-        self.DBG(f"msg#{self.msg_nb} onOrder:{order}")
+        if self.DBG_ON:
+            self.DBG(f"msg#{self.msg_nb} onOrder:{order}")
+        self.onOrderRow(
+            order.ApplSeqNum,
+            order.Price,
+            getattr(order, "Qty", order.OrderQty),  # 上海债券用Qty，同msg_util.msgs_to_batch
+            order.Side,
+            order.OrdType,
+            order.TransactTime,
+            order.OrderNo,
+        )
 
+    def onOrderRow(self, ApplSeqNum, Price, Qty, Side, OrdType, TransactTime, OrderNo):
+        """同onOrder，参数为逐笔委托的原始字段，批量入口不经消息对象调用"""
         if self.holding_nb != 0:  # 把此前缓存的订单(市价/限价)插入LOB
             if self.holding_order.type == TYPE.MARKET and not self.holding_order.traded:
                 self.ERR(f"市价单 {self.holding_order} 未伴随成交")
@@ -945,28 +2452,45 @@ class AXOB:
 
             self._useTimestamp(self.holding_order.TransactTime)
             self.genSnap()  # 先出一个snap，时戳用市价单的
-            self._useTimestamp(order.TransactTime)
+            self._useTimestamp(TransactTime)
 
         if self.SecurityIDSource == SecurityIDSource_SZSE:
-            _order = ob_order(order, self.instrument_type)
+            _order = ob_order.of_row(
+                self.decoder,
+                self.instrument_type,
+                self.SecurityID,
+                ApplSeqNum,
+                Price,
+                Qty,
+                Side,
+                OrdType,
+                TransactTime,
+            )
         elif self.SecurityIDSource == SecurityIDSource_SSE:
             # order or cancel
-            if order.Type_str == "新增":
-                _order = ob_order(order, self.instrument_type)
-            elif order.Type_str == "删除":
-                if order.Side_str == "买入":
-                    Side = SIDE.BID
-                elif order.Side_str == "卖出":
-                    Side = SIDE.ASK
-                _cancel = ob_cancel(
-                    order.OrderNo,
-                    order.Qty,
-                    order.Price,
+            if self.decoder.ordtype_of(OrdType) == TYPE.LIMIT:  # 新增
+                _order = ob_order.of_row(
+                    self.decoder,
+                    self.instrument_type,
+                    self.SecurityID,
+                    ApplSeqNum,
+                    Price,
+                    Qty,
                     Side,
-                    order.TransactTime,
+                    OrdType,
+                    TransactTime,
+                )
+            else:  # 删除
+                _cancel = ob_cancel(
+                    OrderNo,
+                    Qty,
+                    Price,
+                    self.decoder.side_of(Side),
+                    TransactTime,
                     self.SecurityIDSource,
                     self.instrument_type,
                     self.SecurityID,
+                    self.conv,
                 )
                 self.onCancel(_cancel)
                 return
@@ -1063,9 +2587,9 @@ class AXOB:
                 and order.type == TYPE.LIMIT
                 and (
                     order.side == SIDE.BID
-                    and (order.price > CYB_cage_upper(self.bid_cage_ref_px))
+                    and (order.price > self.bid_cage_upper_px)
                     or order.side == SIDE.ASK
-                    and (order.price < CYB_cage_lower(self.ask_cage_ref_px))
+                    and (order.price < self.ask_cage_lower_px)
                 )
             ):
                 self.insertOrder(order, outOfCage=True)
@@ -1116,16 +2640,27 @@ class AXOB:
             self.DBG("outOfCage")
 
         self.order_map[order.applSeqNum] = order
+        ckpt_orders = self.ckpt_orders
+        if ckpt_orders is not None:
+            ckpt_orders.pop(order.applSeqNum, None)  # 移到最后，恢复时按入列先后追加
+            ckpt_orders[order.applSeqNum] = ORDER_DELTA_OP.INSERT
 
         if order.side == SIDE.BID:
-            self._export_level_access(
-                f"LEVEL_ACCESS BID locate {order.price} //insertOrder"
-            )
-            if order.price in self.bid_level_tree:
-                self.bid_level_tree[order.price].qty += order.qty
+            if self.TRACE_ON:
                 self._export_level_access(
-                    f"LEVEL_ACCESS BID writeback {order.price} //insertOrder"
+                    f"LEVEL_ACCESS BID locate {order.price} //insertOrder"
                 )
+            if order.price in self.bid_level_tree:
+                qty = self.bid_level_tree.add_qty(order.price, order.qty)
+                self.bid_top_levels.update(order.price, qty)
+                if self.depth is not None:
+                    self.depth.update(SIDE.BID, order.price, qty)
+                if self.ckpt_bid_levels is not None:
+                    self.ckpt_bid_levels[order.price] = qty
+                if self.TRACE_ON:
+                    self._export_level_access(
+                        f"LEVEL_ACCESS BID writeback {order.price} //insertOrder"
+                    )
                 if order.price == self.bid_max_level_price:
                     self.bid_max_level_qty += order.qty
                 if (
@@ -1136,9 +2671,15 @@ class AXOB:
             else:
                 node = level_node(order.price, order.qty, order.applSeqNum)
                 self.bid_level_tree[order.price] = node
-                self._export_level_access(
-                    f"LEVEL_ACCESS BID insert {order.price} //insertOrder"
-                )
+                self.bid_top_levels.update(order.price, order.qty)
+                if self.depth is not None:
+                    self.depth.insert(SIDE.BID, order.price, order.qty)
+                if self.ckpt_bid_levels is not None:
+                    self.ckpt_bid_levels[order.price] = order.qty
+                if self.TRACE_ON:
+                    self._export_level_access(
+                        f"LEVEL_ACCESS BID insert {order.price} //insertOrder"
+                    )
 
                 if not outOfCage:
                     if (
@@ -1148,11 +2689,13 @@ class AXOB:
                         self.bid_max_level_price = order.price
                         self.bid_max_level_qty = order.qty
 
-                        self.ask_cage_ref_px = order.price
-                        self.DBG(f"Ask cage ref px={self.ask_cage_ref_px}")
+                        self._setAskCageRef(order.price)
+                        if self.DBG_ON:
+                            self.DBG(f"Ask cage ref px={self.ask_cage_ref_px}")
                         if not self.ask_min_level_qty:  # 没有对手价
-                            self.bid_cage_ref_px = order.price
-                            self.DBG(f"bid cage ref px={self.bid_cage_ref_px}")
+                            self._setBidCageRef(order.price)
+                            if self.DBG_ON:
+                                self.DBG(f"bid cage ref px={self.bid_cage_ref_px}")
 
                         self.ask_waiting_for_cage = (
                             True
@@ -1167,23 +2710,37 @@ class AXOB:
                     ):  # 买方笼子之上出现更低价
                         self.bid_cage_upper_ex_min_level_price = order.price
                         self.bid_cage_upper_ex_min_level_qty = order.qty
-                        self.DBG(
-                            f"Refresh bid_cage_upper_ex_min_level_price={self.bid_cage_upper_ex_min_level_price} by new price"
-                        )
+                        if self.DBG_ON:
+                            self.DBG(
+                                f"Refresh bid_cage_upper_ex_min_level_price={self.bid_cage_upper_ex_min_level_price} by new price"
+                            )
+
+                if (
+                    self.bid_cage_upper_ex_min_level_qty
+                    and order.price >= self.bid_cage_upper_ex_min_level_price
+                ):  # 新价格档在笼子外
+                    self.bid_cage_levels.insert(order.price, self.bid_level_tree)
 
             if not outOfCage:
                 self.BidWeightSize += order.qty
                 self.BidWeightValue += order.price * order.qty
 
         elif order.side == SIDE.ASK:
-            self._export_level_access(
-                f"LEVEL_ACCESS ASK locate {order.price} //insertOrder"
-            )
-            if order.price in self.ask_level_tree:
-                self.ask_level_tree[order.price].qty += order.qty
+            if self.TRACE_ON:
                 self._export_level_access(
-                    f"LEVEL_ACCESS ASK writeback {order.price} //insertOrder"
+                    f"LEVEL_ACCESS ASK locate {order.price} //insertOrder"
                 )
+            if order.price in self.ask_level_tree:
+                qty = self.ask_level_tree.add_qty(order.price, order.qty)
+                self.ask_top_levels.update(order.price, qty)
+                if self.depth is not None:
+                    self.depth.update(SIDE.ASK, order.price, qty)
+                if self.ckpt_ask_levels is not None:
+                    self.ckpt_ask_levels[order.price] = qty
+                if self.TRACE_ON:
+                    self._export_level_access(
+                        f"LEVEL_ACCESS ASK writeback {order.price} //insertOrder"
+                    )
                 if order.price == self.ask_min_level_price:
                     self.ask_min_level_qty += order.qty
                 if (
@@ -1194,9 +2751,15 @@ class AXOB:
             else:
                 node = level_node(order.price, order.qty, order.applSeqNum)
                 self.ask_level_tree[order.price] = node
-                self._export_level_access(
-                    f"LEVEL_ACCESS ASK insert {order.price} //insertOrder"
-                )
+                self.ask_top_levels.update(order.price, order.qty)
+                if self.depth is not None:
+                    self.depth.insert(SIDE.ASK, order.price, order.qty)
+                if self.ckpt_ask_levels is not None:
+                    self.ckpt_ask_levels[order.price] = order.qty
+                if self.TRACE_ON:
+                    self._export_level_access(
+                        f"LEVEL_ACCESS ASK insert {order.price} //insertOrder"
+                    )
 
                 if order.price == PRICE_MAXIMUM:
                     self.AskWeightPx_uncertain = True  # 价格越界后，卖出均价将无法确定
@@ -1209,11 +2772,13 @@ class AXOB:
                         self.ask_min_level_price = order.price
                         self.ask_min_level_qty = order.qty
 
-                        self.bid_cage_ref_px = order.price
-                        self.DBG(f"Bid cage ref px={self.bid_cage_ref_px}")
+                        self._setBidCageRef(order.price)
+                        if self.DBG_ON:
+                            self.DBG(f"Bid cage ref px={self.bid_cage_ref_px}")
                         if not self.bid_max_level_qty:  # 没有对手价
-                            self.ask_cage_ref_px = order.price
-                            self.DBG(f"Ask cage ref px={self.ask_cage_ref_px}")
+                            self._setAskCageRef(order.price)
+                            if self.DBG_ON:
+                                self.DBG(f"Ask cage ref px={self.ask_cage_ref_px}")
                         self.bid_waiting_for_cage = (
                             True
                             if self.market_subtype == MARKET_SUBTYPE.SZSE_STK_GEM
@@ -1227,9 +2792,16 @@ class AXOB:
                     ):  # 买方笼子之下出现更高价
                         self.ask_cage_lower_ex_max_level_price = order.price
                         self.ask_cage_lower_ex_max_level_qty = order.qty
-                        self.DBG(
-                            f"Refresh ask_cage_lower_ex_max_level_price={self.ask_cage_lower_ex_max_level_price} by new price"
-                        )
+                        if self.DBG_ON:
+                            self.DBG(
+                                f"Refresh ask_cage_lower_ex_max_level_price={self.ask_cage_lower_ex_max_level_price} by new price"
+                            )
+
+                if (
+                    self.ask_cage_lower_ex_max_level_qty
+                    and order.price <= self.ask_cage_lower_ex_max_level_price
+                ):  # 新价格档在笼子外
+                    self.ask_cage_levels.insert(order.price, self.ask_level_tree)
 
             if not outOfCage:
                 if (
@@ -1248,27 +2820,60 @@ class AXOB:
         逐笔成交入口
         跳转到处理成交或处理撤单
         """
-        self.DBG(f"msg#{self.msg_nb} onExec:{exec}")
-        if exec.ExecType_str == "成交" or self.SecurityIDSource == SecurityIDSource_SSE:
-            _exec = ob_exec(exec, self.instrument_type)
+        if self.DBG_ON:
+            self.DBG(f"msg#{self.msg_nb} onExec:{exec}")
+        self.onExecRow(
+            exec.ApplSeqNum,
+            exec.ExecType,
+            exec.BidApplSeqNum,
+            exec.OfferApplSeqNum,
+            exec.LastPx,
+            exec.LastQty,
+            exec.TransactTime,
+        )
+
+    def onExecRow(
+        self,
+        ApplSeqNum,
+        ExecType,
+        BidApplSeqNum,
+        OfferApplSeqNum,
+        LastPx,
+        LastQty,
+        TransactTime,
+    ):
+        """同onExec，参数为逐笔成交的原始字段，批量入口不经消息对象调用"""
+        if self.decoder.exectype_of(ExecType) == EXEC_TYPE.TRADE:
+            _exec = ob_exec.of_row(
+                self.decoder,
+                self.instrument_type,
+                ApplSeqNum,
+                BidApplSeqNum,
+                OfferApplSeqNum,
+                LastPx,
+                LastQty,
+                TransactTime,
+                self.conv.tpm_in(TransactTime),
+            )
             self.onTrade(_exec)
         else:
             # only SecurityIDSource_SZSE
-            if exec.BidApplSeqNum != 0:  # 撤销bid
-                cancel_seq = exec.BidApplSeqNum
+            if BidApplSeqNum != 0:  # 撤销bid
+                cancel_seq = BidApplSeqNum
                 Side = SIDE.BID
             else:  # 撤销ask
-                cancel_seq = exec.OfferApplSeqNum
+                cancel_seq = OfferApplSeqNum
                 Side = SIDE.ASK
             _cancel = ob_cancel(
                 cancel_seq,
-                exec.LastQty,
-                exec.LastPx,
+                LastQty,
+                LastPx,
                 Side,
-                exec.TransactTime,
+                TransactTime,
                 self.SecurityIDSource,
                 self.instrument_type,
                 self.SecurityID,
+                self.conv,
             )
             self.onCancel(_cancel)
 
@@ -1278,66 +2883,9 @@ class AXOB:
         self.NumTrades += 1
         self.TotalVolumeTrade += exec.LastQty
 
-        if self.SecurityIDSource == SecurityIDSource_SZSE:
-            # 乘法输入：深圳(Qty精度2位、price精度2位or3位小数)；输出TotalValueTrade深圳(精度4位小数)
-            if self.instrument_type == INSTRUMENT_TYPE.STOCK:
-                self.TotalValueTrade += int(
-                    exec.LastQty
-                    * exec.LastPx
-                    / (
-                        QTY_INTER_SZSE_PRECISION
-                        * PRICE_INTER_STOCK_PRECISION
-                        // msg_util.TOTALVALUETRADE_SZSE_PRECISION
-                    )
-                )  # 2x2->4
-            elif self.instrument_type == INSTRUMENT_TYPE.FUND:
-                self.TotalValueTrade += int(
-                    exec.LastQty
-                    * exec.LastPx
-                    / (
-                        QTY_INTER_SZSE_PRECISION
-                        * PRICE_INTER_FUND_PRECISION
-                        // msg_util.TOTALVALUETRADE_SZSE_PRECISION
-                    )
-                )  # 2x3->4
-            elif self.instrument_type == INSTRUMENT_TYPE.KZZ:
-                self.TotalValueTrade += int(
-                    exec.LastQty
-                    * exec.LastPx
-                    / (
-                        QTY_INTER_SZSE_PRECISION
-                        * PRICE_INTER_KZZ_PRECISION
-                        // msg_util.TOTALVALUETRADE_SZSE_PRECISION
-                    )
-                )  # 2x3->4
-            else:
-                self.TotalValueTrade += None
-        elif self.SecurityIDSource == SecurityIDSource_SSE:
-            # 乘法输入：上海(Qty精度3位、price精度2位or3位小数)；输出TotalValueTrade上海(精度5位小数)
-            if self.instrument_type == INSTRUMENT_TYPE.STOCK:
-                self.TotalValueTrade += int(
-                    exec.LastQty
-                    * exec.LastPx
-                    / (
-                        QTY_INTER_SSE_PRECISION
-                        * PRICE_INTER_STOCK_PRECISION
-                        // msg_util.TOTALVALUETRADE_SSE_PRECISION
-                    )
-                )  # 3x2 -> 5
-            elif self.instrument_type == INSTRUMENT_TYPE.FUND:
-                self.TotalValueTrade += int(
-                    exec.LastQty
-                    * exec.LastPx
-                    / (
-                        QTY_INTER_SSE_PRECISION
-                        * PRICE_INTER_FUND_PRECISION
-                        // msg_util.TOTALVALUETRADE_SZSE_PRECISION
-                    )
-                )  # 3x3->5
-            else:
-                self.TotalValueTrade += None
-        else:
-            self.TotalValueTrade += None
+        # 乘法输入：深圳(Qty精度2位、price精度2位or3位小数)，上海(Qty精度3位、price精度2位or3位小数)
+        # 输出TotalValueTrade：深圳精度4位小数，上海精度5位小数
+        self.TotalValueTrade += int(exec.LastQty * exec.LastPx / self.conv.value_rd)
 
         self.LastPx = exec.LastPx
         if self.OpenPx == 0:
@@ -1374,7 +2922,8 @@ class AXOB:
                 if exec.BidApplSeqNum == self.holding_order.applSeqNum
                 else SIDE.BID
             )  # level_side:缓存单的对手盘
-            self.DBG(f"level_side={level_side}")
+            if self.DBG_ON:
+                self.DBG(f"level_side={level_side}")
             assert (
                 self.holding_order.qty >= exec.LastQty
             ), f"{self.SecurityID:06d} holding order Qty unmatch"
@@ -1454,13 +3003,40 @@ class AXOB:
                     self.TradingPhaseMarket = exec.TradingPhaseMarket
                 self.genSnap()  # 集合竞价所有成交完成
 
+    def _setBidCageRef(self, px):
+        """买方笼子基准价，同时算出笼子上沿，省去每次判断笼子时重算"""
+        self.bid_cage_ref_px = px
+        self.bid_cage_upper_px = CYB_cage_upper(px)
+
+    def _setAskCageRef(self, px):
+        """卖方笼子基准价，同时算出笼子下沿"""
+        self.ask_cage_ref_px = px
+        self.ask_cage_lower_px = CYB_cage_lower(px)
+
+    def _rebuildCageLevels(self):
+        """按笼子外边界从价格档重建隐藏档，加载后使用"""
+        self.bid_cage_levels = cage_levels(True)
+        self.bid_cage_levels.rebuild(
+            self.bid_level_tree,
+            self.bid_cage_upper_ex_min_level_price
+            if self.bid_cage_upper_ex_min_level_qty
+            else None,
+        )
+        self.ask_cage_levels = cage_levels(False)
+        self.ask_cage_levels.rebuild(
+            self.ask_level_tree,
+            self.ask_cage_lower_ex_max_level_price
+            if self.ask_cage_lower_ex_max_level_qty
+            else None,
+        )
+
     def enterCage(self):
         """判断订单是否可进入笼子，若进入笼子，判断是否可以成交"""
         while True:
             if (
                 self.bid_cage_upper_ex_min_level_qty
                 and self.bid_cage_upper_ex_min_level_price
-                <= CYB_cage_upper(self.bid_cage_ref_px)
+                <= self.bid_cage_upper_px
             ):  # 买方隐藏订单可以进入笼子
                 if (
                     self.ask_min_level_qty
@@ -1468,10 +3044,11 @@ class AXOB:
                     >= self.ask_min_level_price
                     and self.TradingPhaseMarket != axsbe_base.TPM.VolatilityBreaking
                 ):  # 可与卖方最优成交
-                    self.DBG(
-                        f"ASK px may changed: waiting for BID level"
-                        f"({self.bid_cage_upper_ex_min_level_price} x {self.bid_cage_upper_ex_min_level_qty}) to enter cage & exec"
-                    )
+                    if self.DBG_ON:
+                        self.DBG(
+                            f"ASK px may changed: waiting for BID level"
+                            f"({self.bid_cage_upper_ex_min_level_price} x {self.bid_cage_upper_ex_min_level_qty}) to enter cage & exec"
+                        )
                     break
                 else:  # 无法成交，将隐藏订单加到买方队列
                     self.bid_max_level_price = self.bid_cage_upper_ex_min_level_price
@@ -1483,11 +3060,13 @@ class AXOB:
                     )
                     self.DBG("BID order enter cage and became max level")
 
-                    self.ask_cage_ref_px = self.bid_max_level_price
-                    self.DBG(f"ASK cage ref px={self.ask_cage_ref_px}")
+                    self._setAskCageRef(self.bid_max_level_price)
+                    if self.DBG_ON:
+                        self.DBG(f"ASK cage ref px={self.ask_cage_ref_px}")
                     if not self.ask_min_level_qty:
-                        self.bid_cage_ref_px = self.bid_max_level_price
-                        self.DBG(f"Bid cage ref px={self.bid_cage_ref_px}")
+                        self._setBidCageRef(self.bid_max_level_price)
+                        if self.DBG_ON:
+                            self.DBG(f"Bid cage ref px={self.bid_cage_ref_px}")
 
                     self.ask_waiting_for_cage = (
                         True
@@ -1497,26 +3076,26 @@ class AXOB:
 
                     # 下一个隐藏订单，继续循环，直到无隐藏订单、隐藏订单可成交
                     self.bid_cage_upper_ex_min_level_qty = 0
-                    self._export_level_access(
-                        f"LEVEL_ACCESS BID locate_higher {self.bid_cage_upper_ex_min_level_price} //enterCage:find next order out of cage"
-                    )
-                    for p, l in sorted(
-                        self.bid_level_tree.items(), key=lambda x: x[0], reverse=False
-                    ):  # 从小到大遍历
-                        if p > self.bid_cage_upper_ex_min_level_price:
-                            self.bid_cage_upper_ex_min_level_price = p
-                            self.bid_cage_upper_ex_min_level_qty = l.qty
+                    self.bid_cage_levels.pop_next()
+                    if self.TRACE_ON:
+                        self._export_level_access(
+                            f"LEVEL_ACCESS BID cage_next {self.bid_cage_upper_ex_min_level_price} //enterCage:find next order out of cage"
+                        )
+                    p = self.bid_cage_levels.next()
+                    if p is not None:
+                        self.bid_cage_upper_ex_min_level_price = p
+                        self.bid_cage_upper_ex_min_level_qty = self.bid_level_tree.qty_of(p)
+                        if self.DBG_ON:
                             self.DBG(
                                 f"Refresh bid_cage_upper_ex_min_level_price={self.bid_cage_upper_ex_min_level_price} by prev bid level enter cage"
                             )
-                            break
             else:
                 self.bid_waiting_for_cage = False
 
             if (
                 self.ask_cage_lower_ex_max_level_qty
                 and self.ask_cage_lower_ex_max_level_price
-                >= CYB_cage_lower(self.ask_cage_ref_px)
+                >= self.ask_cage_lower_px
             ):  # 卖方隐藏订单可以进入笼子
                 if (
                     self.bid_max_level_qty
@@ -1524,10 +3103,11 @@ class AXOB:
                     <= self.bid_max_level_price
                     and self.TradingPhaseMarket != axsbe_base.TPM.VolatilityBreaking
                 ):  # 可与买方最优成交
-                    self.DBG(
-                        f"BID px may changed: waiting for ASK level"
-                        f"({self.ask_cage_lower_ex_max_level_price} x {self.ask_cage_lower_ex_max_level_qty}) to enter cage & exec"
-                    )
+                    if self.DBG_ON:
+                        self.DBG(
+                            f"BID px may changed: waiting for ASK level"
+                            f"({self.ask_cage_lower_ex_max_level_price} x {self.ask_cage_lower_ex_max_level_qty}) to enter cage & exec"
+                        )
                     break
                 else:  # 无法成交，将隐藏订单加到买方队列
                     self.ask_min_level_price = self.ask_cage_lower_ex_max_level_price
@@ -1539,11 +3119,13 @@ class AXOB:
                     )
                     self.DBG("ASK order enter cage and became min level")
 
-                    self.bid_cage_ref_px = self.ask_min_level_price
-                    self.DBG(f"BID cage ref px={self.bid_cage_ref_px}")
+                    self._setBidCageRef(self.ask_min_level_price)
+                    if self.DBG_ON:
+                        self.DBG(f"BID cage ref px={self.bid_cage_ref_px}")
                     if not self.bid_max_level_qty:
-                        self.ask_cage_ref_px = self.ask_min_level_price
-                        self.DBG(f"Ask cage ref px={self.ask_cage_ref_px}")
+                        self._setAskCageRef(self.ask_min_level_price)
+                        if self.DBG_ON:
+                            self.DBG(f"Ask cage ref px={self.ask_cage_ref_px}")
 
                     self.bid_waiting_for_cage = (
                         True
@@ -1552,19 +3134,19 @@ class AXOB:
                     )  # 卖方最优价被修改，则判断买方隐藏订单
 
                     self.ask_cage_lower_ex_max_level_qty = 0
-                    self._export_level_access(
-                        f"LEVEL_ACCESS ASK locate_lower {self.ask_cage_lower_ex_max_level_price} //enterCage:find next order out of cage"
-                    )
-                    for p, l in sorted(
-                        self.ask_level_tree.items(), key=lambda x: x[0], reverse=True
-                    ):  # 从大到小遍历
-                        if p < self.ask_cage_lower_ex_max_level_price:
-                            self.ask_cage_lower_ex_max_level_price = p
-                            self.ask_cage_lower_ex_max_level_qty = l.qty
+                    self.ask_cage_levels.pop_next()
+                    if self.TRACE_ON:
+                        self._export_level_access(
+                            f"LEVEL_ACCESS ASK cage_next {self.ask_cage_lower_ex_max_level_price} //enterCage:find next order out of cage"
+                        )
+                    p = self.ask_cage_levels.next()
+                    if p is not None:
+                        self.ask_cage_lower_ex_max_level_price = p
+                        self.ask_cage_lower_ex_max_level_qty = self.ask_level_tree.qty_of(p)
+                        if self.DBG_ON:
                             self.DBG(
                                 f"Refresh ask_cage_lower_ex_max_level_price={self.ask_cage_lower_ex_max_level_price} by prev ask level enter cage"
                             )
-                            break
             else:
                 self.ask_waiting_for_cage = False
 
@@ -1572,11 +3154,20 @@ class AXOB:
                 break
 
     def tradeLimit(self, side: SIDE, Qty, appSeqNum):
-        if appSeqNum not in self.order_map:
+        filled = self.order_map.fill(appSeqNum, Qty)  # 扣减剩余数量，全部成交时出簿；order_map只保留在簿订单
+        if filled is None:  # 如已全部成交出簿后重复/迟到的成交
             self.ERR(f"traded order #{appSeqNum} not found!")
-        order = self.order_map[appSeqNum]
-        # order.qty -= Qty
-        self.levelDequeue(side, order.price, Qty, appSeqNum)
+            return
+        price, remain = filled
+        ckpt_orders = self.ckpt_orders
+        if ckpt_orders is not None:
+            if remain <= 0:
+                ckpt_orders[appSeqNum] = ORDER_DELTA_OP.REMOVE
+            elif appSeqNum not in ckpt_orders:  # 本检查点内新入列的仍按INSERT写出
+                ckpt_orders[appSeqNum] = ORDER_DELTA_OP.UPDATE
+        self.levelDequeue(side, price, Qty, appSeqNum)
+        if remain < 0:
+            self.ERR(f"traded order #{appSeqNum} over filled, qty={remain}!")
 
     def onCancel(self, cancel: ob_cancel):
         """
@@ -1611,12 +3202,11 @@ class AXOB:
                 ):  # 撤销缓存单，holding_nb清空即可
                     return
 
-        if cancel.applSeqNum in self.order_map:
-            order = self.order_map.pop(
-                cancel.applSeqNum
-            )  # 注意order.qty是旧值。实际可以不用pop。
-
-            self.levelDequeue(cancel.side, order.price, cancel.qty, cancel.applSeqNum)
+        price = self.order_map.remove(cancel.applSeqNum)  # 剩余数量应与cancel.qty一致
+        if price is not None:
+            if self.ckpt_orders is not None:
+                self.ckpt_orders[cancel.applSeqNum] = ORDER_DELTA_OP.REMOVE
+            self.levelDequeue(cancel.side, price, cancel.qty, cancel.applSeqNum)
             if self.market_subtype == MARKET_SUBTYPE.SZSE_STK_GEM:
                 self.enterCage()
 
@@ -1624,14 +3214,19 @@ class AXOB:
         elif cancel.applSeqNum in self.illegal_order_map:
             self.illegal_order_map.pop(cancel.applSeqNum)
         else:
-            self.ERR(f"cancel AppSeqNum={cancel.applSeqNum} not found!")
-            raise "cancel AppSeqNum not found!"
+            self.ERR(f"cancel AppSeqNum={cancel.applSeqNum} not found!")  # 如撤已全部成交出列的订单
 
     def levelDequeue(self, side, price, qty, applSeqNum):
         """买/卖方价格档出列（撤单或成交时）"""
         if side == SIDE.BID:
-            self.bid_level_tree[price].qty -= qty
-            self._export_level_access(f"LEVEL_ACCESS BID locate {price} //levelDequeue")
+            remain = self.bid_level_tree.sub_qty(price, qty)
+            self.bid_top_levels.update(price, remain)
+            if self.depth is not None:
+                self.depth.update(SIDE.BID, price, remain)
+            if self.ckpt_bid_levels is not None:
+                self.ckpt_bid_levels[price] = remain
+            if self.TRACE_ON:
+                self._export_level_access(f"LEVEL_ACCESS BID locate {price} //levelDequeue")
             # self.bid_level_tree[price].ts.remove(applSeqNum)
             if price == self.bid_max_level_price:
                 self.bid_max_level_qty -= qty
@@ -1651,53 +3246,52 @@ class AXOB:
                     self.bid_cage_upper_ex_min_level_qty == 0
                 ):  # 买方价格笼子外最低价被cancel/trade光
                     # locate next high bid level
-                    self._export_level_access(
-                        f"LEVEL_ACCESS BID locate_higher {self.bid_cage_upper_ex_min_level_price} //levelDequeue:find next level out of cage"
-                    )
-                    for p, l in sorted(
-                        self.bid_level_tree.items(), key=lambda x: x[0], reverse=False
-                    ):  # 从小到大遍历，TODO:可以先判断是否存在
-                        if p > self.bid_cage_upper_ex_min_level_price:
-                            self.bid_cage_upper_ex_min_level_price = p
-                            self.bid_cage_upper_ex_min_level_qty = l.qty
+                    self.bid_cage_levels.pop_next()
+                    if self.TRACE_ON:
+                        self._export_level_access(
+                            f"LEVEL_ACCESS BID cage_next {self.bid_cage_upper_ex_min_level_price} //levelDequeue:find next level out of cage"
+                        )
+                    p = self.bid_cage_levels.next()
+                    if p is not None:
+                        self.bid_cage_upper_ex_min_level_price = p
+                        self.bid_cage_upper_ex_min_level_qty = self.bid_level_tree.qty_of(p)
+                        if self.DBG_ON:
                             self.DBG(
                                 f"Refresh bid_cage_upper_ex_min_level_price={self.bid_cage_upper_ex_min_level_price} by canceled/traded all"
                             )
-                            break
 
-            if self.bid_level_tree[price].qty == 0:
+            if remain == 0:
                 if price == self.bid_max_level_price:  # 买方最高价被cancel/trade光
                     self.bid_max_level_qty = 0
                     # locate next lower bid level
-                    self._export_level_access(
-                        f"LEVEL_ACCESS BID locate_lower {self.bid_max_level_price} //levelDequeue:find next side level"
-                    )
-                    for p, l in sorted(
-                        self.bid_level_tree.items(), key=lambda x: x[0], reverse=True
-                    ):  # 从大到小遍历
-                        if p < self.bid_max_level_price:
-                            self.bid_max_level_price = p
-                            self.bid_max_level_qty = l.qty
-                            break
+                    if self.TRACE_ON:
+                        self._export_level_access(
+                            f"LEVEL_ACCESS BID locate_lower {self.bid_max_level_price} //levelDequeue:find next side level"
+                        )
+                    l = self.bid_level_tree.locate_lower_pq(self.bid_max_level_price)
+                    if l is not None:
+                        self.bid_max_level_price, self.bid_max_level_qty = l
 
                     # 修改卖方价格笼子参考价
                     if self.bid_max_level_qty != 0:  # 买方还有下一档
-                        self.ask_cage_ref_px = self.bid_max_level_price
+                        self._setAskCageRef(self.bid_max_level_price)
                     else:
-                        self._export_level_access(
-                            f"LEVEL_ACCESS ASK locate {price} //levelDequeue:update oppo ref px"
-                        )
+                        if self.TRACE_ON:
+                            self._export_level_access(
+                                f"LEVEL_ACCESS ASK locate {price} //levelDequeue:update oppo ref px"
+                            )
                         if (
                             price in self.ask_level_tree
                         ):  # 卖方本价位有量(此时ask_min_level_price可能是旧的)
-                            self.ask_cage_ref_px = price  # TODO: 卖方hold?
+                            self._setAskCageRef(price)  # TODO: 卖方hold?
                         elif self.ask_min_level_qty != 0:
-                            self.ask_cage_ref_px = self.ask_min_level_price
+                            self._setAskCageRef(self.ask_min_level_price)
                         else:
-                            self.ask_cage_ref_px = (
+                            self._setAskCageRef(
                                 self.LastPx
                             )  # 一旦lastPx被更新，总会到这里，而此后就不会再用PreClosePx了
-                    self.DBG(f"Ask cage ref px={self.ask_cage_ref_px}")
+                    if self.DBG_ON:
+                        self.DBG(f"Ask cage ref px={self.ask_cage_ref_px}")
 
                     if (
                         self.TradingPhaseMarket == axsbe_base.TPM.AMTrading
@@ -1712,18 +3306,27 @@ class AXOB:
                         self.ask_waiting_for_cage = False
 
                 # remove要在locate_lower之后
-                self.bid_level_tree.pop(price)
-                self._export_level_access(
-                    f"LEVEL_ACCESS BID remove {price} //levelDequeue"
-                )
+                del self.bid_level_tree[price]
+                self.bid_cage_levels.discard(price)
+                if self.TRACE_ON:
+                    self._export_level_access(
+                        f"LEVEL_ACCESS BID remove {price} //levelDequeue"
+                    )
             else:
-                self._export_level_access(
-                    f"LEVEL_ACCESS BID writeback {price} //levelDequeue"
-                )
+                if self.TRACE_ON:
+                    self._export_level_access(
+                        f"LEVEL_ACCESS BID writeback {price} //levelDequeue"
+                    )
 
         else:  ## side == SIDE.ASK:
-            self.ask_level_tree[price].qty -= qty
-            self._export_level_access(f"LEVEL_ACCESS ASK locate {price} //levelDequeue")
+            remain = self.ask_level_tree.sub_qty(price, qty)
+            self.ask_top_levels.update(price, remain)
+            if self.depth is not None:
+                self.depth.update(SIDE.ASK, price, remain)
+            if self.ckpt_ask_levels is not None:
+                self.ckpt_ask_levels[price] = remain
+            if self.TRACE_ON:
+                self._export_level_access(f"LEVEL_ACCESS ASK locate {price} //levelDequeue")
             # self.ask_level_tree[price].ts.remove(applSeqNum)
             if price == self.ask_min_level_price:
                 self.ask_min_level_qty -= qty
@@ -1750,56 +3353,55 @@ class AXOB:
                     self.ask_cage_lower_ex_max_level_qty == 0
                 ):  # 卖方价格笼子外最高价被cancel/trade光
                     # locate next high bid level
-                    self._export_level_access(
-                        f"LEVEL_ACCESS ASK locate_lower {self.ask_cage_lower_ex_max_level_price} //levelDequeue:find next level out of cage"
-                    )
-                    for p, l in sorted(
-                        self.ask_level_tree.items(), key=lambda x: x[0], reverse=True
-                    ):  # 从大到小遍历，TODO:可以先判断是否存在
-                        if p < self.ask_cage_lower_ex_max_level_price:
-                            self.ask_cage_lower_ex_max_level_price = p
-                            self.ask_cage_lower_ex_max_level_qty = l.qty
+                    self.ask_cage_levels.pop_next()
+                    if self.TRACE_ON:
+                        self._export_level_access(
+                            f"LEVEL_ACCESS ASK cage_next {self.ask_cage_lower_ex_max_level_price} //levelDequeue:find next level out of cage"
+                        )
+                    p = self.ask_cage_levels.next()
+                    if p is not None:
+                        self.ask_cage_lower_ex_max_level_price = p
+                        self.ask_cage_lower_ex_max_level_qty = self.ask_level_tree.qty_of(p)
+                        if self.DBG_ON:
                             self.DBG(
                                 f"Refresh ask_cage_lower_ex_max_level_price={self.ask_cage_lower_ex_max_level_price} by canceled/traded all"
                             )
-                            break
 
-            if self.ask_level_tree[price].qty == 0:
+            if remain == 0:
                 if price == PRICE_MAXIMUM:
                     self.AskWeightPx_uncertain = False  # 加权价又可确定了
 
                 if price == self.ask_min_level_price:  # 卖方最低价被cancel/trade光
                     # locate next higher ask level
                     self.ask_min_level_qty = 0
-                    self._export_level_access(
-                        f"LEVEL_ACCESS ASK locate_higher {self.ask_min_level_price} //levelDequeue:find next side level"
-                    )
-                    for p, l in sorted(
-                        self.ask_level_tree.items(), key=lambda x: x[0], reverse=False
-                    ):  # 从小到大遍历
-                        if p > self.ask_min_level_price:
-                            self.ask_min_level_price = p
-                            self.ask_min_level_qty = l.qty
-                            break
+                    if self.TRACE_ON:
+                        self._export_level_access(
+                            f"LEVEL_ACCESS ASK locate_higher {self.ask_min_level_price} //levelDequeue:find next side level"
+                        )
+                    l = self.ask_level_tree.locate_higher_pq(self.ask_min_level_price)
+                    if l is not None:
+                        self.ask_min_level_price, self.ask_min_level_qty = l
 
                     # 修改买方价格笼子参考价
                     if self.ask_min_level_qty != 0:  # 卖方还有下一档
-                        self.bid_cage_ref_px = self.ask_min_level_price
+                        self._setBidCageRef(self.ask_min_level_price)
                     else:
-                        self._export_level_access(
-                            f"LEVEL_ACCESS BID locate {price} //levelDequeue:update oppo ref px"
-                        )
+                        if self.TRACE_ON:
+                            self._export_level_access(
+                                f"LEVEL_ACCESS BID locate {price} //levelDequeue:update oppo ref px"
+                            )
                         if (
                             price in self.bid_level_tree
                         ):  # 买方本价位有量(此时bid_max_level_price可能是旧的)
-                            self.bid_cage_ref_px = price  # TODO: 买方hold?
+                            self._setBidCageRef(price)  # TODO: 买方hold?
                         elif self.bid_max_level_qty != 0:
-                            self.bid_cage_ref_px = self.bid_max_level_price
+                            self._setBidCageRef(self.bid_max_level_price)
                         else:
-                            self.bid_cage_ref_px = (
+                            self._setBidCageRef(
                                 self.LastPx
                             )  # 一旦lastPx被更新，总会到这里，而此后就不会再用PreClosePx了
-                    self.DBG(f"Bid cage ref px={self.bid_cage_ref_px}")
+                    if self.DBG_ON:
+                        self.DBG(f"Bid cage ref px={self.bid_cage_ref_px}")
 
                     if (
                         self.TradingPhaseMarket == axsbe_base.TPM.AMTrading
@@ -1814,17 +3416,21 @@ class AXOB:
                         self.bid_waiting_for_cage = False
 
                 # remove要在locate_lower之后
-                self.ask_level_tree.pop(price)
-                self._export_level_access(
-                    f"LEVEL_ACCESS ASK remove {price} //levelDequeue"
-                )
+                del self.ask_level_tree[price]
+                self.ask_cage_levels.discard(price)
+                if self.TRACE_ON:
+                    self._export_level_access(
+                        f"LEVEL_ACCESS ASK remove {price} //levelDequeue"
+                    )
             else:
-                self._export_level_access(
-                    f"LEVEL_ACCESS ASK writeback {price} //levelDequeue"
-                )
+                if self.TRACE_ON:
+                    self._export_level_access(
+                        f"LEVEL_ACCESS ASK writeback {price} //levelDequeue"
+                    )
 
     def onSnap(self, snap: axsbe_snap_stock):
-        self.DBG(f"msg#{self.msg_nb} onSnap:{snap}")
+        if self.DBG_ON:
+            self.DBG(f"msg#{self.msg_nb} onSnap:{snap}")
         if snap.TradingPhaseSecurity != axsbe_base.TPI.Normal:
             if (
                 self.SecurityIDSource == SecurityIDSource_SZSE
@@ -1846,91 +3452,25 @@ class AXOB:
         ):  # 每天最早的一批快照(7点半前)是没有涨停价、跌停价的，不能只锁一次
             self.constantValue_ready = True
             if self.ChannelNo == CHANNELNO_INIT:
-                self.DBG(
-                    f"Update constatant: ChannelNo={snap.ChannelNo}, PrevClosePx={snap.PrevClosePx}, UpLimitPx={snap.UpLimitPx}, DnLimitPx={snap.DnLimitPx}"
-                )
+                if self.DBG_ON:
+                    self.DBG(
+                        f"Update constatant: ChannelNo={snap.ChannelNo}, PrevClosePx={snap.PrevClosePx}, UpLimitPx={snap.UpLimitPx}, DnLimitPx={snap.DnLimitPx}"
+                    )
 
             self.ChannelNo = snap.ChannelNo
-            if self.SecurityIDSource == SecurityIDSource_SZSE:
-                if self.instrument_type == INSTRUMENT_TYPE.STOCK:
-                    self.PrevClosePx = snap.PrevClosePx // (
-                        msg_util.PRICE_SZSE_SNAP_PRECLOSE_PRECISION
-                        // PRICE_INTER_STOCK_PRECISION
-                    )
-                elif self.instrument_type == INSTRUMENT_TYPE.FUND:
-                    self.PrevClosePx = snap.PrevClosePx // (
-                        msg_util.PRICE_SZSE_SNAP_PRECLOSE_PRECISION
-                        // PRICE_INTER_FUND_PRECISION
-                    )
-                elif self.instrument_type == INSTRUMENT_TYPE.KZZ:
-                    self.PrevClosePx = snap.PrevClosePx // (
-                        msg_util.PRICE_SZSE_SNAP_PRECLOSE_PRECISION
-                        // PRICE_INTER_KZZ_PRECISION
-                    )
-                else:
-                    raise Exception(
-                        f"instrument_type={self.instrument_type} is not ready!"
-                    )  # TODO:
-            elif self.SecurityIDSource == SecurityIDSource_SSE:
-                if self.instrument_type == INSTRUMENT_TYPE.STOCK:
-                    self.PrevClosePx = snap.PrevClosePx // (
-                        msg_util.PRICE_SSE_PRECISION // PRICE_INTER_STOCK_PRECISION
-                    )
-                elif self.instrument_type == INSTRUMENT_TYPE.FUND:
-                    self.PrevClosePx = snap.PrevClosePx // (
-                        msg_util.PRICE_SSE_PRECISION // PRICE_INTER_FUND_PRECISION
-                    )
-                elif self.instrument_type == INSTRUMENT_TYPE.BOND:
-                    self.PrevClosePx = 0  # 上海债券快照没有带昨收！
-                else:
-                    raise Exception(
-                        f"instrument_type={self.instrument_type} is not ready!"
-                    )  #
-            else:
-                raise Exception(
-                    f"SecurityIDSource={self.SecurityIDSource} is not ready!"
-                )  # TODO:
+            self.PrevClosePx = self.conv.preclose_in(snap.PrevClosePx)
 
             if self.SecurityIDSource == SecurityIDSource_SZSE:
-                self.ask_cage_ref_px = self.PrevClosePx
-                self.bid_cage_ref_px = self.PrevClosePx
-                self.DBG(f"Init Bid cage ref px={self.bid_cage_ref_px}")
+                self._setAskCageRef(self.PrevClosePx)
+                self._setBidCageRef(self.PrevClosePx)
+                if self.DBG_ON:
+                    self.DBG(f"Init Bid cage ref px={self.bid_cage_ref_px}")
 
                 self.UpLimitPx = snap.UpLimitPx
                 self.DnLimitPx = snap.DnLimitPx
 
-                if self.SecurityIDSource == SecurityIDSource_SZSE:
-                    if self.instrument_type == INSTRUMENT_TYPE.STOCK:
-                        self.UpLimitPrice = snap.UpLimitPx // (
-                            msg_util.PRICE_SZSE_SNAP_PRECISION
-                            // PRICE_INTER_STOCK_PRECISION
-                        )
-                        self.DnLimitPrice = snap.DnLimitPx // (
-                            msg_util.PRICE_SZSE_SNAP_PRECISION
-                            // PRICE_INTER_STOCK_PRECISION
-                        )
-                    elif self.instrument_type == INSTRUMENT_TYPE.FUND:
-                        self.UpLimitPrice = snap.UpLimitPx // (
-                            msg_util.PRICE_SZSE_SNAP_PRECISION
-                            // PRICE_INTER_FUND_PRECISION
-                        )
-                        self.DnLimitPrice = snap.DnLimitPx // (
-                            msg_util.PRICE_SZSE_SNAP_PRECISION
-                            // PRICE_INTER_FUND_PRECISION
-                        )
-                    elif self.instrument_type == INSTRUMENT_TYPE.KZZ:
-                        self.UpLimitPrice = snap.UpLimitPx // (
-                            msg_util.PRICE_SZSE_SNAP_PRECISION
-                            // PRICE_INTER_KZZ_PRECISION
-                        )
-                        self.DnLimitPrice = snap.DnLimitPx // (
-                            msg_util.PRICE_SZSE_SNAP_PRECISION
-                            // PRICE_INTER_KZZ_PRECISION
-                        )
-                    else:
-                        raise Exception(
-                            f"instrument_type={self.instrument_type} is not ready!"
-                        )  # TODO:
+                self.UpLimitPrice = snap.UpLimitPx // self.conv.snap_rd
+                self.DnLimitPrice = snap.DnLimitPx // self.conv.snap_rd
             elif self.SecurityIDSource == SecurityIDSource_SSE:
                 pass
             else:
@@ -1938,10 +3478,9 @@ class AXOB:
                     f"SecurityIDSource={self.SecurityIDSource} is not ready!"
                 )  # TODO:
 
-            if self.SecurityIDSource == SecurityIDSource_SZSE:
-                self.YYMMDD = snap.TransactTime // SZSE_TICK_CUT  # 深交所带日期
-            else:
-                self.YYMMDD = 0  # 上交所不带日期
+            self.YYMMDD = self.conv.date_in(snap.TransactTime)
+
+            self._rebuildLevelTree()  # 价格带已知，按价格带重建价格档容器(含SORTED的前缀和网格)
 
         if (
             self.TradingPhaseMarket == axsbe_base.TPM.Ending
@@ -1949,26 +3488,13 @@ class AXOB:
             and not self.closePx_ready
         ):
             if self.SecurityIDSource == SecurityIDSource_SZSE:
-                if self.instrument_type == INSTRUMENT_TYPE.STOCK:
-                    self.LastPx = snap.LastPx // (
-                        msg_util.PRICE_SZSE_SNAP_PRECISION
-                        // PRICE_INTER_STOCK_PRECISION
-                    )
-                elif self.instrument_type == INSTRUMENT_TYPE.FUND:
-                    self.LastPx = snap.LastPx // (
-                        msg_util.PRICE_SZSE_SNAP_PRECISION // PRICE_INTER_FUND_PRECISION
-                    )
-                elif self.instrument_type == INSTRUMENT_TYPE.KZZ:
-                    self.LastPx = snap.LastPx // (
-                        msg_util.PRICE_SZSE_SNAP_PRECISION // PRICE_INTER_KZZ_PRECISION
-                    )
-                else:
-                    pass  # TODO:
+                if self.conv.snap_rd is not None:  # TODO: 其它证券类型
+                    self.LastPx = snap.LastPx // self.conv.snap_rd
             else:
                 self.ERR("SSE ClosePx not checked!")
 
             self.closePx_ready = True
-            self.genSnap()
+            self.genSnap(force=True)
 
         if (
             snap.TradingPhaseMarket == axsbe_base.TPM.VolatilityBreaking
@@ -1977,7 +3503,7 @@ class AXOB:
             self.WARN(f"Enter VolatilityBreaking @{snap.TransactTime}")
             # self.VolatilityBreaking_end_tick = 0
             self.TradingPhaseMarket = axsbe_base.TPM.VolatilityBreaking
-            self.genSnap()
+            self.genSnap(force=True)
 
         ## 检查重建算法，仅用于测试算法是否正确：
         snap._seq = self.msg_nb
@@ -1998,10 +3524,11 @@ class AXOB:
                 and snap.is_same(self.last_snap)
                 and self._chkSnapTimestamp(snap, self.last_snap)
             ):
-                self.DBG(
-                    f"market snap #{self.msg_nb}({snap.TransactTime})"
-                    + f" matches last rebuilt snap #{self.last_snap._seq}({self.last_snap.TransactTime})"
-                )
+                if self.DBG_ON:
+                    self.DBG(
+                        f"market snap #{self.msg_nb}({snap.TransactTime})"
+                        + f" matches last rebuilt snap #{self.last_snap._seq}({self.last_snap.TransactTime})"
+                    )
                 ks = list(self.rebuilt_snaps.keys())
                 for k in ks:
                     if k < snap.NumTrades:
@@ -2012,10 +3539,11 @@ class AXOB:
                 if snap.NumTrades in self.rebuilt_snaps:
                     for gen in self.rebuilt_snaps[snap.NumTrades]:
                         if snap.is_same(gen) and self._chkSnapTimestamp(snap, gen):
-                            self.DBG(
-                                f"market snap #{self.msg_nb}({snap.TransactTime})"
-                                + f" matches history rebuilt snap #{gen._seq}({gen.TransactTime})"
-                            )
+                            if self.DBG_ON:
+                                self.DBG(
+                                    f"market snap #{self.msg_nb}({snap.TransactTime})"
+                                    + f" matches history rebuilt snap #{gen._seq}({gen.TransactTime})"
+                                )
                             matched = True
                             break
 
@@ -2033,7 +3561,18 @@ class AXOB:
                         f"market snap #{self.msg_nb}({snap.TransactTime}) not found in history rebuilt snaps!"
                     )
 
-    def genSnap(self):
+    def genSnap(self, force=False):
+        """
+        生成重建快照
+        force: PER_TICK时也立即生成（阶段切换），否则只标记，等时戳前进时由flushSnap生成
+        """
+        if self.snap_emit == SNAP_EMIT.OFF:
+            return
+        if self.snap_emit == SNAP_EMIT.PER_TICK and not force:
+            self.snap_dirty = True
+            return
+        self.snap_dirty = False
+
         assert (
             self.TradingPhaseMarket == axsbe_base.TPM.VolatilityBreaking
             or self.holding_nb == 0
@@ -2067,7 +3606,8 @@ class AXOB:
 
         ## 调试数据，仅用于测试算法是否正确：
         if snap is not None:
-            self.DBG(snap)
+            if self.DBG_ON:
+                self.DBG(snap)
 
             if (
                 (
@@ -2108,74 +3648,286 @@ class AXOB:
             else:
                 self.rebuilt_snaps[snap.NumTrades].append(snap)
 
+            if self.snap_sink is not None:
+                self.snap_sink(snap)
+
+    def set_snap_emit(self, snap_emit: SNAP_EMIT):
+        """切换快照生成时机，切换前先出合并中的快照"""
+        self.flushSnap()
+        self.snap_emit = snap_emit
+
+    ## 按需查询：直接读取订单簿，价格为快照精度，与axsbe_snap_stock字段一致
+    def queryLevels(self, side: SIDE, level_nb=10, prices=None, qtys=None):
+        """
+        单边最优level_nb档（跳过笼子外的隐藏档），写入prices/qtys，不足的档填0
+        prices/qtys: 调用者提供的长度>=level_nb的列表，可反复使用；为None时新建
+        返回：(有效档数, prices, qtys)
+        集合竞价期间为未撮合的委托档，而非快照中的虚拟撮合结果
+        """
+        if prices is None:
+            prices = [0] * level_nb
+        if qtys is None:
+            qtys = [0] * level_nb
+
+        if side == SIDE.BID:
+            top, tree = self.bid_top_levels, self.bid_level_tree
+            bound = (
+                self.bid_cage_upper_ex_min_level_price
+                if self.bid_cage_upper_ex_min_level_qty
+                else None
+            )
+        else:
+            top, tree = self.ask_top_levels, self.ask_level_tree
+            bound = (
+                self.ask_cage_lower_ex_max_level_price
+                if self.ask_cage_lower_ex_max_level_qty
+                else None
+            )
+
+        n = 0
+        if level_nb <= top.nb:
+            _prices, _qtys = top.fetch(tree, bound)
+            for n in range(min(level_nb, len(_prices))):
+                prices[n] = self.conv.price_out(_prices[n])
+                qtys[n] = _qtys[n]
+            n = min(level_nb, len(_prices))
+        else:
+            if top.desc:
+                levels = tree.inorder_list_dec(None if bound is None else bound - 1)
+            else:
+                levels = tree.inorder_list_inc(None if bound is None else bound + 1)
+            for l in levels:
+                if n >= level_nb:
+                    break
+                prices[n] = self.conv.price_out(l.price)
+                qtys[n] = l.qty
+                n += 1
+        for i in range(n, level_nb):
+            prices[i] = 0
+            qtys[i] = 0
+        return n, prices, qtys
+
+    def fetchDepth(self):
+        """
+        全档发布：取走上次调用以来的depth_update，按seq排列；需full_depth
+        首条为整簿，此后为逐消息的价格档增量
+        """
+        if self.depth is None:
+            raise Exception(f"{self.SecurityID:06d} full_depth disabled!")
+        return self.depth.fetch()
+
+    def attachOrderTable(self, table, owner):
+        """CHANNEL: 改用MU分配的通道订单表，owner为本标的在通道内的编号；其它存储方式不变"""
+        if self.order_store_type == ORDER_STORE_TYPE.CHANNEL:
+            self.order_map.attach(table, owner)
+
+    def set_snap_sink(self, sink):
+        """设置重建快照的回调sink(snap)，None为关闭"""
+        self.snap_sink = sink
+
+    def set_full_depth(self, full_depth):
+        """切换全档发布，打开时从整簿开始"""
+        self.full_depth = full_depth
+        self.depth = depth_publisher() if full_depth else None
+
+    def queryOrders(self, side: SIDE, price, order_nb=10):
+        """
+        价格档委托队列的前order_nb个订单，按到达顺序；需level_queue
+        price: 快照精度，同queryLevels的输出
+        返回：[(applSeqNum, qty), ...]
+        """
+        if not self.level_queue:
+            raise Exception(f"{self.SecurityID:06d} level_queue disabled!")
+        price = price // self.conv.price_out(1)
+        return [
+            (o.applSeqNum, o.qty) for o in self.order_map.queue(side, price, order_nb)
+        ]
+
+    def queryWeightPx(self):
+        """返回：(BidWeightPx, BidWeightSize, AskWeightPx, AskWeightSize)"""
+        if self.BidWeightSize != 0:
+            BidWeightPx = (
+                int((self.BidWeightValue << 1) / self.BidWeightSize) + 1
+            ) >> 1  # 四舍五入
+            BidWeightPx = self.conv.price_out(BidWeightPx)
+        else:
+            BidWeightPx = 0
+
+        if self.AskWeightSize != 0:
+            AskWeightPx = (
+                int((self.AskWeightValue << 1) / self.AskWeightSize) + 1
+            ) >> 1  # 四舍五入
+            AskWeightPx = self.conv.price_out(AskWeightPx)
+        else:
+            AskWeightPx = 0
+        return BidWeightPx, self.BidWeightSize, AskWeightPx, self.AskWeightSize
+
+    def queryTrade(self):
+        """返回：(NumTrades, TotalVolumeTrade, TotalValueTrade, LastPx, HighPx, LowPx, OpenPx)"""
+        return (
+            self.NumTrades,
+            self.TotalVolumeTrade,
+            self.TotalValueTrade,
+            self.conv.price_out(self.LastPx),
+            self.conv.price_out(self.HighPx),
+            self.conv.price_out(self.LowPx),
+            self.conv.price_out(self.OpenPx),
+        )
+
+    def flushSnap(self):
+        """生成合并中的快照；有缓存单时暂不生成，留到缓存单处理完后"""
+        if self.snap_dirty and (
+            self.TradingPhaseMarket == axsbe_base.TPM.VolatilityBreaking
+            or self.holding_nb == 0
+        ):
+            self.genSnap(force=True)
+
     def _setSnapFixParam(self, snap):
         """固定参数:每日开盘集合竞价前确定"""
         snap.SecurityID = self.SecurityID
+        if self.conv.preclose_out is not None:
+            snap.PrevClosePx = self.conv.preclose_out(self.PrevClosePx)
+
+        snap.UpLimitPx = self.UpLimitPx
+        snap.DnLimitPx = self.DnLimitPx
+        snap.ChannelNo = self.ChannelNo
+
+    def _clipSnap(self, snap):
+        """超大数据钳位"""
+        snap.AskWeightPx = self._clipInt32(
+            snap.AskWeightPx
+        )  # 当委托价无上限时，加权价格可能超出32位整数，也没有什么意义了，直接钳位到最大
+
+    def _useTimestamp(self, TransactTime):
+        tick = self.conv.tick_in(TransactTime)
+        if self.snap_dirty and tick > self.current_inc_tick:  # 时戳前进，出上一时戳的快照
+            self.flushSnap()
+        self.current_inc_tick = tick
+        if self.current_inc_tick >= (1 << TIMESTAMP_BIT_SIZE):
+            self.ERR(f"msg.TransactTime={TransactTime} ovf!")
+
+    def _setSnapTimestamp(self, snap):
+        snap.TransactTime = self.conv.timestamp_out(self.YYMMDD, self.current_inc_tick)
+
+    def genCallSnap(self, show_level_nb=10, show_potential=False):
+        """
+        show_level_nb:  展示的价格档数
+        show_potential: 在无法撮合时展示出双方价格档
+        """
+        # if self.msg_nb>=885:
+        #    self._print_levels()
+        price, volumeTrade, bid_Qty, ask_Qty = self._callMatch()
+
+        ## 集中竞价期间不需要统计成交信息(TotalVolumeTrade & TotalValueTrade)
+
+        # price 小数位数扩展
+        price = self.conv.price_out(price)
+
+        # 价格档，按(Price,Qty)交错
+        if volumeTrade == 0:  # 无法撮合时
+            if not show_potential:
+                snap_ask_levels = [0] * (show_level_nb * 2)
+                snap_bid_levels = [0] * (show_level_nb * 2)
+            else:  # 无法撮合时，揭示多档
+                snap_ask_levels, snap_bid_levels = self._getLevels(show_level_nb)
+        else:  # 可撮合时，揭示2档
+            pad = [0] * (show_level_nb * 2 - 4)
+            snap_ask_levels = [price, volumeTrade, 0, ask_Qty] + pad
+            snap_bid_levels = [price, volumeTrade, 0, bid_Qty] + pad
+
+        #### 开始构造快照
         if self.SecurityIDSource == SecurityIDSource_SZSE:
-            if self.instrument_type == INSTRUMENT_TYPE.STOCK:
-                snap.PrevClosePx = self.PrevClosePx * (
-                    msg_util.PRICE_SZSE_SNAP_PRECLOSE_PRECISION
-                    // PRICE_INTER_STOCK_PRECISION
+            if (
+                self.instrument_type == INSTRUMENT_TYPE.STOCK
+                or self.instrument_type == INSTRUMENT_TYPE.KZZ
+            ):
+                snap_call = axsbe_snap_stock(
+                    SecurityIDSource=self.SecurityIDSource, source=f"AXOB-call"
                 )
-            elif self.instrument_type == INSTRUMENT_TYPE.FUND:
-                snap.PrevClosePx = self.PrevClosePx * (
-                    msg_util.PRICE_SZSE_SNAP_PRECLOSE_PRECISION
-                    // PRICE_INTER_FUND_PRECISION
+            else:
+                raise Exception(
+                    f"genCallSnap for instrument_type={self.instrument_type} is not ready!"
+                )
+        elif self.SecurityIDSource == SecurityIDSource_SSE:
+            if (
+                self.instrument_type == INSTRUMENT_TYPE.BOND
+                or self.instrument_type == INSTRUMENT_TYPE.KZZ
+                or self.instrument_type == INSTRUMENT_TYPE.NHG
+            ):
+                snap_call = axsbe_snap_stock(
+                    SecurityIDSource=self.SecurityIDSource,
+                    MsgType=MsgType_exe_sse_bond,
+                    source=f"AXOB-call",
                 )
-            elif self.instrument_type == INSTRUMENT_TYPE.KZZ:
-                snap.PrevClosePx = self.PrevClosePx * (
-                    msg_util.PRICE_SZSE_SNAP_PRECLOSE_PRECISION
-                    // PRICE_INTER_KZZ_PRECISION
+            else:
+                raise Exception(
+                    f"genCallSnap for instrument_type={self.instrument_type} is not ready!"
                 )
+
+        self._setSnapFixParam(snap_call)
+
+        ## 本地维护参数
+        snap_call.set_levels(snap_bid_levels, snap_ask_levels)
+        # 以下参数开盘集合竞价期间为0，收盘集合竞价期间有值
+        snap_call.NumTrades = self.NumTrades
+        snap_call.TotalVolumeTrade = self.TotalVolumeTrade
+        snap_call.TotalValueTrade = self.TotalValueTrade
+        snap_call.LastPx = self.conv.price_out(self.LastPx)
+        snap_call.HighPx = self.conv.price_out(self.HighPx)
+        snap_call.LowPx = self.conv.price_out(self.LowPx)
+        snap_call.OpenPx = self.conv.price_out(self.OpenPx)
+
+        # 本地维护参数
+        if self.SecurityIDSource == SecurityIDSource_SZSE:
+            snap_call.BidWeightPx = 0  # 开盘撮合时期为0
+            snap_call.BidWeightSize = 0
+            snap_call.AskWeightPx = 0
+            snap_call.AskWeightSize = 0
+        elif self.SecurityIDSource == SecurityIDSource_SSE:
+            if self.BidWeightSize != 0:
+                snap_call.BidWeightPx = (
+                    int((self.BidWeightValue << 1) / self.BidWeightSize) + 1
+                ) >> 1  # 四舍五入
+                snap_call.BidWeightPx = self.conv.price_out(snap_call.BidWeightPx)
             else:
-                snap.PrevClosePx = self.PrevClosePx  # TODO:
-        else:
-            """TODO-SSE"""
+                snap_call.BidWeightPx = 0
+            snap_call.BidWeightSize = self.BidWeightSize
 
-        snap.UpLimitPx = self.UpLimitPx
-        snap.DnLimitPx = self.DnLimitPx
-        snap.ChannelNo = self.ChannelNo
+            if self.AskWeightSize != 0:
+                snap_call.AskWeightPx = (
+                    int((self.AskWeightValue << 1) / self.AskWeightSize) + 1
+                ) >> 1  # 四舍五入
+                snap_call.AskWeightPx = self.conv.price_out(snap_call.AskWeightPx)
+            else:
+                snap_call.AskWeightPx = 0
+            snap_call.AskWeightSize = self.AskWeightSize
 
-    def _clipSnap(self, snap):
-        """超大数据钳位"""
-        snap.AskWeightPx = self._clipInt32(
-            snap.AskWeightPx
-        )  # 当委托价无上限时，加权价格可能超出32位整数，也没有什么意义了，直接钳位到最大
+        # 最新的一个逐笔消息时戳
+        self._setSnapTimestamp(snap_call)
 
-    def _useTimestamp(self, TransactTime):
-        if self.SecurityIDSource == SecurityIDSource_SZSE:
-            self.current_inc_tick = (
-                TransactTime // SZSE_TICK_MS_TAIL % (SZSE_TICK_CUT // SZSE_TICK_MS_TAIL)
-            )  # 只用逐笔 (10ms精度) 15000000 24b
-        else:
-            self.current_inc_tick = TransactTime  # 上交所(1ms精度) 150000000
-        if self.current_inc_tick >= (1 << TIMESTAMP_BIT_SIZE):
-            self.ERR(f"msg.TransactTime={TransactTime} ovf!")
+        snap_call.update_TradingPhaseCode(
+            self.TradingPhaseMarket, axsbe_base.TPI.Normal
+        )
 
-    def _setSnapTimestamp(self, snap):
-        if self.SecurityIDSource == SecurityIDSource_SZSE:
-            snap.TransactTime = self.YYMMDD * SZSE_TICK_CUT + (
-                self.current_inc_tick * SZSE_TICK_MS_TAIL
-            )  # 深交所显示精度到ms，多补1位
-        elif self.SecurityIDSource == SecurityIDSource_SZSE:
-            if (
-                self.instrument_type == INSTRUMENT_TYPE.BOND
-                or self.instrument_type == INSTRUMENT_TYPE.KZZ
-                or self.instrument_type == INSTRUMENT_TYPE.NHG
-            ):
-                snap.TransactTime = self.current_inc_tick  # 债券精确到ms
-            else:
-                snap.TransactTime = (
-                    self.current_inc_tick // 100
-                )  # 上交所只显示到秒，去掉10ms和100ms两位
+        return snap_call
 
-    def genCallSnap(self, show_level_nb=10, show_potential=False):
+    def _callMatch(self):
         """
-        show_level_nb:  展示的价格档数
-        show_potential: 在无法撮合时展示出双方价格档
+        集合竞价虚拟撮合
+        返回：(撮合价, 撮合量, 买方最后一档剩余量, 卖方最后一档剩余量)，撮合量为0时其余无意义
+        价格档有前缀和时二分查找，否则逐档撮合
         """
-        # if self.msg_nb>=885:
-        #    self._print_levels()
+        if (
+            self.bid_cage_upper_ex_min_level_qty == 0
+            and self.ask_cage_lower_ex_max_level_qty == 0
+            and self.bid_level_tree.prefix_sum_ready()
+            and self.ask_level_tree.prefix_sum_ready()
+        ):
+            return self._callMatchPrefixSum()
+        return self._callMatchWalk()
+
+    def _callMatchWalk(self):
+        """逐档撮合：从双方最优档开始逐档成交，直到价格不再交叉"""
         # 1. 查找 最低卖出价格档、最高买入价格档
         _bid_max_level_price = self.bid_max_level_price
         _bid_max_level_qty = self.bid_max_level_qty
@@ -2246,36 +3998,30 @@ class AXOB:
                         price = _ask_min_level_price
                     # locate next lower bid level
                     _bid_max_level_qty = 0
-                    self._export_level_access(
-                        f"LEVEL_ACCESS BID locate_lower {_bid_max_level_price} //callSnap:next side level"
-                    )
-                    for p, l in sorted(
-                        self.bid_level_tree.items(), key=lambda x: x[0], reverse=True
-                    ):  # 从大到小遍历
-                        if p < _bid_max_level_price:
-                            # if price<=p:
-                            #     price = p+1
-                            _bid_max_level_price = p
-                            _bid_max_level_qty = l.qty
-                            break
+                    if self.TRACE_ON:
+                        self._export_level_access(
+                            f"LEVEL_ACCESS BID locate_lower {_bid_max_level_price} //callSnap:next side level"
+                        )
+                    l = self.bid_level_tree.locate_lower_pq(_bid_max_level_price)
+                    if l is not None:
+                        # if price<=l.price:
+                        #     price = l.price+1
+                        _bid_max_level_price, _bid_max_level_qty = l
 
                 if ask_Qty == 0:
                     if bid_Qty != 0:
                         price = _bid_max_level_price
                     # locate next higher ask level
                     _ask_min_level_qty = 0
-                    self._export_level_access(
-                        f"LEVEL_ACCESS ASK locate_higher {_ask_min_level_price} //callSnap:next side level"
-                    )
-                    for p, l in sorted(
-                        self.ask_level_tree.items(), key=lambda x: x[0], reverse=False
-                    ):  # 从小到大遍历
-                        if p > _ask_min_level_price:
-                            # if price>=p:
-                            #     price = p-1
-                            _ask_min_level_price = p
-                            _ask_min_level_qty = l.qty
-                            break
+                    if self.TRACE_ON:
+                        self._export_level_access(
+                            f"LEVEL_ACCESS ASK locate_higher {_ask_min_level_price} //callSnap:next side level"
+                        )
+                    l = self.ask_level_tree.locate_higher_pq(_ask_min_level_price)
+                    if l is not None:
+                        # if price>=l.price:
+                        #     price = l.price-1
+                        _ask_min_level_price, _ask_min_level_qty = l
 
             else:  # 后续买卖双方至少一方无委托，或价格无交叉
                 if (
@@ -2319,157 +4065,159 @@ class AXOB:
 
                 break
 
-        ## 集中竞价期间不需要统计成交信息(TotalVolumeTrade & TotalValueTrade)
-
-        # price 小数位数扩展
-        price = self._fmtPrice_inter2snap(price)
-
-        # 价格档
-        snap_ask_levels = {}
-        snap_bid_levels = {}
-        if volumeTrade == 0:  # 无法撮合时
-            if not show_potential:
-                for i in range(0, show_level_nb):
-                    snap_ask_levels[i] = price_level(0, 0)
-                    snap_bid_levels[i] = price_level(0, 0)
-            else:  # 无法撮合时，揭示多档
-                snap_ask_levels, snap_bid_levels = self._getLevels(show_level_nb)
-        else:  # 可撮合时，揭示2档
-            snap_ask_levels[0] = price_level(price, volumeTrade)
-            snap_ask_levels[1] = price_level(0, ask_Qty)
-            for i in range(2, show_level_nb):
-                snap_ask_levels[i] = price_level(0, 0)
-
-            snap_bid_levels[0] = price_level(price, volumeTrade)
-            snap_bid_levels[1] = price_level(0, bid_Qty)
-            for i in range(2, show_level_nb):
-                snap_bid_levels[i] = price_level(0, 0)
+        return price, volumeTrade, bid_Qty, ask_Qty
 
-        #### 开始构造快照
-        if self.SecurityIDSource == SecurityIDSource_SZSE:
-            if (
-                self.instrument_type == INSTRUMENT_TYPE.STOCK
-                or self.instrument_type == INSTRUMENT_TYPE.KZZ
-            ):
-                snap_call = axsbe_snap_stock(
-                    SecurityIDSource=self.SecurityIDSource, source=f"AXOB-call"
-                )
+    def _callMatchPrefixSum(self):
+        """
+        前缀和撮合：价格网格上的买方累计量B(p)(>=p)单调减、卖方累计量A(p)(<=p)单调增，
+        最大撮合量 V = max_p min(B(p), A(p))，与逐档撮合的成交量相同；
+        再由前缀和定位第V单位所在的买卖价格档，得到最后一步的状态，成交价规则与逐档撮合一致。
+        """
+        bid_ps = self.bid_level_tree.psum
+        ask_ps = self.ask_level_tree.psum
+        base = self.bid_level_tree.base
+        span = self.bid_level_tree.span
+        bid_total = bid_ps.total
+
+        if self.TRACE_ON:
+            self._export_level_access(f"LEVEL_ACCESS BID prefix_sum //callSnap:search")
+            self._export_level_access(f"LEVEL_ACCESS ASK prefix_sum //callSnap:search")
+
+        # 1. 二分查找 B(k)>=A(k) 的最大下标k
+        lo, hi = 0, span - 1
+        k = -1
+        while lo <= hi:
+            mid = (lo + hi) >> 1
+            if bid_total - bid_ps.prefix(mid - 1) >= ask_ps.prefix(mid):
+                k = mid
+                lo = mid + 1
             else:
-                raise Exception(
-                    f"genCallSnap for instrument_type={self.instrument_type} is not ready!"
-                )
-        elif self.SecurityIDSource == SecurityIDSource_SSE:
-            if (
-                self.instrument_type == INSTRUMENT_TYPE.BOND
-                or self.instrument_type == INSTRUMENT_TYPE.KZZ
-                or self.instrument_type == INSTRUMENT_TYPE.NHG
-            ):
-                snap_call = axsbe_snap_stock(
-                    SecurityIDSource=self.SecurityIDSource,
-                    MsgType=MsgType_exe_sse_bond,
-                    source=f"AXOB-call",
-                )
+                hi = mid - 1
+        volumeTrade = 0
+        if k >= 0:
+            volumeTrade = ask_ps.prefix(k)
+        if k + 1 < span:
+            volumeTrade = max(volumeTrade, bid_total - bid_ps.prefix(k))
+        if volumeTrade == 0:
+            return 0, 0, 0, 0
+
+        # 2. 第volumeTrade单位所在的买卖价格档，及其剩余量
+        kb = bid_ps.lower_bound(bid_total - volumeTrade + 1)
+        _bid_price = base + kb
+        bid_Qty = bid_total - bid_ps.prefix(kb - 1) - volumeTrade
+        ka = ask_ps.lower_bound(volumeTrade)
+        _ask_price = base + ka
+        ask_Qty = ask_ps.prefix(ka) - volumeTrade
+
+        if bid_Qty:  # 最后一步卖方档成交完
+            return _bid_price, volumeTrade, bid_Qty, 0
+        if ask_Qty:  # 最后一步买方档成交完
+            return _ask_price, volumeTrade, 0, ask_Qty
+
+        # 3. 双方恰好成交，同逐档撮合
+        _ref_px = self.PrevClosePx if self.NumTrades == 0 else self.LastPx
+        if _bid_price >= _ref_px and _ask_price <= _ref_px:
+            price = _ref_px
+        else:
+            if abs(_bid_price - _ref_px) < abs(_ask_price - _ref_px):
+                price = _bid_price
             else:
-                raise Exception(
-                    f"genCallSnap for instrument_type={self.instrument_type} is not ready!"
-                )
-
-        self._setSnapFixParam(snap_call)
+                price = _ask_price
 
-        ## 本地维护参数
-        snap_call.ask = snap_ask_levels
-        snap_call.bid = snap_bid_levels
-        # 以下参数开盘集合竞价期间为0，收盘集合竞价期间有值
-        snap_call.NumTrades = self.NumTrades
-        snap_call.TotalVolumeTrade = self.TotalVolumeTrade
-        snap_call.TotalValueTrade = self.TotalValueTrade
-        snap_call.LastPx = self._fmtPrice_inter2snap(self.LastPx)
-        snap_call.HighPx = self._fmtPrice_inter2snap(self.HighPx)
-        snap_call.LowPx = self._fmtPrice_inter2snap(self.LowPx)
-        snap_call.OpenPx = self._fmtPrice_inter2snap(self.OpenPx)
+        if self.TRACE_ON:
+            self._export_level_access(
+                f"LEVEL_ACCESS BID locate_lower {_bid_price} //callSnap:next side level"
+            )
+        l = self.bid_level_tree.locate_lower_pq(_bid_price)
+        if l is not None:
+            _bid_max_level_price, _bid_max_level_qty = l
+        else:
+            _bid_max_level_price = _bid_price
+            _bid_max_level_qty = 0
+        if self.TRACE_ON:
+            self._export_level_access(
+                f"LEVEL_ACCESS ASK locate_higher {_ask_price} //callSnap:next side level"
+            )
+        l = self.ask_level_tree.locate_higher_pq(_ask_price)
+        if l is not None:
+            _ask_min_level_price, _ask_min_level_qty = l
+        else:
+            _ask_min_level_price = _ask_price
+            _ask_min_level_qty = 0
 
-        # 本地维护参数
-        if self.SecurityIDSource == SecurityIDSource_SZSE:
-            snap_call.BidWeightPx = 0  # 开盘撮合时期为0
-            snap_call.BidWeightSize = 0
-            snap_call.AskWeightPx = 0
-            snap_call.AskWeightSize = 0
-        elif self.SecurityIDSource == SecurityIDSource_SSE:
-            if self.BidWeightSize != 0:
-                snap_call.BidWeightPx = (
-                    int((self.BidWeightValue << 1) / self.BidWeightSize) + 1
-                ) >> 1  # 四舍五入
-                snap_call.BidWeightPx = self._fmtPrice_inter2snap(snap_call.BidWeightPx)
+        # 根据下一档价格，可能需要修正成交价
+        if (
+            _ask_min_level_qty and price >= _ask_min_level_price
+        ):  # 成交价高于卖方下一档，必须修正到小于等于卖方下一档
+            if (
+                _bid_max_level_qty == 0
+                or _bid_max_level_price + 1 < _ask_min_level_price
+            ):  # 买方下一档+1分钱 小于 卖方下一档，修到卖方下一档-1
+                price = _ask_min_level_price - 1
             else:
-                snap_call.BidWeightPx = 0
-            snap_call.BidWeightSize = self.BidWeightSize
+                if (
+                    _ask_min_level_qty <= _bid_max_level_qty
+                ):  # 卖方双方下一档只差一分钱，选量小的，同量卖方优先
+                    price = _ask_min_level_price
+                    ask_Qty = _ask_min_level_qty
+                else:
+                    price = _bid_max_level_price
+                    bid_Qty = _bid_max_level_qty
 
-            if self.AskWeightSize != 0:
-                snap_call.AskWeightPx = (
-                    int((self.AskWeightValue << 1) / self.AskWeightSize) + 1
-                ) >> 1  # 四舍五入
-                snap_call.AskWeightPx = self._fmtPrice_inter2snap(snap_call.AskWeightPx)
+        elif (
+            _bid_max_level_qty and price <= _bid_max_level_price
+        ):  # 成交价低于买方下一档，必须修正到大于等于买方下一档
+            if (
+                _bid_max_level_qty == 0
+                or _ask_min_level_price > _bid_max_level_price + 1
+            ):  # 卖方下一档分钱 大于 买方下一档+1，修到买方下一档+1
+                price = _bid_max_level_price + 1
             else:
-                snap_call.AskWeightPx = 0
-            snap_call.AskWeightSize = self.AskWeightSize
-
-        # 最新的一个逐笔消息时戳
-        self._setSnapTimestamp(snap_call)
-
-        snap_call.update_TradingPhaseCode(
-            self.TradingPhaseMarket, axsbe_base.TPI.Normal
-        )
+                if (
+                    _bid_max_level_qty <= _ask_min_level_qty
+                ):  # 卖方双方下一档只差一分钱，选量小的，同量买方优先
+                    price = _bid_max_level_price
+                    bid_Qty = _bid_max_level_qty
+                else:
+                    price = _ask_min_level_price
+                    ask_Qty = _ask_min_level_qty
 
-        return snap_call
+        return price, volumeTrade, bid_Qty, ask_Qty
 
     def genTradingSnap(self, isVolatilityBreaking=False, level_nb=10):
         """
         生成连续竞价期间快照
         level_nb: 快照单边档数
         """
-        snap_bid_levels = {}
-        lv = 0
-        if not isVolatilityBreaking:  # 临停期间，各档均填0；非临停期间才从价格档中取值
-            self._export_level_access(
-                f"LEVEL_ACCESS BID locate_lower {self.bid_max_level_price} x{level_nb} //tradingSnap:traverse side level"
+        if not isVolatilityBreaking and level_nb <= self.bid_top_levels.nb:
+            if self.TRACE_ON:
+                self._export_level_access(
+                    f"LEVEL_ACCESS BID locate_lower {self.bid_max_level_price} x{level_nb} //tradingSnap:traverse side level"
+                )
+            snap_bid_levels = self._topSnapLevels(
+                self.bid_top_levels,
+                self.bid_level_tree,
+                self.bid_cage_upper_ex_min_level_price
+                if self.bid_cage_upper_ex_min_level_qty
+                else None,
+                level_nb,
             )
-            for p, l in sorted(
-                self.bid_level_tree.items(), key=lambda x: x[0], reverse=True
-            ):  # 从大到小遍历
-                if (
-                    self.bid_cage_upper_ex_min_level_qty == 0
-                    or p < self.bid_cage_upper_ex_min_level_price
-                ):
-                    snap_bid_levels[lv] = price_level(
-                        self._fmtPrice_inter2snap(p), l.qty
-                    )
-                    lv += 1
-                    if lv >= level_nb:
-                        break
-        for i in range(lv, level_nb):
-            snap_bid_levels[i] = price_level(0, 0)
-
-        snap_ask_levels = {}
-        lv = 0
-        if not isVolatilityBreaking:  # 临停期间，各档均填0；非临停期间才从价格档中取值
-            self._export_level_access(
-                f"LEVEL_ACCESS ASK locate_higher {self.ask_min_level_price} x{level_nb} //tradingSnap:traverse side level"
+            if self.TRACE_ON:
+                self._export_level_access(
+                    f"LEVEL_ACCESS ASK locate_higher {self.ask_min_level_price} x{level_nb} //tradingSnap:traverse side level"
+                )
+            snap_ask_levels = self._topSnapLevels(
+                self.ask_top_levels,
+                self.ask_level_tree,
+                self.ask_cage_lower_ex_max_level_price
+                if self.ask_cage_lower_ex_max_level_qty
+                else None,
+                level_nb,
+            )
+        else:
+            snap_bid_levels, snap_ask_levels = self._walkSnapLevels(
+                isVolatilityBreaking, level_nb
             )
-            for p, l in sorted(
-                self.ask_level_tree.items(), key=lambda x: x[0], reverse=False
-            ):  # 从小到大遍历
-                if (
-                    self.ask_cage_lower_ex_max_level_qty == 0
-                    or p > self.ask_cage_lower_ex_max_level_price
-                ):
-                    snap_ask_levels[lv] = price_level(
-                        self._fmtPrice_inter2snap(p), l.qty
-                    )
-                    lv += 1
-                    if lv >= level_nb:
-                        break
-        for i in range(lv, level_nb):
-            snap_ask_levels[i] = price_level(0, 0)
 
         if (
             self.instrument_type == INSTRUMENT_TYPE.STOCK
@@ -2483,8 +4231,7 @@ class AXOB:
                 f"genTradingSnap for instrument_type={self.instrument_type} is not ready!"
             )
             return None  # TODO: not ready [Mid priority]
-        snap.ask = snap_ask_levels
-        snap.bid = snap_bid_levels
+        snap.set_levels(snap_bid_levels, snap_ask_levels)
 
         # 固定参数
         self._setSnapFixParam(snap)
@@ -2493,10 +4240,10 @@ class AXOB:
         snap.NumTrades = self.NumTrades
         snap.TotalVolumeTrade = self.TotalVolumeTrade
         snap.TotalValueTrade = self.TotalValueTrade
-        snap.LastPx = self._fmtPrice_inter2snap(self.LastPx)
-        snap.HighPx = self._fmtPrice_inter2snap(self.HighPx)
-        snap.LowPx = self._fmtPrice_inter2snap(self.LowPx)
-        snap.OpenPx = self._fmtPrice_inter2snap(self.OpenPx)
+        snap.LastPx = self.conv.price_out(self.LastPx)
+        snap.HighPx = self.conv.price_out(self.HighPx)
+        snap.LowPx = self.conv.price_out(self.LowPx)
+        snap.OpenPx = self.conv.price_out(self.OpenPx)
 
         # 维护参数
         if isVolatilityBreaking:  # 临停期间填0
@@ -2505,23 +4252,12 @@ class AXOB:
             snap.AskWeightPx = 0
             snap.AskWeightSize = 0
         else:
-            if self.BidWeightSize != 0:
-                snap.BidWeightPx = (
-                    int((self.BidWeightValue << 1) / self.BidWeightSize) + 1
-                ) >> 1  # 四舍五入
-                snap.BidWeightPx = self._fmtPrice_inter2snap(snap.BidWeightPx)
-            else:
-                snap.BidWeightPx = 0
-            snap.BidWeightSize = self.BidWeightSize
-
-            if self.AskWeightSize != 0:
-                snap.AskWeightPx = (
-                    int((self.AskWeightValue << 1) / self.AskWeightSize) + 1
-                ) >> 1  # 四舍五入
-                snap.AskWeightPx = self._fmtPrice_inter2snap(snap.AskWeightPx)
-            else:
-                snap.AskWeightPx = 0
-            snap.AskWeightSize = self.AskWeightSize
+            (
+                snap.BidWeightPx,
+                snap.BidWeightSize,
+                snap.AskWeightPx,
+                snap.AskWeightSize,
+            ) = self.queryWeightPx()
 
         # 最新的一个逐笔消息时戳
         self._setSnapTimestamp(snap)
@@ -2530,6 +4266,60 @@ class AXOB:
 
         return snap
 
+    def _topSnapLevels(self, top, tree, bound, level_nb):
+        """从最优档缓存取快照档位，缓存内容未变时复用上次的档位"""
+        prices, qtys = top.fetch(tree, bound)
+        if top.snap_version != top.version or len(top.snap_levels) != level_nb * 2:
+            levels = array("q", bytes(8 * level_nb * 2))
+            for i in range(min(level_nb, len(prices))):
+                levels[i * 2] = self.conv.price_out(prices[i])
+                levels[i * 2 + 1] = qtys[i]
+            top.snap_levels = levels
+            top.snap_version = top.version
+        return top.snap_levels
+
+    def _walkSnapLevels(self, isVolatilityBreaking, level_nb):
+        """遍历价格档生成快照档位（不使用最优档缓存）"""
+        snap_bid_levels = []
+        lv = 0
+        if not isVolatilityBreaking:  # 临停期间，各档均填0；非临停期间才从价格档中取值
+            if self.TRACE_ON:
+                self._export_level_access(
+                    f"LEVEL_ACCESS BID locate_lower {self.bid_max_level_price} x{level_nb} //tradingSnap:traverse side level"
+                )
+            for price, qty in self.bid_level_tree.inorder_pq_dec(
+                self.bid_cage_upper_ex_min_level_price - 1
+                if self.bid_cage_upper_ex_min_level_qty
+                else None
+            ):  # 从大到小遍历，跳过笼子外的价格档
+                snap_bid_levels.append(self.conv.price_out(price))
+                snap_bid_levels.append(qty)
+                lv += 1
+                if lv >= level_nb:
+                    break
+        snap_bid_levels.extend([0] * ((level_nb - lv) * 2))
+
+        snap_ask_levels = []
+        lv = 0
+        if not isVolatilityBreaking:  # 临停期间，各档均填0；非临停期间才从价格档中取值
+            if self.TRACE_ON:
+                self._export_level_access(
+                    f"LEVEL_ACCESS ASK locate_higher {self.ask_min_level_price} x{level_nb} //tradingSnap:traverse side level"
+                )
+            for price, qty in self.ask_level_tree.inorder_pq_inc(
+                self.ask_cage_lower_ex_max_level_price + 1
+                if self.ask_cage_lower_ex_max_level_qty
+                else None
+            ):  # 从小到大遍历，跳过笼子外的价格档
+                snap_ask_levels.append(self.conv.price_out(price))
+                snap_ask_levels.append(qty)
+                lv += 1
+                if lv >= level_nb:
+                    break
+        snap_ask_levels.extend([0] * ((level_nb - lv) * 2))
+
+        return snap_bid_levels, snap_ask_levels
+
     def _clipInt32(self, x):
         if x > (0x7FFFFFFF):
             return 0x7FFFFFFF
@@ -2542,46 +4332,12 @@ class AXOB:
         else:
             return x
 
-    def _fmtPrice_inter2snap(self, price):
-        # price 小数位数扩展
-        if self.SecurityIDSource == SecurityIDSource_SZSE:
-            # 深圳快照价格精度6位小数（唯有PrevClosePx是4位小数）
-            if self.instrument_type == INSTRUMENT_TYPE.STOCK:
-                price *= (
-                    msg_util.PRICE_SZSE_SNAP_PRECISION // PRICE_INTER_STOCK_PRECISION
-                )  # 内部2位，输出6位
-            elif self.instrument_type == INSTRUMENT_TYPE.FUND:
-                price *= (
-                    msg_util.PRICE_SZSE_SNAP_PRECISION // PRICE_INTER_FUND_PRECISION
-                )  # 内部3位，输出6位
-            elif self.instrument_type == INSTRUMENT_TYPE.KZZ:
-                price *= (
-                    msg_util.PRICE_SZSE_SNAP_PRECISION // PRICE_INTER_KZZ_PRECISION
-                )  # 内部3位，输出6位
-            else:
-                price = None
-        elif self.SecurityIDSource == SecurityIDSource_SSE:
-            # 上海快照价格精度3位小数
-            if self.instrument_type == INSTRUMENT_TYPE.STOCK:
-                price *= (
-                    msg_util.PRICE_SSE_PRECISION // PRICE_INTER_STOCK_PRECISION
-                )  # 内部2位，输出3位
-            elif self.instrument_type == INSTRUMENT_TYPE.FUND:
-                price *= (
-                    msg_util.PRICE_SSE_PRECISION // PRICE_INTER_FUND_PRECISION
-                )  # 内部3位，输出3位
-            else:
-                price = None
-        else:
-            price = None
-        return price
-
     def _getLevels(self, level_nb):
         """
-        输出：卖方最优n档, 买方最优n档
+        输出：卖方最优n档, 买方最优n档，按(Price,Qty)交错
         """
-        snap_ask_levels = {}
-        snap_bid_levels = {}
+        snap_ask_levels = []
+        snap_bid_levels = []
 
         _bid_max_level_price = self.bid_max_level_price
         _bid_max_level_qty = self.bid_max_level_qty
@@ -2590,42 +4346,34 @@ class AXOB:
 
         for nb in range(level_nb):
             if _ask_min_level_qty != 0:
-                snap_ask_levels[nb] = price_level(
-                    self._fmtPrice_inter2snap(_ask_min_level_price), _ask_min_level_qty
-                )
+                snap_ask_levels.append(self.conv.price_out(_ask_min_level_price))
+                snap_ask_levels.append(_ask_min_level_qty)
                 # locate next higher ask level
                 _ask_min_level_qty = 0
-                self._export_level_access(
-                    f"LEVEL_ACCESS ASK locate_higher {_ask_min_level_price} //snap:traverse side level"
-                )
-                for p, l in sorted(
-                    self.ask_level_tree.items(), key=lambda x: x[0], reverse=False
-                ):  # 从小到大遍历
-                    if p > _ask_min_level_price:
-                        _ask_min_level_price = p
-                        _ask_min_level_qty = l.qty
-                        break
+                if self.TRACE_ON:
+                    self._export_level_access(
+                        f"LEVEL_ACCESS ASK locate_higher {_ask_min_level_price} //snap:traverse side level"
+                    )
+                l = self.ask_level_tree.locate_higher_pq(_ask_min_level_price)
+                if l is not None:
+                    _ask_min_level_price, _ask_min_level_qty = l
             else:
-                snap_ask_levels[nb] = price_level(0, 0)
+                snap_ask_levels.extend((0, 0))
 
             if _bid_max_level_qty != 0:
-                snap_bid_levels[nb] = price_level(
-                    self._fmtPrice_inter2snap(_bid_max_level_price), _bid_max_level_qty
-                )
+                snap_bid_levels.append(self.conv.price_out(_bid_max_level_price))
+                snap_bid_levels.append(_bid_max_level_qty)
                 # locate next lower bid level
                 _bid_max_level_qty = 0
-                self._export_level_access(
-                    f"LEVEL_ACCESS BID locate_lower {_bid_max_level_price} //snap:traverse side level"
-                )
-                for p, l in sorted(
-                    self.bid_level_tree.items(), key=lambda x: x[0], reverse=True
-                ):  # 从大到小遍历
-                    if p < _bid_max_level_price:
-                        _bid_max_level_price = p
-                        _bid_max_level_qty = l.qty
-                        break
+                if self.TRACE_ON:
+                    self._export_level_access(
+                        f"LEVEL_ACCESS BID locate_lower {_bid_max_level_price} //snap:traverse side level"
+                    )
+                l = self.bid_level_tree.locate_lower_pq(_bid_max_level_price)
+                if l is not None:
+                    _bid_max_level_price, _bid_max_level_qty = l
             else:
-                snap_bid_levels[nb] = price_level(0, 0)
+                snap_bid_levels.extend((0, 0))
 
         return snap_ask_levels, snap_bid_levels
 
@@ -2674,6 +4422,30 @@ class AXOB:
     def order_map_size(self):
         return len(self.order_map)
 
+    def _newLevelTree(self):
+        """按涨跌停价格带新建价格档容器，无涨跌停时由new_level_tree退化为SORTED"""
+        if (
+            self.constantValue_ready
+            and self.UpLimitPx != msg_util.ORDER_PRICE_OVERFLOW
+            and self.DnLimitPx != msg_util.ORDER_PRICE_OVERFLOW
+            and self.UpLimitPrice > self.DnLimitPrice
+        ):
+            return new_level_tree(
+                self.level_tree_type, self.DnLimitPrice, self.UpLimitPrice
+            )
+        return new_level_tree(self.level_tree_type)
+
+    def _rebuildLevelTree(self):
+        """价格带变化后重建价格档容器，已有价格档原样搬入"""
+        for attr in ["bid_level_tree", "ask_level_tree"]:
+            old = getattr(self, attr)
+            new = self._newLevelTree()
+            for l in old.inorder_list_inc():
+                new[l.price] = level_node(l.price, l.qty, 0)
+            setattr(self, attr, new)
+        self.bid_top_levels.invalidate()
+        self.ask_top_levels.invalidate()
+
     @property
     def level_tree_size(self):
         return len(self.bid_level_tree) + len(self.ask_level_tree)
@@ -2727,14 +4499,10 @@ class AXOB:
         return s
 
     def _print_levels(self):
-        for p, l in sorted(
-            self.ask_level_tree.items(), key=lambda x: x[0], reverse=True
-        ):  # 从大到小遍历
+        for l in self.ask_level_tree.inorder_list_dec():  # 从大到小遍历
             s = f"ask\t{l}{self._describe_px(l.price)}"
             self.DBG(s)
-        for p, l in sorted(
-            self.bid_level_tree.items(), key=lambda x: x[0], reverse=True
-        ):  # 从大到小遍历
+        for l in self.bid_level_tree.inorder_list_dec():  # 从大到小遍历
             s = f"bid\t{l}{self._describe_px(l.price)}"
             self.DBG(s)
 
@@ -2761,46 +4529,124 @@ class AXOB:
 
     def save(self):
         """save/load 用于保存/加载测试时刻"""
+        data = self._saveScalars()
+        data.update(self._saveSnaps())
+        for attr in ["order_map", "bid_level_tree", "ask_level_tree"]:
+            value = getattr(self, attr)
+            data[attr] = {}
+            for i in value:
+                data[attr][i] = value[i].save()
+        return data
+
+    def _saveScalars(self):
+        """除订单及价格档容器、快照缓存以外的状态，供save及检查点头部"""
         data = {}
         for attr in self.__slots__:
-            if attr in ["logger", "DBG", "INFO", "WARN", "ERR"]:
+            if attr in [
+                "logger",
+                "DBG",
+                "INFO",
+                "WARN",
+                "ERR",
+                "DBG_ON",
+                "TRACE_ON",
+                "decoder",
+                "conv",
+                "msg_handlers",
+                "depth",
+                "snap_sink",
+                "ckpt_seq",
+                "ckpt_orders",
+                "ckpt_bid_levels",
+                "ckpt_ask_levels",
+                "bid_cage_upper_px",
+                "ask_cage_lower_px",
+                "bid_cage_levels",
+                "ask_cage_levels",
+                "order_map",
+                "bid_level_tree",
+                "ask_level_tree",
+                "rebuilt_snaps",
+                "market_snaps",
+                "last_snap",
+            ]:
                 continue
 
             value = getattr(self, attr)
-            if attr in ["order_map", "bid_level_tree", "ask_level_tree"]:
-                data[attr] = {}
-                for i in value:
-                    data[attr][i] = value[i].save()
-            elif attr == "rebuilt_snaps" or attr == "market_snaps":
-                data[attr] = {}
-                for i in value:
-                    data[attr][i] = [x.save() for x in value[i]]
-            elif attr == "last_snap":
-                if value is None:
-                    data[attr] = None
-                else:
-                    data[attr] = value.save()
+            if attr == "verifier":
+                data[attr] = value.save()
+            elif attr in ["bid_top_levels", "ask_top_levels"]:
+                data[attr] = value.nb  # 缓存不保存，加载后重建
             else:
                 data[attr] = value
         return data
 
+    def _saveSnaps(self):
+        """快照缓存：未匹配的重建快照及行情快照、最近的重建快照"""
+        data = {}
+        for attr in ["rebuilt_snaps", "market_snaps"]:
+            value = getattr(self, attr)
+            data[attr] = {}
+            for i in value:
+                data[attr][i] = [x.save() for x in value[i]]
+        if self.last_snap is None:
+            data["last_snap"] = None
+        else:
+            data["last_snap"] = self.last_snap.save()
+        return data
+
     def load(self, data):
+        data = {**AXOB_LOAD_DEFAULT, **data}
         setattr(self, "instrument_type", data["instrument_type"])
+        setattr(self, "level_tree_type", data["level_tree_type"])
+        for attr in [
+            "constantValue_ready",
+            "UpLimitPx",
+            "DnLimitPx",
+            "UpLimitPrice",
+            "DnLimitPrice",
+        ]:  # 价格档容器依赖价格带
+            setattr(self, attr, data[attr])
         for attr in self.__slots__:
-            if attr in ["logger", "DBG", "INFO", "WARN", "ERR"]:
+            if attr in [
+                "logger",
+                "DBG",
+                "INFO",
+                "WARN",
+                "ERR",
+                "DBG_ON",
+                "TRACE_ON",
+                "decoder",
+                "conv",
+                "msg_handlers",
+                "depth",
+                "snap_sink",
+                "ckpt_seq",
+                "ckpt_orders",
+                "ckpt_bid_levels",
+                "ckpt_ask_levels",
+                "bid_cage_upper_px",
+                "ask_cage_lower_px",
+                "bid_cage_levels",
+                "ask_cage_levels",
+            ]:
                 continue
 
             if attr == "order_map":
-                v = {}
+                v = new_order_map(
+                    data["order_store_type"], data["level_queue"]
+                )  # 按保存时的插入顺序重建，委托队列顺序不变
                 for i in data[attr]:
-                    v[i] = ob_order(axsbe_order(), INSTRUMENT_TYPE.UNKNOWN)
-                    v[i].load(data[attr][i])
+                    order = ob_order.__new__(ob_order)  # 字段全部来自load，不经__init__解码
+                    order.load(data[attr][i])
+                    v[i] = order
                 setattr(self, attr, v)
             elif attr in ["bid_level_tree", "ask_level_tree"]:
-                v = {}
+                v = self._newLevelTree()
                 for i in data[attr]:
-                    v[i] = level_node(-1, -1, -1)
-                    v[i].load(data[attr][i])
+                    l = level_node(-1, -1, -1)
+                    l.load(data[attr][i])
+                    v[i] = l
                 setattr(self, attr, v)
             elif attr == "rebuilt_snaps" or attr == "market_snaps":
                 v = {}
@@ -2825,6 +4671,12 @@ class AXOB:
                         raise f"unable to load instrument_type={self.instrument_type}"
                     v.load(data[attr])
                 setattr(self, attr, v)
+            elif attr == "verifier":
+                v = verifier()
+                v.load(data[attr])
+                setattr(self, attr, v)
+            elif attr in ["bid_top_levels", "ask_top_levels"]:
+                setattr(self, attr, top_levels(data[attr], attr == "bid_top_levels"))
             else:
                 setattr(self, attr, data[attr])
 
@@ -2833,6 +4685,9 @@ class AXOB:
             # else:
             #     print(f'AXOB.{attr} not in load data!')
             #     setattr(self, attr, 0)
+        self._setBidCageRef(self.bid_cage_ref_px)
+        self._setAskCageRef(self.ask_cage_ref_px)
+        self._rebuildCageLevels()
 
         ## 日志
         self.logger = logging.getLogger(f"{self.SecurityID:06d}")
@@ -2848,3 +4703,192 @@ class AXOB:
         self.INFO = self.logger.info
         self.WARN = self.logger.warning
         self.ERR = self.logger.error
+        self.DBG_ON = self.logger.isEnabledFor(logging.DEBUG)
+        self.TRACE_ON = EXPORT_LEVEL_ACCESS and self.DBG_ON
+
+    def checkpoint(self, delta=False, snaps=False):
+        """
+        生成检查点：小段标量头部(pickle) + 订单及价格档的定长整数数组，restore一次读回
+          * delta=False: 全量，订单表按槽位原样写出(含空闲槽位及委托队列链接)
+          * delta=True: 增量，仅含上一检查点以来变化的订单及价格档，
+            由insertOrder/tradeLimit/onCancel及价格档增删处随处理记录(ckpt_orders/ckpt_*_levels)，
+            写出只与变化数成正比，与订单容器类型无关；此前没有检查点时无基准，告警并退化为全量
+          * snaps=True: 另附快照缓存段(pickle，见_saveSnaps)，恢复后可继续与行情快照比对；
+            缓存随未匹配的快照增长，默认不写，恢复出的快照缓存为空
+        每次检查点后以当前状态为新的基准，清空变化记录
+        """
+        if delta and self.ckpt_orders is None:
+            self.WARN(f"no base checkpoint, delta checkpoint #{self.ckpt_seq + 1} falls back to full")
+            delta = False
+        kind = CKPT_KIND.DELTA if delta else CKPT_KIND.FULL
+        base_seq = self.ckpt_seq
+        self.ckpt_seq += 1
+
+        scalars = pickle.dumps(self._saveScalars(), pickle.HIGHEST_PROTOCOL)
+        if snaps:
+            snaps = pickle.dumps(self._saveSnaps(), pickle.HIGHEST_PROTOCOL)
+        else:
+            snaps = b""
+        parts = [
+            CKPT_HEAD.pack(
+                CKPT_MAGIC,
+                CKPT_VERSION,
+                kind.value,
+                self.ckpt_seq,
+                base_seq,
+                len(scalars),
+                len(snaps),
+            ),
+            scalars,
+            snaps,
+        ]
+
+        order_map = self.order_map
+        if kind == CKPT_KIND.FULL:
+            ckpt_pack_arrays(parts, order_map_image(order_map))
+            ckpt_pack_arrays(
+                parts,
+                ckpt_level_image(self.bid_level_tree) + ckpt_level_image(self.ask_level_tree),
+            )
+        else:
+            ops = array("b")
+            applSeqNums = array("Q")
+            prices = array("q")
+            qtys = array("q")
+            sides = array("b")
+            types = array("b")
+            traded = array("b")
+            TransactTimes = array("q")
+            for applSeqNum, op in self.ckpt_orders.items():
+                ops.append(op)
+                applSeqNums.append(applSeqNum)
+                if op == ORDER_DELTA_OP.REMOVE:
+                    prices.append(0)
+                    qtys.append(0)
+                    sides.append(0)
+                    types.append(0)
+                    traded.append(0)
+                    TransactTimes.append(0)
+                else:
+                    order = order_map[applSeqNum]
+                    prices.append(order.price)
+                    qtys.append(order.qty)
+                    sides.append(order.side.value)
+                    types.append(order.type.value)
+                    traded.append(order.traded)
+                    TransactTimes.append(order.TransactTime)
+            ckpt_pack_arrays(
+                parts,
+                [ops, applSeqNums, prices, qtys, sides, types, traded, TransactTimes],
+            )
+            for levels in [self.ckpt_bid_levels, self.ckpt_ask_levels]:
+                ckpt_pack_arrays(
+                    parts, [array("q", levels.keys()), array("q", levels.values())]
+                )
+
+        self.ckpt_orders = {}
+        self.ckpt_bid_levels = {}
+        self.ckpt_ask_levels = {}
+        return b"".join(parts)
+
+    def restore(self, buf):
+        """
+        从checkpoint的输出恢复；增量检查点须按序依次作用在其基准检查点恢复出的对象上
+        可作用于AXOB.__new__(AXOB)得到的空对象(全量)
+        """
+        view = memoryview(buf)
+        magic, version, kind, seq, base_seq, scalars_len, snaps_len = CKPT_HEAD.unpack_from(
+            view
+        )
+        if magic != CKPT_MAGIC or version != CKPT_VERSION:
+            raise ValueError(f"bad checkpoint magic={magic} version={version}")
+        kind = CKPT_KIND(kind)
+        off = CKPT_HEAD.size
+        data = pickle.loads(view[off : off + scalars_len])
+        off += scalars_len
+        if snaps_len:
+            data.update(pickle.loads(view[off : off + snaps_len]))
+        else:
+            data.update(rebuilt_snaps={}, market_snaps={}, last_snap=None)
+        off += snaps_len
+        data["order_map"] = {}
+        data["bid_level_tree"] = {}
+        data["ask_level_tree"] = {}
+
+        if kind == CKPT_KIND.FULL:
+            self.load(data)
+            arrays, off = ckpt_unpack_arrays(view, off, ORDER_IMAGE_NB)
+            self.order_map = order_map_from_image(
+                arrays, self.order_store_type, self.level_queue
+            )
+            (bid_prices, bid_qtys, ask_prices, ask_qtys), off = ckpt_unpack_arrays(
+                view, off, 4
+            )
+            for tree, prices, qtys in [
+                (self.bid_level_tree, bid_prices, bid_qtys),
+                (self.ask_level_tree, ask_prices, ask_qtys),
+            ]:
+                for price, qty in zip(prices, qtys):
+                    tree[price] = level_node(price, qty, 0)
+        else:
+            if self.ckpt_orders is None or base_seq != self.ckpt_seq:
+                raise ValueError(
+                    f"checkpoint base_seq={base_seq} does not follow ckpt_seq={self.ckpt_seq}"
+                )
+            order_map = self.order_map
+            band = (self.level_tree_type, self.UpLimitPrice, self.DnLimitPrice)
+            trees = (self.bid_level_tree, self.ask_level_tree)
+            self.load(data)  # 价格档容器按当前价格带新建
+            if band == (self.level_tree_type, self.UpLimitPrice, self.DnLimitPrice):
+                self.bid_level_tree, self.ask_level_tree = trees  # 价格带未变，沿用
+            else:
+                for tree, base in zip((self.bid_level_tree, self.ask_level_tree), trees):
+                    for l in base.inorder_list_inc():
+                        tree[l.price] = level_node(l.price, l.qty, 0)
+
+            (
+                ops,
+                applSeqNums,
+                prices,
+                qtys,
+                sides,
+                types,
+                traded,
+                TransactTimes,
+            ), off = ckpt_unpack_arrays(view, off, 8)
+            for j, applSeqNum in enumerate(applSeqNums):
+                op = ops[j]
+                if op == ORDER_DELTA_OP.UPDATE:
+                    order = order_map[applSeqNum]
+                    order.price = prices[j]
+                    order.qty = qtys[j]
+                    order.traded = bool(traded[j])
+                    continue
+                if applSeqNum in order_map:
+                    order_map.pop(applSeqNum)
+                if op == ORDER_DELTA_OP.INSERT:  # 按变化先后追加，委托队列顺序不变
+                    order = ob_order.__new__(ob_order)
+                    order.applSeqNum = applSeqNum
+                    order.price = prices[j]
+                    order.qty = qtys[j]
+                    order.side = SIDE(sides[j])
+                    order.type = TYPE(types[j])
+                    order.traded = bool(traded[j])
+                    order.TransactTime = TransactTimes[j]
+                    order_map[applSeqNum] = order
+            self.order_map = order_map
+
+            for tree in [self.bid_level_tree, self.ask_level_tree]:
+                (prices, qtys), off = ckpt_unpack_arrays(view, off, 2)
+                for price, qty in zip(prices, qtys):
+                    if qty:
+                        tree[price] = level_node(price, qty, 0)  # []=维护前缀和
+                    elif price in tree:
+                        del tree[price]
+        self._rebuildCageLevels()
+
+        self._bindMsgHandlers()
+        self.ckpt_orders = {}
+        self.ckpt_bid_levels = {}
+        self.ckpt_ask_levels = {}
+        self.ckpt_seq = seq
@@ -0,0 +1,1288 @@
+# -*- coding: utf-8 -*-
+
+"""
+价格档位容器，供AXOB的bid_level_tree/ask_level_tree使用：
+  * 保持dict风格的接口(in/[]/pop/len)，以价格作为索引，值为level_node
+  * 提供有序访问：locate_min/locate_max/locate_lower/locate_higher/inorder_list_inc/inorder_list_dec
+    命名与binaryTree、LEVEL_ACCESS导出保持一致，便于与FPGA的树管理模块对照
+  * 不同实现可通过LEVEL_TREE_TYPE切换
+  * 档位数量的增减用add_qty/sub_qty，避免取出节点再写回
+  * 只需价格及数量时用qty_of/locate_*_pq/inorder_pq_*，不经level_node(DENSE不构造dense_level)
+  * 按价格区间批量删除/求和用pop_range/range_sum
+"""
+
+import abc
+from bisect import bisect_left, bisect_right, insort
+from enum import Enum
+
+
+class LEVEL_TREE_TYPE(Enum):
+    SORTED = 0  # 哈希+有序价格数组，默认；已知涨跌停时另建集合竞价撮合的前缀和
+    DENSE = 1  # 涨跌停价内的定长数组+占用位图，无涨跌停或超出价格带时退化为SORTED
+    HASH = 2  # 哈希+涨跌停价内的占用位图，无涨跌停或超出价格带时退化为SORTED
+
+
+BAND_SPAN_MAX = 1 << 16  # 价格带超过此档数时不使用占用位图
+BITMAP_WORD_BITS = 64  # 位图字宽，与FPGA的字宽一致
+BITMAP_WORD_SHIFT = 6  # log2(BITMAP_WORD_BITS)
+BITMAP_WORD_MASK = BITMAP_WORD_BITS - 1
+
+
+class level_bitmap:
+    """
+    分层占用位图：第0层每位对应一个价格档，上一层每位对应下一层的一个非零字
+    find_next/find_prev 每层只看一个字，层数为log64(档数)，价格带6万档时只有3层
+    """
+
+    __slots__ = [
+        "levels",  # levels[0]为叶子层；每层为字列表，每字BITMAP_WORD_BITS位
+        "nb",  # 总位数
+    ]
+
+    def __init__(self, nb):
+        self.nb = nb
+        self.levels = []
+        while True:
+            n = (nb + BITMAP_WORD_BITS - 1) // BITMAP_WORD_BITS
+            self.levels.append([0] * n)
+            if n <= 1:
+                break
+            nb = n
+
+    def test(self, i):
+        return (self.levels[0][i // BITMAP_WORD_BITS] >> (i % BITMAP_WORD_BITS)) & 1
+
+    def set(self, i):
+        for words in self.levels:
+            w, b = divmod(i, BITMAP_WORD_BITS)
+            old = words[w]
+            words[w] = old | (1 << b)
+            if old:  # 上层已置位
+                break
+            i = w
+
+    def clear(self, i):
+        for words in self.levels:
+            w, b = divmod(i, BITMAP_WORD_BITS)
+            words[w] &= ~(1 << b)
+            if words[w]:  # 本字仍非零，上层不变
+                break
+            i = w
+
+    def reset(self):
+        for words in self.levels:
+            words[:] = [0] * len(words)
+
+    def find_next(self, i):
+        """下标>=i的最低置位，不存在时返回-1"""
+        if i < 0:
+            i = 0
+        levels = self.levels
+        lv = 0
+        while lv < len(levels):
+            words = levels[lv]
+            w = i >> BITMAP_WORD_SHIFT
+            if w >= len(words):
+                return -1
+            m = words[w] & (-1 << (i & BITMAP_WORD_MASK))
+            if m:
+                i = (w << BITMAP_WORD_SHIFT) + (m & -m).bit_length() - 1
+                break
+            i = w + 1
+            lv += 1
+        else:
+            return -1
+        while lv:  # 逐层向下取最低置位
+            lv -= 1
+            m = levels[lv][i]
+            i = (i << BITMAP_WORD_SHIFT) + (m & -m).bit_length() - 1
+        return i
+
+    def find_prev(self, i):
+        """下标<=i的最高置位，不存在时返回-1"""
+        if i >= self.nb:
+            i = self.nb - 1
+        levels = self.levels
+        lv = 0
+        while lv < len(levels):
+            if i < 0:
+                return -1
+            w = i >> BITMAP_WORD_SHIFT
+            m = levels[lv][w] & ((2 << (i & BITMAP_WORD_MASK)) - 1)
+            if m:
+                i = (w << BITMAP_WORD_SHIFT) + m.bit_length() - 1
+                break
+            i = w - 1
+            lv += 1
+        else:
+            return -1
+        while lv:  # 逐层向下取最高置位
+            lv -= 1
+            i = (i << BITMAP_WORD_SHIFT) + levels[lv][i].bit_length() - 1
+        return i
+
+
+class level_tree_base(metaclass=abc.ABCMeta):
+    """
+    价格档位容器的有序访问接口
+    locate_*返回level_node，不存在时返回None；
+    inorder_list_*在遍历期间不可增删价格档（与二叉树相同）
+    """
+
+    __slots__ = []
+
+    psum = None  # 数量前缀和，见prefix_sum_ready
+
+    @abc.abstractmethod
+    def locate_min(self):
+        """最低价格档"""
+
+    @abc.abstractmethod
+    def locate_max(self):
+        """最高价格档"""
+
+    @abc.abstractmethod
+    def locate_lower(self, price):
+        """严格低于price的最高价格档"""
+
+    @abc.abstractmethod
+    def locate_higher(self, price):
+        """严格高于price的最低价格档"""
+
+    @abc.abstractmethod
+    def inorder_list_inc(self, price=None):
+        """从小到大遍历，price不为None时从大于等于price的价格档开始"""
+
+    @abc.abstractmethod
+    def inorder_list_dec(self, price=None):
+        """从大到小遍历，price不为None时从小于等于price的价格档开始"""
+
+    @abc.abstractmethod
+    def qty_of(self, price):
+        """已存在的价格档的数量"""
+
+    @abc.abstractmethod
+    def locate_min_pq(self):
+        """同locate_min，返回(price, qty)"""
+
+    @abc.abstractmethod
+    def locate_max_pq(self):
+        """同locate_max，返回(price, qty)"""
+
+    @abc.abstractmethod
+    def locate_lower_pq(self, price):
+        """同locate_lower，返回(price, qty)"""
+
+    @abc.abstractmethod
+    def locate_higher_pq(self, price):
+        """同locate_higher，返回(price, qty)"""
+
+    def inorder_pq_inc(self, price=None):
+        """同inorder_list_inc，逐档给出(price, qty)"""
+        for l in self.inorder_list_inc(price):
+            yield l.price, l.qty
+
+    def inorder_pq_dec(self, price=None):
+        """同inorder_list_dec，逐档给出(price, qty)"""
+        for l in self.inorder_list_dec(price):
+            yield l.price, l.qty
+
+    @abc.abstractmethod
+    def add_qty(self, price, qty):
+        """已存在的价格档增加数量，返回新数量"""
+
+    @abc.abstractmethod
+    def sub_qty(self, price, qty):
+        """已存在的价格档减少数量，返回剩余数量（为0时价格档仍存在，需另行pop）"""
+
+    def pop_range(self, lo=None, hi=None):
+        """
+        删除价格在[lo, hi]内的全部价格档，None表示该侧不限
+        返回：(被删除的价格档(升序), 数量和, 金额和)
+        """
+        prices = []
+        for l in self.inorder_list_inc(lo):
+            if hi is not None and l.price > hi:
+                break
+            prices.append(l.price)
+        removed = [self.pop(p) for p in prices]
+        return removed, sum(l.qty for l in removed), sum(l.price * l.qty for l in removed)
+
+    def range_sum(self, lo=None, hi=None):
+        """价格在[lo, hi]内的价格档的(数量和, 金额和)，None表示该侧不限"""
+        qty = value = 0
+        for l in self.inorder_list_inc(lo):
+            if hi is not None and l.price > hi:
+                break
+            qty += l.qty
+            value += l.price * l.qty
+        return qty, value
+
+    def prefix_sum_ready(self):
+        """
+        建立（或沿用）价格网格上的数量前缀和，可用时返回True
+        前缀和只跟踪[]=/pop/add_qty/sub_qty，不能直接改节点的qty
+        """
+        return False
+
+    def drop_prefix_sum(self):
+        """不再需要前缀和时释放，省去逐笔维护的开销"""
+
+
+class sorted_level_tree(dict, level_tree_base):
+    """
+    哈希索引 + 升序价格数组
+      * in/[]/len 直接走dict
+      * 插入/删除价格档时用二分维护价格数组，查找O(logL)，数组搬移为连续内存拷贝
+      * locate_min/locate_max O(1)，locate_lower/locate_higher O(logL)，遍历k档O(logL+k)
+      * 已知涨跌停价格带时，集合竞价撮合所需的数量前缀和建在价格带网格上(同banded_level_tree)，
+        下标为price-base；价格带外出现价格档时前缀和作废，由prefix_sum_ready判断
+    """
+
+    __slots__ = [
+        "prices",  # 升序排列的价格
+        "base",  # 价格带下沿，None=价格带未知
+        "span",  # 价格带档数
+        "psum",  # 价格带内的数量前缀和，None=未启用
+    ]
+
+    def __init__(self, price_lo=None, price_hi=None):
+        super().__init__()
+        self.prices = []
+        self.base = price_lo
+        self.span = 0 if price_lo is None else price_hi - price_lo + 1
+        self.psum = None
+
+    def _band(self):
+        """构造参数，copy/pickle时沿用价格带"""
+        return () if self.base is None else (self.base, self.base + self.span - 1)
+
+    def _psumAdd(self, price, qty):
+        i = price - self.base
+        if 0 <= i < self.span:
+            self.psum.add(i, qty)
+        else:  # 价格带外的价格档，前缀和不完整
+            self.psum = None
+
+    def __setitem__(self, price, node):
+        if not dict.__contains__(self, price):
+            insort(self.prices, price)
+            if self.psum is not None:
+                self._psumAdd(price, node.qty)
+        elif self.psum is not None:
+            self._psumAdd(price, node.qty - dict.__getitem__(self, price).qty)
+        dict.__setitem__(self, price, node)
+
+    def __delitem__(self, price):
+        l = dict.pop(self, price)
+        del self.prices[bisect_left(self.prices, price)]
+        if self.psum is not None:
+            self._psumAdd(price, -l.qty)
+
+    def pop(self, price, *default):
+        if dict.__contains__(self, price):
+            del self.prices[bisect_left(self.prices, price)]
+            l = dict.pop(self, price)
+            if self.psum is not None:
+                self._psumAdd(price, -l.qty)
+            return l
+        return dict.pop(self, price, *default)
+
+    def setdefault(self, price, node=None):
+        if not dict.__contains__(self, price):
+            self[price] = node
+        return dict.__getitem__(self, price)
+
+    def update(self, *args, **kwargs):
+        for price, node in dict(*args, **kwargs).items():
+            self[price] = node
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def popitem(self):
+        """取出最高价格档(price, level_node)"""
+        if not self.prices:
+            raise KeyError("popitem(): sorted_level_tree is empty")
+        price = self.prices.pop()
+        l = dict.pop(self, price)
+        if self.psum is not None:
+            self._psumAdd(price, -l.qty)
+        return price, l
+
+    def clear(self):
+        dict.clear(self)
+        self.prices.clear()
+        self.psum = None
+
+    def copy(self):
+        t = sorted_level_tree(*self._band())
+        dict.update(t, self)
+        t.prices = self.prices.copy()
+        return t
+
+    @classmethod
+    def fromkeys(cls, prices, node=None):
+        t = cls()
+        for price in prices:
+            t[price] = node
+        return t
+
+    def __reduce__(self):
+        # copy/deepcopy/pickle：经__init__重建prices，再逐档__setitem__
+        return self.__class__, self._band(), None, None, iter(dict.items(self))
+
+    def locate_min(self):
+        if self.prices:
+            return dict.__getitem__(self, self.prices[0])
+        return None
+
+    def locate_max(self):
+        if self.prices:
+            return dict.__getitem__(self, self.prices[-1])
+        return None
+
+    def locate_lower(self, price):
+        i = bisect_left(self.prices, price)
+        if i:
+            return dict.__getitem__(self, self.prices[i - 1])
+        return None
+
+    def locate_higher(self, price):
+        i = bisect_right(self.prices, price)
+        if i < len(self.prices):
+            return dict.__getitem__(self, self.prices[i])
+        return None
+
+    def qty_of(self, price):
+        return dict.__getitem__(self, price).qty
+
+    def locate_min_pq(self):
+        if self.prices:
+            price = self.prices[0]
+            return price, dict.__getitem__(self, price).qty
+        return None
+
+    def locate_max_pq(self):
+        if self.prices:
+            price = self.prices[-1]
+            return price, dict.__getitem__(self, price).qty
+        return None
+
+    def locate_lower_pq(self, price):
+        i = bisect_left(self.prices, price)
+        if i:
+            price = self.prices[i - 1]
+            return price, dict.__getitem__(self, price).qty
+        return None
+
+    def locate_higher_pq(self, price):
+        i = bisect_right(self.prices, price)
+        if i < len(self.prices):
+            price = self.prices[i]
+            return price, dict.__getitem__(self, price).qty
+        return None
+
+    def inorder_list_inc(self, price=None):
+        prices = self.prices
+        i = 0 if price is None else bisect_left(prices, price)
+        while i < len(prices):
+            yield dict.__getitem__(self, prices[i])
+            i += 1
+
+    def inorder_list_dec(self, price=None):
+        prices = self.prices
+        i = len(prices) - 1 if price is None else bisect_right(prices, price) - 1
+        while i >= 0:
+            yield dict.__getitem__(self, prices[i])
+            i -= 1
+
+    def inorder_pq_inc(self, price=None):
+        prices = self.prices
+        i = 0 if price is None else bisect_left(prices, price)
+        while i < len(prices):
+            p = prices[i]
+            yield p, dict.__getitem__(self, p).qty
+            i += 1
+
+    def inorder_pq_dec(self, price=None):
+        prices = self.prices
+        i = len(prices) - 1 if price is None else bisect_right(prices, price) - 1
+        while i >= 0:
+            p = prices[i]
+            yield p, dict.__getitem__(self, p).qty
+            i -= 1
+
+    def add_qty(self, price, qty):
+        l = dict.__getitem__(self, price)
+        l.qty += qty
+        if self.psum is not None:
+            self._psumAdd(price, qty)
+        return l.qty
+
+    def sub_qty(self, price, qty):
+        l = dict.__getitem__(self, price)
+        l.qty -= qty
+        if self.psum is not None:
+            self._psumAdd(price, -qty)
+        return l.qty
+
+    def pop_range(self, lo=None, hi=None):
+        """价格数组只做一次切片删除"""
+        prices = self.prices
+        i = 0 if lo is None else bisect_left(prices, lo)
+        j = len(prices) if hi is None else bisect_right(prices, hi)
+        removed = [dict.pop(self, p) for p in prices[i:j]]
+        del prices[i:j]
+        qty = value = 0
+        for l in removed:
+            qty += l.qty
+            value += l.price * l.qty
+            if self.psum is not None:
+                self._psumAdd(l.price, -l.qty)
+        return removed, qty, value
+
+    def prefix_sum_ready(self):
+        if self.base is None:
+            return False
+        prices = self.prices
+        if prices and (prices[0] < self.base or prices[-1] >= self.base + self.span):
+            return False  # 价格带外有价格档，前缀和不完整
+        if self.psum is None:
+            qtys = [0] * self.span
+            for p in prices:
+                qtys[p - self.base] = dict.__getitem__(self, p).qty
+            self.psum = prefix_sum(qtys)
+        return True
+
+    def drop_prefix_sum(self):
+        self.psum = None
+
+    def range_sum(self, lo=None, hi=None):
+        prices = self.prices
+        i = 0 if lo is None else bisect_left(prices, lo)
+        j = len(prices) if hi is None else bisect_right(prices, hi)
+        qty = value = 0
+        for p in prices[i:j]:
+            q = dict.__getitem__(self, p).qty
+            qty += q
+            value += p * q
+        return qty, value
+
+
+class prefix_sum:
+    """
+    树状数组(Fenwick)：单点增减、前缀和、按前缀和查找下标，均为O(logN)
+    """
+
+    __slots__ = [
+        "tree",  # 1-based
+        "nb",
+        "total",
+        "top_bit",  # 不超过nb的最高位，用于lower_bound
+    ]
+
+    def __init__(self, values):
+        nb = len(values)
+        tree = [0] * (nb + 1)
+        for i, v in enumerate(values, 1):
+            tree[i] += v
+            j = i + (i & -i)
+            if j <= nb:
+                tree[j] += tree[i]
+        self.tree = tree
+        self.nb = nb
+        self.total = sum(values)
+        self.top_bit = 1 << (nb.bit_length() - 1) if nb else 0
+
+    def add(self, i, delta):
+        self.total += delta
+        tree = self.tree
+        i += 1
+        while i <= self.nb:
+            tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i):
+        """下标[0, i]之和"""
+        tree = self.tree
+        s = 0
+        i = min(i, self.nb - 1) + 1
+        while i > 0:
+            s += tree[i]
+            i -= i & -i
+        return s
+
+    def lower_bound(self, x):
+        """prefix(i)>=x的最小下标i，x>total时返回nb"""
+        tree = self.tree
+        pos = 0
+        bit = self.top_bit
+        while bit:
+            nxt = pos + bit
+            if nxt <= self.nb and tree[nxt] < x:
+                pos = nxt
+                x -= tree[nxt]
+            bit >>= 1
+        return pos
+
+
+class banded_level_tree(level_tree_base):
+    """
+    以涨跌停价格带为网格的价格档容器，价格档是否存在由分层占用位图记录：
+      * 最优价及上下一档由位图find_next/find_prev查找，与档数无关
+      * 价格带外的价格（如PRICE_MAXIMUM）存入sparse(SORTED)
+    子类决定档内数据的存放方式（_get/_put/_drop/_add）。
+    数量为0的价格档可以存在（与dict一致，由调用者pop）
+    """
+
+    __slots__ = [
+        "base",  # 价格带下沿，即DnLimitPrice
+        "span",  # 价格带档数
+        "bitmap",  # 占用位图，bit i对应价格base+i
+        "size",  # 价格带内的档数
+        "sparse",  # 价格带外的价格档
+        "psum",  # 价格带内的数量前缀和，None=未启用
+    ]
+
+    def __init__(self, price_lo, price_hi):
+        self.base = price_lo
+        self.span = price_hi - price_lo + 1
+        self.bitmap = level_bitmap(self.span)
+        self.size = 0
+        self.sparse = sorted_level_tree()
+        self.psum = None
+
+    @abc.abstractmethod
+    def _get(self, i):
+        """下标i的价格档"""
+
+    @abc.abstractmethod
+    def _qty(self, i):
+        """下标i的价格档数量"""
+
+    @abc.abstractmethod
+    def _put(self, i, node):
+        """写入下标i的价格档"""
+
+    @abc.abstractmethod
+    def _drop(self, i):
+        """移除下标i的价格档并返回"""
+
+    @abc.abstractmethod
+    def _erase(self, i):
+        """移除下标i的价格档"""
+
+    @abc.abstractmethod
+    def _add(self, i, qty):
+        """下标i的价格档增加数量，返回新数量"""
+
+    def _reset(self):
+        pass
+
+    def _index(self, price):
+        i = price - self.base
+        if 0 <= i < self.span:
+            return i
+        return -1
+
+    def __len__(self):
+        return self.size + len(self.sparse)
+
+    def __contains__(self, price):
+        i = self._index(price)
+        if i >= 0:
+            return self.bitmap.test(i) == 1
+        return price in self.sparse
+
+    def __getitem__(self, price):
+        i = self._index(price)
+        if i >= 0:
+            if not self.bitmap.test(i):
+                raise KeyError(price)
+            return self._get(i)
+        return self.sparse[price]
+
+    def __setitem__(self, price, node):
+        i = self._index(price)
+        if i >= 0:
+            if not self.bitmap.test(i):
+                self.bitmap.set(i)
+                self.size += 1
+                if self.psum is not None:
+                    self.psum.add(i, node.qty)
+            elif self.psum is not None:
+                self.psum.add(i, node.qty - self._get(i).qty)
+            self._put(i, node)
+        else:
+            self.sparse[price] = node
+
+    def __delitem__(self, price):
+        """同pop，不返回被删除的价格档"""
+        i = self._index(price)
+        if i >= 0:
+            if not self.bitmap.test(i):
+                raise KeyError(price)
+            self.bitmap.clear(i)
+            self.size -= 1
+            if self.psum is not None:
+                self.psum.add(i, -self._qty(i))
+            self._erase(i)
+        else:
+            del self.sparse[price]
+
+    def pop(self, price, *default):
+        i = self._index(price)
+        if i >= 0:
+            if not self.bitmap.test(i):
+                if default:
+                    return default[0]
+                raise KeyError(price)
+            self.bitmap.clear(i)
+            self.size -= 1
+            l = self._drop(i)
+            if self.psum is not None:
+                self.psum.add(i, -l.qty)
+            return l
+        return self.sparse.pop(price, *default)
+
+    def clear(self):
+        self.bitmap.reset()
+        self.size = 0
+        self.sparse.clear()
+        self._reset()
+        self.psum = None
+
+    def prefix_sum_ready(self):
+        if len(self.sparse):  # 价格带外有价格档，前缀和不完整
+            return False
+        if self.psum is None:
+            qtys = [0] * self.span
+            i = self.bitmap.find_next(0)
+            while i >= 0:
+                qtys[i] = self._get(i).qty
+                i = self.bitmap.find_next(i + 1)
+            self.psum = prefix_sum(qtys)
+        return True
+
+    def drop_prefix_sum(self):
+        self.psum = None
+
+    def __iter__(self):
+        for l in self.inorder_list_inc():
+            yield l.price
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return list(self.inorder_list_inc())
+
+    def items(self):
+        return [(l.price, l) for l in self.inorder_list_inc()]
+
+    def locate_min(self):
+        l = self.sparse.locate_min()
+        if l is not None and l.price < self.base:
+            return l
+        i = self.bitmap.find_next(0)
+        if i >= 0:
+            return self._get(i)
+        return l
+
+    def locate_max(self):
+        l = self.sparse.locate_max()
+        if l is not None and l.price >= self.base + self.span:
+            return l
+        i = self.bitmap.find_prev(self.span - 1)
+        if i >= 0:
+            return self._get(i)
+        return l
+
+    def locate_lower(self, price):
+        l = self.sparse.locate_lower(price)
+        if l is not None and l.price >= self.base + self.span:
+            return l
+        i = self.bitmap.find_prev(price - self.base - 1)
+        if i >= 0:
+            return self._get(i)
+        return l
+
+    def locate_higher(self, price):
+        l = self.sparse.locate_higher(price)
+        if l is not None and l.price < self.base:
+            return l
+        i = self.bitmap.find_next(price - self.base + 1)
+        if i >= 0:
+            return self._get(i)
+        return l
+
+    def qty_of(self, price):
+        i = self._index(price)
+        if i >= 0:
+            if not self.bitmap.test(i):
+                raise KeyError(price)
+            return self._qty(i)
+        return self.sparse.qty_of(price)
+
+    def locate_min_pq(self):
+        l = self.sparse.locate_min_pq()
+        if l is not None and l[0] < self.base:
+            return l
+        i = self.bitmap.find_next(0)
+        if i >= 0:
+            return self.base + i, self._qty(i)
+        return l
+
+    def locate_max_pq(self):
+        l = self.sparse.locate_max_pq()
+        if l is not None and l[0] >= self.base + self.span:
+            return l
+        i = self.bitmap.find_prev(self.span - 1)
+        if i >= 0:
+            return self.base + i, self._qty(i)
+        return l
+
+    def locate_lower_pq(self, price):
+        l = self.sparse.locate_lower_pq(price)
+        if l is not None and l[0] >= self.base + self.span:
+            return l
+        i = self.bitmap.find_prev(price - self.base - 1)
+        if i >= 0:
+            return self.base + i, self._qty(i)
+        return l
+
+    def locate_higher_pq(self, price):
+        l = self.sparse.locate_higher_pq(price)
+        if l is not None and l[0] < self.base:
+            return l
+        i = self.bitmap.find_next(price - self.base + 1)
+        if i >= 0:
+            return self.base + i, self._qty(i)
+        return l
+
+    def inorder_list_inc(self, price=None):
+        base = self.base
+        for l in self.sparse.inorder_list_inc(price):
+            if l.price >= base:
+                break
+            yield l
+        i = self.bitmap.find_next(0 if price is None else price - base)
+        while i >= 0:
+            yield self._get(i)
+            i = self.bitmap.find_next(i + 1)
+        top = base + self.span
+        yield from self.sparse.inorder_list_inc(
+            top if price is None else max(price, top)
+        )
+
+    def inorder_list_dec(self, price=None):
+        top = self.base + self.span
+        for l in self.sparse.inorder_list_dec(price):
+            if l.price < top:
+                break
+            yield l
+        i = self.bitmap.find_prev(self.span - 1 if price is None else price - self.base)
+        while i >= 0:
+            yield self._get(i)
+            i = self.bitmap.find_prev(i - 1)
+        bottom = self.base - 1
+        yield from self.sparse.inorder_list_dec(
+            bottom if price is None else min(price, bottom)
+        )
+
+    def add_qty(self, price, qty):
+        i = self._index(price)
+        if i >= 0:
+            if self.psum is not None:
+                self.psum.add(i, qty)
+            return self._add(i, qty)
+        return self.sparse.add_qty(price, qty)
+
+    def sub_qty(self, price, qty):
+        i = self._index(price)
+        if i >= 0:
+            if self.psum is not None:
+                self.psum.add(i, -qty)
+            return self._add(i, -qty)
+        return self.sparse.sub_qty(price, qty)
+
+
+class dense_level:
+    """
+    定长数组中的价格档，接口同level_node(price/qty/save)
+    qtys/i指向数组中的数量，从容器中pop出的价格档指向自己的单元素数组
+    """
+
+    __slots__ = ["qtys", "i", "price"]
+
+    def __init__(self, qtys, i, price):
+        self.qtys = qtys
+        self.i = i
+        self.price = price
+
+    @property
+    def qty(self):
+        return self.qtys[self.i]
+
+    @qty.setter
+    def qty(self, qty):
+        self.qtys[self.i] = qty
+
+    def save(self):
+        """save/load 用于保存/加载测试时刻，格式同level_node"""
+        return {"price": self.price, "qty": self.qty}
+
+    def __str__(self) -> str:
+        return f"{self.price}\t{self.qty}"
+
+
+class dense_level_tree(banded_level_tree):
+    """
+    价格带内的价格档数量存于以(price-DnLimitPrice)为下标的定长数组
+      * 插入/删除/增减数量 O(1)，无哈希
+      * 档位不是对象：AXOB逐笔用到的in/[]=/del/add_qty/sub_qty/qty_of/locate_*_pq/inorder_pq_*
+        按下标直接读写qtys及位图叶子层；[]/pop/locate_*/inorder_list_*仍构造dense_level，不在逐笔路径上
+    取舍：逐笔的价格档操作约为SORTED的1.35倍(SORTED为C实现的dict+bisect)，整日回放仍略慢；
+    集合竞价的前缀和撮合SORTED同样支持(同一价格带网格上的树状数组)，性能上不再有选用DENSE的理由，
+    保留用于对照FPGA的定长数组实现
+    """
+
+    __slots__ = [
+        "qtys",  # 各档数量
+        "words",  # 位图叶子层(bitmap.levels[0])，判断价格档是否存在时直接取字
+    ]
+
+    def __init__(self, price_lo, price_hi):
+        super().__init__(price_lo, price_hi)
+        self.qtys = [0] * self.span
+        self.words = self.bitmap.levels[0]  # reset就地清零，引用不失效
+
+    ## 以下按下标直接读写qtys及位图，不经_get/_qty/_add，也不构造dense_level
+    def __contains__(self, price):
+        i = price - self.base
+        if 0 <= i < self.span:
+            return (self.words[i >> BITMAP_WORD_SHIFT] >> (i & BITMAP_WORD_MASK)) & 1 == 1
+        return price in self.sparse
+
+    def __setitem__(self, price, node):
+        i = price - self.base
+        if 0 <= i < self.span:
+            qty = node.qty
+            words = self.words
+            j = i >> BITMAP_WORD_SHIFT
+            w = words[j]
+            bit = 1 << (i & BITMAP_WORD_MASK)
+            if w & bit:
+                if self.psum is not None:
+                    self.psum.add(i, qty - self.qtys[i])
+            else:
+                if w:  # 叶子字已非零，上层不变
+                    words[j] = w | bit
+                else:
+                    self.bitmap.set(i)
+                self.size += 1
+                if self.psum is not None:
+                    self.psum.add(i, qty)
+            self.qtys[i] = qty
+        else:
+            self.sparse[price] = node
+
+    def __delitem__(self, price):
+        i = price - self.base
+        if 0 <= i < self.span:
+            words = self.words
+            j = i >> BITMAP_WORD_SHIFT
+            bit = 1 << (i & BITMAP_WORD_MASK)
+            w = words[j]
+            if not w & bit:
+                raise KeyError(price)
+            if w ^ bit:  # 叶子字仍非零，上层不变
+                words[j] = w ^ bit
+            else:
+                self.bitmap.clear(i)
+            self.size -= 1
+            if self.psum is not None:
+                self.psum.add(i, -self.qtys[i])
+            self.qtys[i] = 0
+        else:
+            del self.sparse[price]
+
+    def add_qty(self, price, qty):
+        i = price - self.base
+        if 0 <= i < self.span:
+            if self.psum is not None:
+                self.psum.add(i, qty)
+            qtys = self.qtys
+            qtys[i] += qty
+            return qtys[i]
+        return self.sparse.add_qty(price, qty)
+
+    def sub_qty(self, price, qty):
+        i = price - self.base
+        if 0 <= i < self.span:
+            if self.psum is not None:
+                self.psum.add(i, -qty)
+            qtys = self.qtys
+            qtys[i] -= qty
+            return qtys[i]
+        return self.sparse.sub_qty(price, qty)
+
+    def qty_of(self, price):
+        i = price - self.base
+        if 0 <= i < self.span:
+            if not (self.words[i >> BITMAP_WORD_SHIFT] >> (i & BITMAP_WORD_MASK)) & 1:
+                raise KeyError(price)
+            return self.qtys[i]
+        return self.sparse.qty_of(price)
+
+    def locate_min_pq(self):
+        l = self.sparse.locate_min_pq() if self.sparse else None
+        if l is not None and l[0] < self.base:
+            return l
+        i = self.bitmap.find_next(0)
+        if i >= 0:
+            return self.base + i, self.qtys[i]
+        return l
+
+    def locate_max_pq(self):
+        l = self.sparse.locate_max_pq() if self.sparse else None
+        if l is not None and l[0] >= self.base + self.span:
+            return l
+        i = self.bitmap.find_prev(self.span - 1)
+        if i >= 0:
+            return self.base + i, self.qtys[i]
+        return l
+
+    def locate_lower_pq(self, price):
+        l = self.sparse.locate_lower_pq(price) if self.sparse else None
+        if l is not None and l[0] >= self.base + self.span:
+            return l
+        i = self.bitmap.find_prev(price - self.base - 1)
+        if i >= 0:
+            return self.base + i, self.qtys[i]
+        return l
+
+    def locate_higher_pq(self, price):
+        l = self.sparse.locate_higher_pq(price) if self.sparse else None
+        if l is not None and l[0] < self.base:
+            return l
+        i = self.bitmap.find_next(price - self.base + 1)
+        if i >= 0:
+            return self.base + i, self.qtys[i]
+        return l
+
+    def inorder_pq_inc(self, price=None):
+        base = self.base
+        sparse = self.sparse
+        if sparse:
+            for p, q in sparse.inorder_pq_inc(price):
+                if p >= base:
+                    break
+                yield p, q
+        qtys = self.qtys
+        find_next = self.bitmap.find_next
+        i = find_next(0 if price is None else price - base)
+        while i >= 0:
+            yield base + i, qtys[i]
+            i = find_next(i + 1)
+        if sparse:
+            top = base + self.span
+            yield from sparse.inorder_pq_inc(top if price is None else max(price, top))
+
+    def inorder_pq_dec(self, price=None):
+        base = self.base
+        top = base + self.span
+        sparse = self.sparse
+        if sparse:
+            for p, q in sparse.inorder_pq_dec(price):
+                if p < top:
+                    break
+                yield p, q
+        qtys = self.qtys
+        find_prev = self.bitmap.find_prev
+        i = find_prev(self.span - 1 if price is None else price - base)
+        while i >= 0:
+            yield base + i, qtys[i]
+            i = find_prev(i - 1)
+        if sparse:
+            yield from sparse.inorder_pq_dec(base - 1 if price is None else min(price, base - 1))
+
+    def _get(self, i):
+        return dense_level(self.qtys, i, self.base + i)
+
+    def _qty(self, i):
+        return self.qtys[i]
+
+    def _put(self, i, node):
+        self.qtys[i] = node.qty
+
+    def _drop(self, i):
+        l = dense_level([self.qtys[i]], 0, self.base + i)
+        self.qtys[i] = 0
+        return l
+
+    def _erase(self, i):
+        self.qtys[i] = 0
+
+    def _add(self, i, qty):
+        self.qtys[i] += qty
+        return self.qtys[i]
+
+    def _reset(self):
+        self.qtys = [0] * self.span
+
+
+class hash_level_tree(banded_level_tree):
+    """
+    价格档节点存于哈希表（同dict实现），有序访问走占用位图
+    """
+
+    __slots__ = ["nodes"]  # 下标 : level_node
+
+    def __init__(self, price_lo, price_hi):
+        super().__init__(price_lo, price_hi)
+        self.nodes = {}
+
+    def _get(self, i):
+        return self.nodes[i]
+
+    def _qty(self, i):
+        return self.nodes[i].qty
+
+    def _put(self, i, node):
+        self.nodes[i] = node
+
+    def _drop(self, i):
+        return self.nodes.pop(i)
+
+    def _erase(self, i):
+        del self.nodes[i]
+
+    def _add(self, i, qty):
+        l = self.nodes[i]
+        l.qty += qty
+        return l.qty
+
+    def _reset(self):
+        self.nodes.clear()
+
+
+class top_levels:
+    """
+    单边最优N档缓存，供生成快照时直接取用：
+      * 价格档数量变化时由update就地修补，只处理缓存范围内及紧邻的价格档
+      * 缓存末尾之后的档位被删空时先不补齐，留到fetch时从价格档容器中补
+      * bound为构建时的笼子外边界（买方不含>=bound，卖方不含<=bound，None表示无）；
+        边界变化后fetch时整体重建
+      * version在可见内容变化时递增，未变时可直接复用上次生成的快照档位
+    """
+
+    __slots__ = [
+        "nb",  # 缓存档数
+        "desc",  # True=买方(从大到小)，False=卖方(从小到大)
+        "bound",
+        "prices",  # 最优在前
+        "qtys",
+        "tail_open",  # 末尾之后可能还有未缓存的价格档
+        "valid",
+        "version",
+        "snap_levels",  # 上次生成的快照档位，array('q')按(Price,Qty)交错
+        "snap_version",
+    ]
+
+    def __init__(self, nb, desc):
+        self.nb = nb
+        self.desc = desc
+        self.bound = None
+        self.prices = []
+        self.qtys = []
+        self.tail_open = False
+        self.valid = False
+        self.version = 0
+        self.snap_levels = None
+        self.snap_version = -1
+
+    def invalidate(self):
+        self.valid = False
+        self.version += 1
+
+    def _visible(self, price):
+        if self.bound is None:
+            return True
+        return price < self.bound if self.desc else price > self.bound
+
+    def update(self, price, qty):
+        """价格档price的数量变为qty，qty=0表示价格档被删除"""
+        if not self.valid or not self._visible(price):
+            return
+        prices = self.prices
+        for i, p in enumerate(prices):
+            if p == price:
+                if qty:
+                    self.qtys[i] = qty
+                else:
+                    del prices[i]
+                    del self.qtys[i]
+                self.version += 1
+                return
+            if (p < price) if self.desc else (p > price):  # 新价格优于第i档
+                if qty:
+                    prices.insert(i, price)
+                    self.qtys.insert(i, qty)
+                    if len(prices) > self.nb:
+                        prices.pop()
+                        self.qtys.pop()
+                        self.tail_open = True
+                    self.version += 1
+                return
+        if qty:  # 劣于所有缓存档
+            if not self.tail_open and len(prices) < self.nb:
+                prices.append(price)
+                self.qtys.append(qty)
+                self.version += 1
+            else:
+                self.tail_open = True
+
+    def fetch(self, tree, bound):
+        """按当前笼子外边界校准缓存，必要时从tree重建或补齐末尾"""
+        if not self.valid or bound != self.bound:
+            self.bound = bound
+            self.prices = []
+            self.qtys = []
+            self.tail_open = True
+            self.valid = True
+            self.version += 1
+        if self.tail_open and len(self.prices) < self.nb:
+            if self.prices:
+                start = self.prices[-1] + (-1 if self.desc else 1)
+            elif bound is not None:
+                start = bound + (-1 if self.desc else 1)
+            else:
+                start = None
+            levels = tree.inorder_pq_dec(start) if self.desc else tree.inorder_pq_inc(start)
+            for price, qty in levels:
+                if len(self.prices) >= self.nb:
+                    break
+                self.prices.append(price)
+                self.qtys.append(qty)
+                self.version += 1
+            self.tail_open = len(self.prices) >= self.nb
+        return self.prices, self.qtys
+
+
+class cage_levels:
+    """
+    单边价格笼子外的隐藏档价格，与价格档容器分开维护（价格档数量仍在容器中）：
+      * 买方隐藏档为>=笼子外最低价的全部价格档，进笼从低到高；卖方为<=笼子外最高价的全部价格档，进笼从高到低
+      * keys按进笼顺序的逆序存放，下一个进笼的价格档在末尾，next/pop_next为O(1)
+      * 笼子外边界下移(买)/上移(卖)时，由insert从价格档容器中补入原边界与新边界之间的价格档
+    """
+
+    __slots__ = [
+        "desc",  # True=买方，keys为-price；False=卖方，keys为price
+        "keys",  # 升序
+    ]
+
+    def __init__(self, desc):
+        self.desc = desc
+        self.keys = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, price):
+        key = -price if self.desc else price
+        i = bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def __iter__(self):
+        """按进笼顺序"""
+        for key in reversed(self.keys):
+            yield -key if self.desc else key
+
+    def next(self):
+        """下一个进笼的价格，即笼子外边界；无隐藏档时返回None"""
+        if self.keys:
+            return -self.keys[-1] if self.desc else self.keys[-1]
+        return None
+
+    def pop_next(self):
+        key = self.keys.pop()
+        return -key if self.desc else key
+
+    def insert(self, price, tree):
+        """
+        新价格档落在边界或边界之外；price成为新边界时，
+        把tree中新旧边界之间(原先可见)的价格档一并补入
+        """
+        keys = self.keys
+        key = -price if self.desc else price
+        if keys and key < keys[-1]:  # 不改变边界
+            insort(keys, key)
+            return
+        end = keys[-1] if keys else None
+        levels = tree.inorder_pq_inc(price + 1) if self.desc else tree.inorder_pq_dec(price - 1)
+        between = []
+        for p, _ in levels:
+            k = -p if self.desc else p
+            if end is not None and k <= end:
+                break
+            between.append(k)
+        between.reverse()
+        keys.extend(between)
+        keys.append(key)
+
+    def discard(self, price):
+        """价格档被删除"""
+        keys = self.keys
+        if not keys:
+            return
+        key = -price if self.desc else price
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            del keys[i]
+
+    def clear(self):
+        self.keys = []
+
+    def rebuild(self, tree, bound):
+        """按边界从tree重建，bound为None表示无隐藏档"""
+        self.keys = []
+        if bound is None:
+            return
+        if self.desc:
+            for l in tree.inorder_list_dec():
+                if l.price < bound:
+                    break
+                self.keys.append(-l.price)
+        else:
+            for l in tree.inorder_list_inc():
+                if l.price > bound:
+                    break
+                self.keys.append(l.price)
+
+
+def new_level_tree(
+    tree_type: LEVEL_TREE_TYPE = LEVEL_TREE_TYPE.SORTED, price_lo=None, price_hi=None
+):
+    """
+    price_lo/price_hi: 涨跌停价格带（内部精度），未知或无涨跌停时为None
+    """
+    if (
+        price_lo is None
+        or price_hi is None
+        or price_hi < price_lo
+        or price_hi - price_lo >= BAND_SPAN_MAX
+    ):
+        price_lo = price_hi = None  # 价格带未知或过宽：不建网格，没有前缀和
+    if tree_type == LEVEL_TREE_TYPE.SORTED or (
+        price_lo is None and tree_type in (LEVEL_TREE_TYPE.DENSE, LEVEL_TREE_TYPE.HASH)
+    ):
+        return sorted_level_tree(price_lo, price_hi)
+    if tree_type == LEVEL_TREE_TYPE.DENSE:
+        return dense_level_tree(price_lo, price_hi)
+    if tree_type == LEVEL_TREE_TYPE.HASH:
+        return hash_level_tree(price_lo, price_hi)
+    raise Exception(f"level tree type={tree_type} not support!")
@@ -1,10 +1,209 @@
 # -*- coding: utf-8 -*-
 
-from behave.axob import AXOB, AX_SIGNAL
-from tool.axsbe_base import TPM, SecurityIDSource_SSE, SecurityIDSource_SZSE
+from behave.axob import (
+    AXOB,
+    AX_SIGNAL,
+    CKPT_HEAD,
+    CKPT_KIND,
+    CKPT_VERSION,
+    ORDER_STORE_TYPE,
+    SIDE,
+    SNAP_EMIT,
+    VERIFY_POLICY,
+    channel_order_table,
+    get_px_converter,
+    verifier,
+)
+from behave.level_tree import LEVEL_TREE_TYPE
+from tool.axsbe_base import TPM, MsgTypes_order, SecurityIDSource_SSE, SecurityIDSource_SZSE
 from tool.msg_util import *
 
 import logging
+import pickle
+import struct
+
+SZSE_CHANNELNO_OFFSET = {  # 深交所 按消息类型查表：ChannelNo - offset = unique_ChannelNo
+    axsbe_order: 2000,
+    axsbe_exe: 2000,
+    axsbe_snap_stock: 1000,
+}
+
+CHANNELNO_OFFSET = {  # 按交易所查表，无偏移的消息类型归入通道0
+    SecurityIDSource_SZSE: SZSE_CHANNELNO_OFFSET,
+    SecurityIDSource_SSE: {},  # 上交所 快照ChannelNo为0，无法和逐笔对应起来，按照只有1个channle来处理
+}
+
+_any = lambda msg: True
+
+## 通道交易阶段切换表：当前阶段 : (下一阶段, 下发给AXOB的SIGNAL, 日志, {消息类型 : 切换条件})
+# 上交所逐笔要等到9:25才发送，债券另有市场状态消息；两所共用一张表，按消息类型区分，
+# MU构造时由phase_rules按MU_PHASE_MSG_TYPES取出本所的条件
+# 逐笔(TICK_TYPES)的切换条件以逐笔时戳所在的交易阶段为参数，批量入口不构造消息即可检查；其它消息以消息为参数
+TICK_TYPES = (axsbe_order, axsbe_exe)
+
+MU_PHASE_RULES = {
+    # 深交所：任意逐笔，或快照时戳大于等于开盘或快照状态（TODO:回归测试）
+    # 上交所：逐笔要等到9:25才发送，仅用快照时戳或快照状态
+    TPM.Starting: (
+        TPM.OpenCall,
+        AX_SIGNAL.OPENCALL_BGN,
+        "Starting -> OpenCall",
+        {
+            axsbe_order: _any,
+            axsbe_exe: _any,
+            axsbe_status: lambda msg: msg.TradingPhaseMarket == TPM.OpenCall,
+            axsbe_snap_stock: lambda msg: msg.HHMMSSms >= 91500000
+            or msg.TradingPhaseMarket == TPM.OpenCall,
+        },
+    ),
+    # 任意逐笔离开开盘集合竞价，或快照时戳超过盘前休市15s
+    # 上交所: 债券市场状态进入连续自动撮合
+    TPM.OpenCall: (
+        TPM.PreTradingBreaking,
+        AX_SIGNAL.OPENCALL_END,
+        "OpenCall -> PreTradingBreaking",
+        {
+            axsbe_exe: lambda tpm: tpm == TPM.PreTradingBreaking,
+            axsbe_status: lambda msg: msg.TradingPhaseMarket
+            == TPM.ContinuousAutomaticMatching,
+            axsbe_snap_stock: lambda msg: msg.HHMMSSms >= 92515000,
+        },
+    ),
+    # 任意逐笔进入上午连续竞价阶段，或快照时戳大于等于上午连续竞价
+    TPM.PreTradingBreaking: (
+        TPM.AMTrading,
+        AX_SIGNAL.AMTRADING_BGN,
+        "PreTradingBreaking -> AMTrading",
+        {
+            axsbe_order: lambda tpm: tpm == TPM.AMTrading,
+            axsbe_exe: lambda tpm: tpm == TPM.AMTrading,
+            axsbe_snap_stock: lambda msg: msg.HHMMSSms >= 93000000,
+        },
+    ),
+    # 快照时戳大于等于中午休市15s
+    TPM.AMTrading: (
+        TPM.Breaking,
+        AX_SIGNAL.AMTRADING_END,
+        "AMTrading -> Breaking",
+        {
+            axsbe_snap_stock: lambda msg: msg.HHMMSSms >= 113015000,
+        },
+    ),
+    # 任意逐笔，或快照时戳大于等于下午连续竞价
+    TPM.Breaking: (
+        TPM.PMTrading,
+        AX_SIGNAL.PMTRADING_BGN,
+        "Breaking -> PMTrading",
+        {
+            axsbe_order: _any,
+            axsbe_exe: _any,
+            axsbe_snap_stock: lambda msg: msg.HHMMSSms >= 130000000,
+        },
+    ),
+    # 任意逐笔进入收盘集合竞价阶段，或快照时戳大于等于收盘集合竞价15s
+    TPM.PMTrading: (
+        TPM.CloseCall,
+        AX_SIGNAL.PMTRADING_END,
+        "PMTrading -> CloseCall",
+        {
+            axsbe_order: lambda tpm: tpm == TPM.CloseCall,
+            axsbe_exe: lambda tpm: tpm == TPM.CloseCall,
+            axsbe_snap_stock: lambda msg: msg.HHMMSSms >= 145715000,
+        },
+    ),
+    # 任意成交离开收盘集合竞价阶段，或快照时戳大于等于闭市15s
+    # 上交所: 债券市场状态进入闭市=15:00:00~15:04:59
+    TPM.CloseCall: (
+        TPM.Ending,
+        AX_SIGNAL.ALL_END,
+        "CloseCall -> Ending",
+        {
+            axsbe_exe: lambda tpm: tpm == TPM.Ending,
+            axsbe_status: lambda msg: msg.TradingPhaseMarket == TPM.Closing,
+            axsbe_snap_stock: lambda msg: msg.HHMMSSms >= 150015000,
+        },
+    ),
+}
+
+MU_PHASE_MSG_TYPES = {  # 各交易所参与阶段切换的消息类型；深交所心跳(axsbe_status)不带市场交易阶段
+    SecurityIDSource_SZSE: (axsbe_order, axsbe_exe, axsbe_snap_stock),
+    SecurityIDSource_SSE: (axsbe_order, axsbe_exe, axsbe_status, axsbe_snap_stock),
+}
+
+
+def phase_rules(SecurityIDSource):
+    """MU_PHASE_RULES中本所的切换条件，同一张表的格式；切换时不再检查另一所的条件"""
+    types = MU_PHASE_MSG_TYPES.get(SecurityIDSource, ())
+    return {
+        tpm: (
+            next_tpm,
+            signal,
+            desc,
+            {cls: conds[cls] for cls in types if cls in conds},
+        )
+        for tpm, (next_tpm, signal, desc, conds) in MU_PHASE_RULES.items()
+    }
+
+
+MU_UNSAVED = (  # 加载时重建：按交易所查表，或由各AXOB重新统计(_recount)
+    "channel_offset",
+    "phase_rules",
+    "tick_tpm",
+    "handlers",
+    "sum_order_map_size",
+    "sum_bid_level_tree_size",
+    "sum_ask_level_tree_size",
+    "max_AskWeightSize",
+    "max_AskWeightValue",
+    "max_BidWeightSize",
+    "max_BidWeightValue",
+)
+
+MU_LOAD_DEFAULT = {  # 早期save中没有的字段，加载时按当时的行为补齐
+    "verifier": verifier().save(),  # 逐消息全簿自检
+}
+
+
+class mu_channel:
+    """
+    一个通道的交易阶段及其标的；fanout为阶段切换时下发SIGNAL的AXOB消息入口(MU.handlers)，按加入顺序，不保存
+    orders: 通道内AXOB共用的订单表(ORDER_STORE_TYPE.CHANNEL)，标的在SecurityID_list中的位置即其编号；
+            不保存，加载时由各AXOB的订单重新搬入
+    """
+
+    __slots__ = [
+        "TPM",
+        "SecurityID_list",
+        "SecurityID_set",
+        "fanout",
+        "orders",
+    ]
+
+    def __init__(self, tpm=TPM.Starting, SecurityID_list=()):
+        self.TPM = tpm
+        self.SecurityID_list = list(SecurityID_list)
+        self.SecurityID_set = set(SecurityID_list)
+        self.fanout = []
+        self.orders = channel_order_table()
+
+    def join(self, SecurityID, axob, handler):
+        axob.attachOrderTable(self.orders, len(self.SecurityID_list))
+        self.SecurityID_list.append(SecurityID)
+        self.SecurityID_set.add(SecurityID)
+        self.fanout.append(handler)
+
+    def bind(self, axobs):
+        self.orders = channel_order_table()  # 由各AXOB的在簿订单重建
+        for owner, SecurityID in enumerate(self.SecurityID_list):
+            axobs[SecurityID].attachOrderTable(self.orders, owner)
+
+    def save(self):
+        return {"TPM": self.TPM, "SecurityID_list": list(self.SecurityID_list)}
+
+
+MU_CKPT_MAGIC = b"MUCK"
+MU_CKPT_HEAD = struct.Struct("<4sBBII")  # magic, version, kind, 标量段长度, AXOB个数
+MU_CKPT_AXOB_HEAD = struct.Struct("<II")  # SecurityID, AXOB检查点长度
 
 
 class MU:
@@ -18,8 +217,13 @@ class MU:
     __slots__ = [
         "axobs",
         "SecurityIDSource",
-        "channel_map",
+        "channel_map",  # unique_ChannelNo : mu_channel
+        "channel_offset",  # 按交易所的CHANNELNO_OFFSET，不保存
+        "phase_rules",  # 本所的交易阶段切换表，见phase_rules，不保存
+        "tick_tpm",  # 逐笔时戳->交易阶段，同AXOB的conv.tpm_in，批量入口检查阶段切换用，不保存
+        "handlers",  # SecurityID : AXOB的消息入口，需要profile时包一层_track，见_bindHandlers，不保存
         "msg_nb",
+        "verifier",  # 自检策略，同时下发给各AXOB
         # profile
         "pf_order_map_maxSize",
         "pf_level_tree_maxSize",
@@ -29,11 +233,21 @@ class MU:
         "pf_AskWeightValue_max",
         "pf_BidWeightSize_max",
         "pf_BidWeightValue_max",
+        # 全市场规模的累计值，由handlers按差值维护，不保存
+        "sum_order_map_size",
+        "sum_bid_level_tree_size",
+        "sum_ask_level_tree_size",
+        "max_AskWeightSize",
+        "max_AskWeightValue",
+        "max_BidWeightSize",
+        "max_BidWeightValue",
         "logger",
         "DBG",
         "INFO",
         "WARN",
         "ERR",
+        "DBG_ON",  # 构造/加载时确定，为False时调试信息不格式化
+        "INFO_ON",
     ]
 
     def __init__(
@@ -42,6 +256,14 @@ class MU:
         SecurityIDSource,
         instrument_type: INSTRUMENT_TYPE,
         load_data=None,
+        level_tree_type: LEVEL_TREE_TYPE = LEVEL_TREE_TYPE.SORTED,
+        verify_policy: VERIFY_POLICY = VERIFY_POLICY.FULL,
+        verify_interval=0,
+        verify_period=0.0,
+        snap_emit: SNAP_EMIT = SNAP_EMIT.PER_MSG,
+        order_store_type: ORDER_STORE_TYPE = ORDER_STORE_TYPE.ARRAY,
+        level_queue=False,
+        full_depth=False,
     ) -> None:
         if load_data is not None:
             self.load(load_data)
@@ -50,7 +272,19 @@ class MU:
                 zip(
                     SecurityID_list,
                     [
-                        AXOB(x, SecurityIDSource, instrument_type)
+                        AXOB(
+                            x,
+                            SecurityIDSource,
+                            instrument_type,
+                            level_tree_type=level_tree_type,
+                            verify_policy=verify_policy,
+                            verify_interval=verify_interval,
+                            verify_period=verify_period,
+                            snap_emit=snap_emit,
+                            order_store_type=order_store_type,
+                            level_queue=level_queue,
+                            full_depth=full_depth,
+                        )
                         for x in SecurityID_list
                     ],
                 )
@@ -58,14 +292,16 @@ class MU:
 
             self.SecurityIDSource = SecurityIDSource
 
-            self.channel_map = (
-                {}
-            )  # 按不同ChannelID分组标的: ChannelID : {'TPM':?, 'SecurityID_list':[] }
+            self.channel_offset = CHANNELNO_OFFSET.get(SecurityIDSource, {})
+            self.phase_rules = phase_rules(SecurityIDSource)
+            self.tick_tpm = get_px_converter(SecurityIDSource, instrument_type).tpm_in
+            self.channel_map = {}  # 按不同ChannelID分组标的: ChannelID : mu_channel
             # 在FPGA实现时，开盘前：FPGA先报告ChannelID、新股SecID；
             #             host将ChannelID相同的分到一个MU，新股按最大成交量分配。
 
             # for test
             self.msg_nb = 0
+            self.verifier = verifier(verify_policy, verify_interval, verify_period)
             self.pf_order_map_maxSize = 0
             self.pf_level_tree_maxSize = 0
             self.pf_bid_level_tree_maxSize = 0
@@ -86,163 +322,181 @@ class MU:
             self.INFO = self.logger.info
             self.WARN = self.logger.warning
             self.ERR = self.logger.error
-        self.INFO(f"SecurityID_list={SecurityID_list}")
+            self.DBG_ON = self.logger.isEnabledFor(logging.DEBUG)
+            self.INFO_ON = self.logger.isEnabledFor(logging.INFO)
+            self._recount()
+            self._bindHandlers()
+        if self.INFO_ON:
+            self.INFO(f"SecurityID_list={SecurityID_list}")
+
+    def onBatch(self, batch):
+        """
+        批量入口：已解码的逐笔按字段排成并列数组，格式见msg_util.BATCH_DTYPE/batch_msgs；快照行情仍走onMsg。
+        按(标的, 通道)切成连续的段，每段只查一次通道及AXOB，整段交给AXOB.onBatch；
+        交易阶段只在通道当前阶段有逐笔切换条件时逐行检查，在切换的行处分段，
+        切换及各AXOB出快照的时机同逐条调用。MU的profile每段采样一次。
+        """
+        cols = batch_columns(batch)
+        MsgType = cols["MsgType"]
+        SecurityID = cols["SecurityID"]
+        ChannelNo = cols["ChannelNo"]
+        n = len(MsgType)
+        order_types = frozenset(MsgTypes_order)
+        i = 0
+        while i < n:
+            sid = SecurityID[i]
+            ch = ChannelNo[i]
+            j = i + 1
+            while j < n and SecurityID[j] == sid and ChannelNo[j] == ch:
+                j += 1
+
+            # 逐笔委托与成交的通道号偏移相同，按段首行查
+            cls = axsbe_order if MsgType[i] in order_types else axsbe_exe
+            offset = self.channel_offset.get(cls)
+            unique_ChannelNo = 0 if offset is None else ch - offset
+            chnl = self.channel_map.get(unique_ChannelNo)
+            if chnl is None:
+                chnl = self.channel_map[unique_ChannelNo] = mu_channel()
+            x = self.axobs.get(sid)
+            if x is not None and sid not in chnl.SecurityID_set:
+                chnl.join(sid, x, self.handlers[sid])
+            if not chnl.fanout:
+                i = j
+                continue
+
+            lo = i  # 待转发的首行
+            scan = i  # 待检查阶段切换的首行；切换所在行不再检查下一阶段，同onMsg
+            while True:
+                k = self._phaseSwitchRow(chnl, cols, scan, j, order_types)
+                if x is not None and k > lo:
+                    self._dispatchBatch(x, cols, lo, k)
+                if k == j:
+                    break
+                self._switchPhase(chnl, unique_ChannelNo)
+                lo = k
+                scan = k + 1
+            i = j
+
+    def _phaseSwitchRow(self, chnl, cols, start, stop, order_types):
+        """批次[start, stop)行中首个满足通道当前阶段切换条件的行，没有时返回stop；按各行时戳所在的交易阶段检查"""
+        rule = self.phase_rules.get(chnl.TPM)
+        if rule is None:
+            return stop
+        conds = rule[3]
+        order_cond = conds.get(axsbe_order)
+        exe_cond = conds.get(axsbe_exe)
+        if order_cond is None and exe_cond is None:
+            return stop
+        MsgType = cols["MsgType"]
+        TransactTime = cols["TransactTime"]
+        tick_tpm = self.tick_tpm
+        for k in range(start, stop):
+            cond = order_cond if MsgType[k] in order_types else exe_cond
+            if cond is not None and cond(tick_tpm(TransactTime[k])):
+                return k
+        return stop
+
+    def _switchPhase(self, chnl, unique_ChannelNo):
+        next_tpm, signal, desc, _ = self.phase_rules[chnl.TPM]
+        if self.INFO_ON:
+            self.INFO(f"Chnl {unique_ChannelNo} {desc}")
+        chnl.TPM = next_tpm
+        for handler in chnl.fanout:
+            handler(signal)
 
     def unique_ChannelNo(self, msg):
-        # 将逐笔和快照的ChannelNo统一，用于管理分组
-        if self.SecurityIDSource == SecurityIDSource_SZSE:
-            # 深交所 逐笔和快照的ChannelNo相差1000
-            if isinstance(msg, (axsbe_order, axsbe_exe)):
-                return msg.ChannelNo - 2000
-            elif isinstance(msg, axsbe_snap_stock):
-                return msg.ChannelNo - 1000
-            else:
-                return 0
-        elif self.SecurityIDSource == SecurityIDSource_SSE:
-            # 上交所 快照ChannelNo为0，无法和逐笔对应起来，按照只有1个channle来处理
-            return 0
-        else:
+        # 将逐笔和快照的ChannelNo统一，用于管理分组；深交所 逐笔和快照的ChannelNo相差1000
+        offset = self.channel_offset.get(type(msg))
+        if offset is None:
             return 0
+        return msg.ChannelNo - offset
 
     def onMsg(self, msg):
         """
-        交易阶段管理
+        交易阶段管理：按通道查本所的切换表(phase_rules)，满足切换条件时向通道内各AXOB下发SIGNAL
         """
-        unique_ChannelNo = self.unique_ChannelNo(msg)
+        offset = self.channel_offset.get(msg.__class__)
+        unique_ChannelNo = 0 if offset is None else msg.ChannelNo - offset
 
-        if unique_ChannelNo not in self.channel_map:
-            self.channel_map[unique_ChannelNo] = {
-                "TPM": TPM.Starting,
-                "SecurityID_list": [],
-            }
-        if (
-            msg.SecurityID in self.axobs
-            and msg.SecurityID
-            not in self.channel_map[unique_ChannelNo]["SecurityID_list"]
-        ):
-            self.channel_map[unique_ChannelNo]["SecurityID_list"].append(msg.SecurityID)
-
-        if len(self.channel_map[unique_ChannelNo]["SecurityID_list"]):
-            if (
-                self.channel_map[unique_ChannelNo]["TPM"] == TPM.Starting
-            ):  # Starting -> OpenCall
-                # 深交所：任意逐笔，或快照时戳大于等于开盘或快照状态（TODO:回归测试）
-                # 上交所：逐笔要等到9:25才发送，仅用快照时戳或快照状态
-                if (
-                    (isinstance(msg, (axsbe_order, axsbe_exe)))
-                    or (
-                        isinstance(msg, axsbe_status)
-                        and msg.TradingPhaseMarket == TPM.OpenCall
-                    )
-                    or (
-                        isinstance(msg, axsbe_snap_stock)
-                        and (
-                            msg.HHMMSSms >= 91500000
-                            or msg.TradingPhaseMarket == TPM.OpenCall
-                        )
-                    )
-                ):
-                    self.INFO(f"Chnl {unique_ChannelNo} Starting -> OpenCall")
-                    self.channel_map[unique_ChannelNo]["TPM"] = TPM.OpenCall
-                    for id in self.channel_map[unique_ChannelNo]["SecurityID_list"]:
-                        self.axobs[id].onMsg(AX_SIGNAL.OPENCALL_BGN)
-            elif (
-                self.channel_map[unique_ChannelNo]["TPM"] == TPM.OpenCall
-            ):  # OpenCall -> PreTradingBreaking
-                # 任意逐笔离开开盘集合竞价，或快照时戳超过盘前休市15s
-                # 上交所: 债券市场状态进入连续自动撮合
-                if (
-                    (
-                        isinstance(msg, axsbe_exe)
-                        and msg.TradingPhaseMarket == TPM.PreTradingBreaking
-                    )
-                    or (
-                        isinstance(msg, axsbe_status)
-                        and msg.TradingPhaseMarket == TPM.ContinuousAutomaticMatching
-                    )
-                    or (isinstance(msg, axsbe_snap_stock) and msg.HHMMSSms >= 92515000)
-                ):
-                    self.INFO(f"Chnl {unique_ChannelNo} OpenCall -> PreTradingBreaking")
-                    self.channel_map[unique_ChannelNo]["TPM"] = TPM.PreTradingBreaking
-                    for id in self.channel_map[unique_ChannelNo]["SecurityID_list"]:
-                        self.axobs[id].onMsg(AX_SIGNAL.OPENCALL_END)
-            elif (
-                self.channel_map[unique_ChannelNo]["TPM"] == TPM.PreTradingBreaking
-            ):  # PreTradingBreaking -> AMTrading
-                # 任意逐笔进入上午连续竞价阶段，或快照时戳大于等于上午连续竞价
-                if (
-                    isinstance(msg, (axsbe_order, axsbe_exe))
-                    and msg.TradingPhaseMarket == TPM.AMTrading
-                ) or (isinstance(msg, axsbe_snap_stock) and msg.HHMMSSms >= 93000000):
-                    self.INFO(
-                        f"Chnl {unique_ChannelNo} PreTradingBreaking -> AMTrading"
-                    )
-                    self.channel_map[unique_ChannelNo]["TPM"] = TPM.AMTrading
-                    for id in self.channel_map[unique_ChannelNo]["SecurityID_list"]:
-                        self.axobs[id].onMsg(AX_SIGNAL.AMTRADING_BGN)
-            elif (
-                self.channel_map[unique_ChannelNo]["TPM"] == TPM.AMTrading
-            ):  # AMTrading -> Breaking
-                # 快照时戳大于等于中午休市15s
-                if isinstance(msg, axsbe_snap_stock) and msg.HHMMSSms >= 113015000:
-                    self.INFO(f"Chnl {unique_ChannelNo} AMTrading -> Breaking")
-                    self.channel_map[unique_ChannelNo]["TPM"] = TPM.Breaking
-                    for id in self.channel_map[unique_ChannelNo]["SecurityID_list"]:
-                        self.axobs[id].onMsg(AX_SIGNAL.AMTRADING_END)
-            elif (
-                self.channel_map[unique_ChannelNo]["TPM"] == TPM.Breaking
-            ):  # Breaking -> PMTrading
-                # 任意逐笔，或快照时戳大于等于下午连续竞价
-                if (isinstance(msg, (axsbe_order, axsbe_exe))) or (
-                    isinstance(msg, axsbe_snap_stock) and msg.HHMMSSms >= 130000000
-                ):
-                    self.INFO(f"Chnl {unique_ChannelNo} Breaking -> PMTrading")
-                    self.channel_map[unique_ChannelNo]["TPM"] = TPM.PMTrading
-                    for id in self.channel_map[unique_ChannelNo]["SecurityID_list"]:
-                        self.axobs[id].onMsg(AX_SIGNAL.PMTRADING_BGN)
-            elif (
-                self.channel_map[unique_ChannelNo]["TPM"] == TPM.PMTrading
-            ):  # PMTrading -> CloseCall
-                # 任意逐笔进入收盘集合竞价阶段，或快照时戳大于等于收盘集合竞价15s
-                if (
-                    isinstance(msg, (axsbe_order, axsbe_exe))
-                    and msg.TradingPhaseMarket == TPM.CloseCall
-                ) or (isinstance(msg, axsbe_snap_stock) and msg.HHMMSSms >= 145715000):
-                    self.INFO(f"Chnl {unique_ChannelNo} PMTrading -> CloseCall")
-                    self.channel_map[unique_ChannelNo]["TPM"] = TPM.CloseCall
-                    for id in self.channel_map[unique_ChannelNo]["SecurityID_list"]:
-                        self.axobs[id].onMsg(AX_SIGNAL.PMTRADING_END)
-            elif (
-                self.channel_map[unique_ChannelNo]["TPM"] == TPM.CloseCall
-            ):  # CloseCall -> Ending
-                # 任意成交离开收盘集合竞价阶段，或快照时戳大于等于闭市15s
-                # 上交所: 债券市场状态进入闭市=15:00:00~15:04:59
-                if (
-                    (
-                        isinstance(msg, axsbe_exe)
-                        and msg.TradingPhaseMarket == TPM.Ending
-                    )
-                    or (
-                        isinstance(msg, axsbe_status)
-                        and msg.TradingPhaseMarket == TPM.Closing
-                    )
-                    or (isinstance(msg, axsbe_snap_stock) and msg.HHMMSSms >= 150015000)
-                ):
-                    self.INFO(f"Chnl {unique_ChannelNo} CloseCall -> Ending")
-                    self.channel_map[unique_ChannelNo]["TPM"] = TPM.Ending
-                    for id in self.channel_map[unique_ChannelNo]["SecurityID_list"]:
-                        self.axobs[id].onMsg(AX_SIGNAL.ALL_END)
-        else:
-            return
+        chnl = self.channel_map.get(unique_ChannelNo)
+        if chnl is None:
+            chnl = self.channel_map[unique_ChannelNo] = mu_channel()
+        handler = self.handlers.get(msg.SecurityID)
+        if handler is not None and msg.SecurityID not in chnl.SecurityID_set:
+            chnl.join(msg.SecurityID, self.axobs[msg.SecurityID], handler)
 
-        if msg.SecurityID not in self.axobs:
+        if not chnl.fanout:
+            return
+        rule = self.phase_rules.get(chnl.TPM)
+        if rule is not None:
+            cls = msg.__class__
+            cond = rule[3].get(cls)
+            if cond is not None and cond(
+                msg.TradingPhaseMarket if cls in TICK_TYPES else msg
+            ):
+                self._switchPhase(chnl, unique_ChannelNo)
+
+        if handler is None:
             return
 
         # TODO: 重构消息给axob？
-        self.axobs[msg.SecurityID].onMsg(msg)
+        handler(msg)
 
         self.msg_nb += 1
-        self.profile()
+        if self.verifier.due():
+            self.profile()
+
+    def set_verify_policy(
+        self, policy: VERIFY_POLICY, interval=0, period=0.0
+    ):
+        """运行中切换自检策略，MU及所有AXOB一并切换"""
+        self.verifier = verifier(policy, interval, period)
+        for x in self.axobs.values():
+            x.set_verify_policy(policy, interval, period)
+        self._recount()  # 关闭自检期间累计值不再维护
+        self._bindHandlers()
+
+    def flushSnap(self):
+        """PER_TICK: 输入结束时生成各AXOB合并中的快照"""
+        for x in self.axobs.values():
+            x.flushSnap()
+
+    def set_snap_emit(self, snap_emit: SNAP_EMIT, SecurityID_list=None):
+        """按标的切换快照生成时机，SecurityID_list为None时切换全部标的"""
+        if SecurityID_list is None:
+            SecurityID_list = self.axobs.keys()
+        for id in SecurityID_list:
+            self.axobs[id].set_snap_emit(snap_emit)
+
+    def set_full_depth(self, full_depth, SecurityID_list=None):
+        """按标的切换全档发布，SecurityID_list为None时切换全部标的"""
+        if SecurityID_list is None:
+            SecurityID_list = self.axobs.keys()
+        for id in SecurityID_list:
+            self.axobs[id].set_full_depth(full_depth)
+
+    def set_snap_sink(self, sink, SecurityID_list=None):
+        """按标的设置重建快照的回调sink(snap)，SecurityID_list为None时设置全部标的"""
+        if SecurityID_list is None:
+            SecurityID_list = self.axobs.keys()
+        for id in SecurityID_list:
+            self.axobs[id].set_snap_sink(sink)
+
+    def fetchDepth(self, SecurityID):
+        return self.axobs[SecurityID].fetchDepth()
+
+    ## 按需查询，见AXOB.query*
+    def queryLevels(self, SecurityID, side: SIDE, level_nb=10, prices=None, qtys=None):
+        return self.axobs[SecurityID].queryLevels(side, level_nb, prices, qtys)
+
+    def queryOrders(self, SecurityID, side: SIDE, price, order_nb=10):
+        return self.axobs[SecurityID].queryOrders(side, price, order_nb)
+
+    def queryWeightPx(self, SecurityID):
+        return self.axobs[SecurityID].queryWeightPx()
+
+    def queryTrade(self, SecurityID):
+        return self.axobs[SecurityID].queryTrade()
 
     def are_you_ok(self):
         ok_nb = 0
@@ -263,50 +517,103 @@ class MU:
     @property
     def TradingPhaseMarket(self):
         ret = TPM.Starting
-        for ch in self.channel_map:
-            t = self.channel_map[ch]["TPM"]
+        for ch in self.channel_map.values():
+            t = ch.TPM
             if t <= TPM.Ending:
                 ret = max(ret, t)  # 取最晚的TPM
         return ret
 
-    def profile(self):
-        k = [x.order_map_size for _, x in self.axobs.items()]
-        k = sum(k)
-        if k > self.pf_order_map_maxSize:
-            self.pf_order_map_maxSize = k
+    def _bindHandlers(self):
+        """
+        构造/加载/切换自检策略时绑定各AXOB的消息入口，通道的fanout同步更新：
+        自检关闭(VERIFY_POLICY.OFF)时不做profile，直接用AXOB.onMsg；
+        否则包一层，按处理前后的差值更新全市场累计值，profile无需遍历全部AXOB
+        """
+        if self.verifier.policy == VERIFY_POLICY.OFF:
+            self.handlers = {
+                SecurityID: x.onMsg for SecurityID, x in self.axobs.items()
+            }
+        else:
+            self.handlers = {
+                SecurityID: self._trackedHandler(x) for SecurityID, x in self.axobs.items()
+            }
+        for chnl in self.channel_map.values():
+            chnl.fanout = [self.handlers[x] for x in chnl.SecurityID_list]
+
+    def _trackedHandler(self, x):
+        onMsg = x.onMsg
+        track = self._track
+
+        def handler(msg):
+            order_nb = len(x.order_map)
+            bid_nb = len(x.bid_level_tree)
+            ask_nb = len(x.ask_level_tree)
+            onMsg(msg)
+            track(x, order_nb, bid_nb, ask_nb)
+
+        return handler
+
+    def _dispatchBatch(self, x, cols, start, stop):
+        """转发批次的[start, stop)行给AXOB，累计值、计数及profile同逐条调用时的一段"""
+        if self.verifier.policy == VERIFY_POLICY.OFF:
+            x.onBatch(cols, start, stop)
+        else:
+            order_nb = len(x.order_map)
+            bid_nb = len(x.bid_level_tree)
+            ask_nb = len(x.ask_level_tree)
+            x.onBatch(cols, start, stop)
+            self._track(x, order_nb, bid_nb, ask_nb)
+        self.msg_nb += stop - start
+        if self.verifier.due():
+            self.profile()
+
+    def _track(self, x, order_nb, bid_nb, ask_nb):
+        self.sum_order_map_size += len(x.order_map) - order_nb
+        self.sum_bid_level_tree_size += len(x.bid_level_tree) - bid_nb
+        self.sum_ask_level_tree_size += len(x.ask_level_tree) - ask_nb
+
+        # 各AXOB的峰值只增不减，取其最大值即可
+        if x.pf_AskWeightSize_max > self.max_AskWeightSize:
+            self.max_AskWeightSize = x.pf_AskWeightSize_max
+        if x.pf_AskWeightValue_max > self.max_AskWeightValue:
+            self.max_AskWeightValue = x.pf_AskWeightValue_max
+        if x.pf_BidWeightSize_max > self.max_BidWeightSize:
+            self.max_BidWeightSize = x.pf_BidWeightSize_max
+        if x.pf_BidWeightValue_max > self.max_BidWeightValue:
+            self.max_BidWeightValue = x.pf_BidWeightValue_max
+
+    def _recount(self):
+        """构造/加载/切换自检策略时从各AXOB重新统计累计值"""
+        axobs = self.axobs.values()
+        self.sum_order_map_size = sum(x.order_map_size for x in axobs)
+        self.sum_bid_level_tree_size = sum(x.bid_level_tree_size for x in axobs)
+        self.sum_ask_level_tree_size = sum(x.ask_level_tree_size for x in axobs)
+        self.max_AskWeightSize = max((x.pf_AskWeightSize_max for x in axobs), default=0)
+        self.max_AskWeightValue = max((x.pf_AskWeightValue_max for x in axobs), default=0)
+        self.max_BidWeightSize = max((x.pf_BidWeightSize_max for x in axobs), default=0)
+        self.max_BidWeightValue = max((x.pf_BidWeightValue_max for x in axobs), default=0)
 
-        k = [x.level_tree_size for _, x in self.axobs.items()]
-        k = sum(k)
+    def profile(self):
+        if self.verifier.policy == VERIFY_POLICY.OFF:  # 自检关闭时不维护累计值，按需调用时重新统计
+            self._recount()
+        if self.sum_order_map_size > self.pf_order_map_maxSize:
+            self.pf_order_map_maxSize = self.sum_order_map_size
+        k = self.sum_bid_level_tree_size + self.sum_ask_level_tree_size
         if k > self.pf_level_tree_maxSize:
             self.pf_level_tree_maxSize = k
-
-        k = [x.bid_level_tree_size for _, x in self.axobs.items()]
-        k = sum(k)
-        if k > self.pf_bid_level_tree_maxSize:
-            self.pf_bid_level_tree_maxSize = k
-
-        k = [x.ask_level_tree_size for _, x in self.axobs.items()]
-        k = sum(k)
-        if k > self.pf_ask_level_tree_maxSize:
-            self.pf_ask_level_tree_maxSize = k
-
-        k = [x.pf_AskWeightSize_max for _, x in self.axobs.items()]
-        k = max(k)
-        if k > self.pf_AskWeightSize_max:
-            self.pf_AskWeightSize_max = k
-        k = [x.pf_AskWeightValue_max for _, x in self.axobs.items()]
-        k = max(k)
-        if k > self.pf_AskWeightValue_max:
-            self.pf_AskWeightValue_max = k
-
-        k = [x.pf_BidWeightSize_max for _, x in self.axobs.items()]
-        k = max(k)
-        if k > self.pf_BidWeightSize_max:
-            self.pf_BidWeightSize_max = k
-        k = [x.pf_BidWeightValue_max for _, x in self.axobs.items()]
-        k = max(k)
-        if k > self.pf_BidWeightValue_max:
-            self.pf_BidWeightValue_max = k
+        if self.sum_bid_level_tree_size > self.pf_bid_level_tree_maxSize:
+            self.pf_bid_level_tree_maxSize = self.sum_bid_level_tree_size
+        if self.sum_ask_level_tree_size > self.pf_ask_level_tree_maxSize:
+            self.pf_ask_level_tree_maxSize = self.sum_ask_level_tree_size
+
+        if self.max_AskWeightSize > self.pf_AskWeightSize_max:
+            self.pf_AskWeightSize_max = self.max_AskWeightSize
+        if self.max_AskWeightValue > self.pf_AskWeightValue_max:
+            self.pf_AskWeightValue_max = self.max_AskWeightValue
+        if self.max_BidWeightSize > self.pf_BidWeightSize_max:
+            self.pf_BidWeightSize_max = self.max_BidWeightSize
+        if self.max_BidWeightValue > self.pf_BidWeightValue_max:
+            self.pf_BidWeightValue_max = self.max_BidWeightValue
 
     def __str__(self) -> str:
         s = "========================\n"
@@ -326,31 +633,63 @@ class MU:
 
     def save(self):
         """save/load 用于保存/加载测试时刻"""
+        data = self._saveScalars()
+        data["axobs"] = {}
+        for i in self.axobs:
+            data["axobs"][i] = self.axobs[i].save()
+        return data
+
+    def _saveScalars(self):
         data = {}
         for attr in self.__slots__:
-            if attr in ["logger", "DBG", "INFO", "WARN", "ERR"]:
+            if attr in [
+                "logger",
+                "DBG",
+                "INFO",
+                "WARN",
+                "ERR",
+                "DBG_ON",
+                "INFO_ON",
+                "axobs",
+            ] or attr in MU_UNSAVED:
                 continue
 
             value = getattr(self, attr)
-            if attr in ["axobs"]:
-                data[attr] = {}
-                for i in value:
-                    data[attr][i] = value[i].save()
+            if attr == "verifier":
+                data[attr] = value.save()
+            elif attr == "channel_map":
+                data[attr] = {ch: x.save() for ch, x in value.items()}
             else:
                 data[attr] = value
         return data
 
     def load(self, data):
+        data = {**MU_LOAD_DEFAULT, **data}
         for attr in self.__slots__:
-            if attr in ["logger", "DBG", "INFO", "WARN", "ERR"]:
+            if attr in ["logger", "DBG", "INFO", "WARN", "ERR", "DBG_ON", "INFO_ON"]:
+                continue
+            if attr in MU_UNSAVED:
                 continue
 
             if attr in ["axobs"]:
                 v = {}
                 for i in data[attr]:
-                    v[i] = AXOB(
-                        -1, -1, INSTRUMENT_TYPE.UNKNOWN, load_data=data[attr][i]
-                    )
+                    if isinstance(data[attr][i], AXOB):  # 已由检查点恢复
+                        v[i] = data[attr][i]
+                    else:
+                        v[i] = AXOB(
+                            -1, -1, INSTRUMENT_TYPE.UNKNOWN, load_data=data[attr][i]
+                        )
+                setattr(self, attr, v)
+            elif attr == "verifier":
+                v = verifier()
+                v.load(data[attr])
+                setattr(self, attr, v)
+            elif attr == "channel_map":
+                v = {}
+                for ch, x in data[attr].items():
+                    v[ch] = mu_channel(x["TPM"], x["SecurityID_list"])
+                    v[ch].bind(self.axobs)
                 setattr(self, attr, v)
             else:
                 setattr(self, attr, data[attr])
@@ -366,3 +705,53 @@ class MU:
         self.INFO = self.logger.info
         self.WARN = self.logger.warning
         self.ERR = self.logger.error
+        self.DBG_ON = self.logger.isEnabledFor(logging.DEBUG)
+        self.INFO_ON = self.logger.isEnabledFor(logging.INFO)
+        self.channel_offset = CHANNELNO_OFFSET.get(self.SecurityIDSource, {})
+        self.phase_rules = phase_rules(self.SecurityIDSource)
+        self.tick_tpm = next(iter(self.axobs.values())).conv.tpm_in
+        self._recount()
+        self._bindHandlers()
+
+    def checkpoint(self, delta=False, snaps=False):
+        """
+        MU检查点：标量头部 + 各AXOB的检查点(AXOB.checkpoint)顺序拼接
+        delta=True时各AXOB写增量，尚无检查点的AXOB告警并退化为全量；snaps=True时各AXOB附快照缓存
+        """
+        scalars = pickle.dumps(self._saveScalars(), pickle.HIGHEST_PROTOCOL)
+        kind = CKPT_KIND.DELTA if delta else CKPT_KIND.FULL
+        parts = [
+            MU_CKPT_HEAD.pack(
+                MU_CKPT_MAGIC, CKPT_VERSION, kind.value, len(scalars), len(self.axobs)
+            ),
+            scalars,
+        ]
+        for SecurityID, axob in self.axobs.items():
+            blob = axob.checkpoint(delta, snaps)
+            parts.append(MU_CKPT_AXOB_HEAD.pack(SecurityID, len(blob)))
+            parts.append(blob)
+        return b"".join(parts)
+
+    def restore(self, buf):
+        """从checkpoint的输出恢复；增量检查点作用在已恢复的各AXOB上，可作用于MU.__new__(MU)(全量)"""
+        view = memoryview(buf)
+        magic, version, kind, scalars_len, axob_nb = MU_CKPT_HEAD.unpack_from(view)
+        if magic != MU_CKPT_MAGIC or version != CKPT_VERSION:
+            raise ValueError(f"bad MU checkpoint magic={magic} version={version}")
+        off = MU_CKPT_HEAD.size
+        data = pickle.loads(view[off : off + scalars_len])
+        off += scalars_len
+
+        axobs = {}
+        for _ in range(axob_nb):
+            SecurityID, n = MU_CKPT_AXOB_HEAD.unpack_from(view, off)
+            off += MU_CKPT_AXOB_HEAD.size
+            if CKPT_HEAD.unpack_from(view, off)[2] == CKPT_KIND.DELTA.value:  # 按各AXOB自身的类型，无基准的已退化为全量
+                axob = self.axobs[SecurityID]
+            else:
+                axob = AXOB.__new__(AXOB)
+            axob.restore(view[off : off + n])
+            off += n
+            axobs[SecurityID] = axob
+        data["axobs"] = axobs
+        self.load(data)
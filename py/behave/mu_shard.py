@@ -0,0 +1,573 @@
+# -*- coding: utf-8 -*-
+
+"""
+多进程分片运行MU，对应design.md中多个宏单元并行、由前级路由分发消息：
+  * 路由进程只看消息头，按统一通道号(同MU.unique_ChannelNo)把消息分给N个工作进程；
+    每个工作进程一个共享内存环形缓冲(shard_ring)，定长块，每块一批记录，不经pickle：
+    axsbe_file_raw读出的原始行只解析MsgType/ChannelNo，原文写入；股票逐笔/快照对象写SBE字节流(bytes_stream)；
+    其它消息(债券、心跳等)pickle后写入。记录由工作进程解码
+  * 每个工作进程运行一个MU
+  * 同一通道的消息总在同一分片，通道的交易阶段管理与单个MU相同
+  * 各MU的重建快照按输入消息的顺序归并输出，与单个MU逐条处理时的快照顺序一致
+  * 负载均衡：盘前用scan_day统计前一日各标的的逐笔数，plan_shards按通道整体分配到各分片，
+    同一通道不拆分(保证订单号在分片内唯一)，各分片的消息数尽量接近
+"""
+
+import heapq
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import pickle
+import struct
+import traceback
+
+from behave.axob import EXEC_TYPE, TYPE, get_msg_decoder
+from behave.mu import CHANNELNO_OFFSET, MU
+from tool.axsbe_base import (
+    INSTRUMENT_TYPE,
+    MsgType_exe_stock,
+    MsgType_order_stock,
+    MsgType_snap_stock,
+    SecurityIDSource_SSE,
+)
+from tool.msg_util import (
+    MSG_TYPE_CLASS,
+    axsbe_exe,
+    axsbe_line,
+    axsbe_order,
+    axsbe_snap_stock,
+    line_header,
+)
+
+SHARD_RING_BLOCKS = 64  # 每个工作进程的环形缓冲块数，路由超前过多时阻塞
+SHARD_BLOCK_SIZE = 1 << 18  # 块字节数，一批记录写不下时提前发出
+
+SHARD_BLOCK_END = 0xFFFFFFFF  # 结束块的记录数
+BLOCK_HEAD = struct.Struct("<I")  # 块头：记录数
+RECORD_HEAD = struct.Struct("<QHB")  # 记录头：输入序号, 内容长度, 记录类型
+
+RECORD_LINE = 0  # 原始行，utf-8
+RECORD_SBE = 1  # SBE字节流，首两字节为SecurityIDSource、MsgType
+RECORD_PICKLE = 2
+
+SBE_MSGTYPE = {  # 按SBE字节流转发的消息类 : MsgType，bytes_stream/unpack_stream对这些消息无损
+    axsbe_order: MsgType_order_stock,
+    axsbe_exe: MsgType_exe_stock,
+    axsbe_snap_stock: MsgType_snap_stock,
+}
+
+
+def encode_record(rec):
+    """消息或原始行编码为(记录类型, 内容)"""
+    cls = rec.__class__
+    if cls is str:
+        return RECORD_LINE, rec.encode()
+    if SBE_MSGTYPE.get(cls) == rec.MsgType:
+        return RECORD_SBE, rec.bytes_stream
+    return RECORD_PICKLE, pickle.dumps(rec, pickle.HIGHEST_PROTOCOL)
+
+
+def decode_record(kind, data):
+    """encode_record的逆过程，data可为共享内存的memoryview"""
+    if kind == RECORD_LINE:
+        return axsbe_line(str(data, "utf-8"))
+    if kind == RECORD_SBE:
+        msg = MSG_TYPE_CLASS[data[1]](SecurityIDSource=data[0], MsgType=data[1])
+        msg.unpack_stream(data)
+        return msg
+    return pickle.loads(data)
+
+
+class shard_ring:
+    """
+    路由到一个工作进程的共享内存环形缓冲，单写单读：
+      块：记录数(BLOCK_HEAD) + 记录...；记录：RECORD_HEAD + 内容
+    free/full两个信号量分别计数空闲块和待读块；写端、读端各自维护当前块号
+    在创建进程中构造(create=True)，子进程按名字重新连接；由创建方release()
+    """
+
+    __slots__ = [
+        "shm",
+        "blocks",
+        "block_size",
+        "free",
+        "full",
+        "slot",  # 当前块号
+        "pos",  # 写端：当前块的写入位置
+        "end",  # 写端：当前块的结束位置
+        "nb",  # 写端：当前块的记录数
+    ]
+
+    def __init__(self, blocks=SHARD_RING_BLOCKS, block_size=SHARD_BLOCK_SIZE, name=None, free=None, full=None):
+        self.blocks = blocks
+        self.block_size = block_size
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=blocks * block_size)
+            self.free = mp.Semaphore(blocks)
+            self.full = mp.Semaphore(0)
+        else:
+            self.shm = shared_memory.SharedMemory(name)
+            self.free = free
+            self.full = full
+        self.slot = 0
+        self.pos = self.end = 0
+        self.nb = 0
+
+    def __reduce__(self):
+        return (
+            shard_ring,
+            (self.blocks, self.block_size, self.shm.name, self.free, self.full),
+        )
+
+    def put(self, seq, kind, data):
+        """写一条记录，返回当前块的记录数；块写满时先发出"""
+        n = RECORD_HEAD.size + len(data)
+        if self.nb and self.pos + n > self.end:
+            self.flush()
+        if not self.nb:
+            if n > self.block_size - BLOCK_HEAD.size:
+                raise Exception(f"shard_ring: record of {len(data)} bytes exceeds block_size={self.block_size}")
+            self.free.acquire()
+            self.pos = self.slot * self.block_size + BLOCK_HEAD.size
+            self.end = self.pos - BLOCK_HEAD.size + self.block_size
+        buf = self.shm.buf
+        RECORD_HEAD.pack_into(buf, self.pos, seq, len(data), kind)
+        self.pos += RECORD_HEAD.size
+        buf[self.pos : self.pos + len(data)] = data
+        self.pos += len(data)
+        self.nb += 1
+        return self.nb
+
+    def flush(self):
+        """发出当前块"""
+        if self.nb:
+            BLOCK_HEAD.pack_into(self.shm.buf, self.slot * self.block_size, self.nb)
+            self.full.release()
+            self.slot = (self.slot + 1) % self.blocks
+            self.nb = 0
+
+    def close(self):
+        """写端结束：发出当前块及结束块"""
+        self.flush()
+        self.free.acquire()
+        BLOCK_HEAD.pack_into(self.shm.buf, self.slot * self.block_size, SHARD_BLOCK_END)
+        self.full.release()
+
+    def get(self, decode=True):
+        """
+        读一块，返回[(输入序号, 消息), ...]，结束块返回None；
+        decode=False时不解码，消息为None
+        """
+        self.full.acquire()
+        buf = self.shm.buf
+        pos = self.slot * self.block_size
+        (nb,) = BLOCK_HEAD.unpack_from(buf, pos)
+        if nb == SHARD_BLOCK_END:
+            recs = None
+        else:
+            recs = []
+            pos += BLOCK_HEAD.size
+            for _ in range(nb):
+                seq, n, kind = RECORD_HEAD.unpack_from(buf, pos)
+                pos += RECORD_HEAD.size
+                if decode:
+                    data = buf[pos : pos + n]
+                    recs.append((seq, decode_record(kind, data)))
+                    data.release()
+                else:
+                    recs.append((seq, None))
+                pos += n
+        del buf
+        self.free.release()
+        self.slot = (self.slot + 1) % self.blocks
+        return recs
+
+    def release(self):
+        """创建方回收共享内存"""
+        self.shm.close()
+        self.shm.unlink()
+
+
+def shard_of_channel(unique_ChannelNo, shard_nb):
+    """无分片计划时按通道号取模"""
+    return unique_ChannelNo % shard_nb
+
+
+class security_stat:
+    """单个标的一日的逐笔统计"""
+
+    __slots__ = [
+        "SecurityID",
+        "unique_ChannelNo",
+        "order_nb",  # 新增委托
+        "exec_nb",  # 成交
+        "cancel_nb",  # 撤单
+        "resting_max",  # 挂单数峰值
+    ]
+
+    def __init__(self, SecurityID, unique_ChannelNo):
+        self.SecurityID = SecurityID
+        self.unique_ChannelNo = unique_ChannelNo
+        self.order_nb = 0
+        self.exec_nb = 0
+        self.cancel_nb = 0
+        self.resting_max = 0
+
+    @property
+    def weight(self):
+        """处理量估计：逐笔消息数"""
+        return self.order_nb + self.exec_nb + self.cancel_nb
+
+    def save(self):
+        return {attr: getattr(self, attr) for attr in self.__slots__}
+
+    def load(self, data):
+        for attr in self.__slots__:
+            setattr(self, attr, data[attr])
+
+
+def scan_day(source, SecurityIDSource, instrument_type=INSTRUMENT_TYPE.STOCK):
+    """
+    遍历一日行情，统计各标的的委托/成交/撤单数及挂单数峰值，返回{SecurityID : security_stat}
+    挂单按剩余数量跟踪：深交所以ApplSeqNum、上交所以OrderNo为订单号，成交扣减、撤单移除
+    """
+    decoder = get_msg_decoder(SecurityIDSource, instrument_type)
+    offsets = CHANNELNO_OFFSET.get(SecurityIDSource, {})
+    by_OrderNo = SecurityIDSource == SecurityIDSource_SSE
+    stats = {}
+    resting = {}  # SecurityID : {订单号 : 剩余数量}
+    for msg in source:
+        cls = msg.__class__
+        if cls is not axsbe_order and cls is not axsbe_exe:
+            continue
+        st = stats.get(msg.SecurityID)
+        if st is None:
+            offset = offsets.get(cls)
+            st = stats[msg.SecurityID] = security_stat(
+                msg.SecurityID, 0 if offset is None else msg.ChannelNo - offset
+            )
+            resting[msg.SecurityID] = {}
+        live = resting[msg.SecurityID]
+
+        if cls is axsbe_order:
+            no = msg.OrderNo if by_OrderNo else msg.ApplSeqNum
+            if decoder.ordtype(msg) == TYPE.UNKNOWN:  # 上交所撤单
+                st.cancel_nb += 1
+                live.pop(no, None)
+                continue
+            st.order_nb += 1
+            live[no] = msg.OrderQty
+            if len(live) > st.resting_max:
+                st.resting_max = len(live)
+        elif decoder.exectype(msg) == EXEC_TYPE.TRADE:
+            st.exec_nb += 1
+            for no in (msg.BidApplSeqNum, msg.OfferApplSeqNum):
+                qty = live.get(no)
+                if qty is not None:
+                    if qty > msg.LastQty:
+                        live[no] = qty - msg.LastQty
+                    else:
+                        live.pop(no)
+        else:  # 深交所撤单：被撤的一方序号非0
+            st.cancel_nb += 1
+            live.pop(msg.BidApplSeqNum or msg.OfferApplSeqNum, None)
+    return stats
+
+
+class shard_plan:
+    """
+    标的到分片的分配：同一通道的标的总在同一分片
+    spare_shard: 计划外(前一日没有逐笔)的通道分到的分片，为计划时最轻的分片
+    """
+
+    __slots__ = [
+        "shard_nb",
+        "channel_shard",  # unique_ChannelNo : 分片
+        "shard_SecurityIDs",  # 各分片的标的列表
+        "shard_weight",  # 各分片的逐笔数估计
+        "shard_resting",  # 各分片挂单数峰值之和，估计订单表规模
+        "spare_shard",
+    ]
+
+    def __init__(self, shard_nb=1):
+        self.shard_nb = shard_nb
+        self.channel_shard = {}
+        self.shard_SecurityIDs = [[] for _ in range(shard_nb)]
+        self.shard_weight = [0] * shard_nb
+        self.shard_resting = [0] * shard_nb
+        self.spare_shard = 0
+
+    def save(self):
+        return {attr: getattr(self, attr) for attr in self.__slots__}
+
+    def load(self, data):
+        for attr in self.__slots__:
+            setattr(self, attr, data[attr])
+
+    def __str__(self):
+        s = f"shard_plan: {len(self.channel_shard)} channels -> {self.shard_nb} shards\n"
+        for k in range(self.shard_nb):
+            s += f"  shard#{k}: securities={len(self.shard_SecurityIDs[k])} weight={self.shard_weight[k]} resting={self.shard_resting[k]}\n"
+        return s
+
+
+def plan_shards(stats, shard_nb, SecurityID_list=None):
+    """
+    按通道整体贪心分配(LPT)：通道按总逐笔数从大到小，依次放入当前最轻的分片
+    stats: scan_day的输出，或其save()的字典；SecurityID_list不为None时只统计其中的标的
+    """
+    channels = {}  # unique_ChannelNo : [security_stat]
+    for SecurityID, st in stats.items():
+        if SecurityID_list is not None and SecurityID not in SecurityID_list:
+            continue
+        if isinstance(st, dict):
+            d = st
+            st = security_stat(0, 0)
+            st.load(d)
+        channels.setdefault(st.unique_ChannelNo, []).append(st)
+
+    plan = shard_plan(shard_nb)
+    heap = [(0, k) for k in range(shard_nb)]
+    order = sorted(
+        channels.items(), key=lambda x: (-sum(st.weight for st in x[1]), x[0])
+    )
+    for unique_ChannelNo, sts in order:
+        weight, k = heapq.heappop(heap)
+        plan.channel_shard[unique_ChannelNo] = k
+        for st in sts:
+            plan.shard_SecurityIDs[k].append(st.SecurityID)
+            plan.shard_resting[k] += st.resting_max
+            weight += st.weight
+        plan.shard_weight[k] = weight
+        heapq.heappush(heap, (weight, k))
+    plan.spare_shard = heap[0][1]
+    return plan
+
+
+def _route(
+    source, SecurityIDSource, shard_nb, channel_shard, spare_shard, batch_size, rings, out_q
+):
+    """
+    路由进程：按通道分发，记录写入各分片的环形缓冲，每块至多batch_size条，结束时各发一个结束块
+    原始行只取消息头，不支持的消息类型同axsbe_file丢弃
+    """
+    try:
+        offsets = CHANNELNO_OFFSET.get(SecurityIDSource, {})
+        for seq, rec in enumerate(source):
+            if rec.__class__ is str:
+                cls, ChannelNo = line_header(rec)
+                if cls is None:
+                    continue
+            else:
+                cls, ChannelNo = rec.__class__, rec.ChannelNo
+            offset = offsets.get(cls)
+            unique_ChannelNo = 0 if offset is None else ChannelNo - offset
+            if channel_shard is None:
+                k = shard_of_channel(unique_ChannelNo, shard_nb)
+            else:
+                k = channel_shard.get(unique_ChannelNo, spare_shard)
+            ring = rings[k]
+            if ring.put(seq, *encode_record(rec)) >= batch_size:
+                ring.flush()
+        for ring in rings:
+            ring.close()
+    except Exception:
+        out_q.put((-1, None, traceback.format_exc(), None))
+
+
+def _work(
+    shard, SecurityID_list, SecurityIDSource, instrument_type, mu_kwargs, ring, out_q, return_state
+):
+    """
+    工作进程：运行一个MU，从环形缓冲读记录并解码；每块回送(分片, 本批最后的输入序号, [(输入序号, [快照...]), ...], None)
+    结束时回送(分片, None, flushSnap出的快照, MU检查点或None)
+    没有标的的分片只回送进度，不解码：其通道没有成员，单个MU也不会处理这些消息
+    """
+    try:
+        if not SecurityID_list:
+            while True:
+                recs = ring.get(decode=False)
+                if recs is None:
+                    break
+                out_q.put((shard, recs[-1][0], [], None))
+            out_q.put((shard, None, [], None))
+            return
+
+        mu = MU(SecurityID_list, SecurityIDSource, instrument_type, **mu_kwargs)
+        snaps = []
+        mu.set_snap_sink(snaps.append)
+        onMsg = mu.onMsg
+        while True:
+            recs = ring.get()
+            if recs is None:
+                break
+            out = []
+            for seq, msg in recs:
+                onMsg(msg)
+                if snaps:
+                    out.append((seq, snaps[:]))
+                    snaps.clear()
+            out_q.put((shard, recs[-1][0], out, None))
+
+        mu.flushSnap()
+        out_q.put((shard, None, snaps, mu.checkpoint(snaps=True) if return_state else None))
+    except Exception:
+        out_q.put((-1, None, traceback.format_exc(), None))
+
+
+class shard_runner:
+    """
+    按通道分片的多进程MU：
+      runner = shard_runner(SecurityID_list, SecurityIDSource, instrument_type, shard_nb=4)
+      for snap in runner.run(msgs): ...
+    plan: shard_plan或其save()的字典，决定分片数、通道分配及各分片的标的；为None时按通道号取模，
+          每个分片都持有全部标的(收不到消息的AXOB保持空闲)
+    其余参数同MU，透传给各分片的MU。
+    """
+
+    __slots__ = [
+        "SecurityID_list",
+        "SecurityIDSource",
+        "instrument_type",
+        "shard_nb",
+        "batch_size",
+        "plan",
+        "mu_kwargs",
+        "mus",  # run(return_state=True)结束后各分片的MU
+    ]
+
+    def __init__(
+        self,
+        SecurityID_list,
+        SecurityIDSource,
+        instrument_type,
+        shard_nb=None,
+        batch_size=1024,
+        plan=None,
+        **mu_kwargs,
+    ):
+        self.SecurityID_list = list(SecurityID_list)
+        self.SecurityIDSource = SecurityIDSource
+        self.instrument_type = instrument_type
+        if shard_nb is None:
+            shard_nb = max(1, mp.cpu_count() - 1)  # 留一个核给路由
+        self.shard_nb = shard_nb
+        self.batch_size = batch_size
+        self.plan = None
+        self.mu_kwargs = mu_kwargs
+        self.mus = None
+        if plan is not None:
+            self.load_plan(plan)
+
+    def load_plan(self, plan):
+        """按分片计划运行，分片数取计划中的"""
+        if isinstance(plan, dict):
+            data = plan
+            plan = shard_plan()
+            plan.load(data)
+        self.plan = plan
+        self.shard_nb = plan.shard_nb
+
+    def _shardSecurityIDs(self, k):
+        """计划中该分片的标的；计划外的标的每个分片都持有，其通道落在哪个分片都能处理"""
+        if self.plan is None:
+            return self.SecurityID_list
+        planned = set()
+        for x in self.plan.shard_SecurityIDs:
+            planned.update(x)
+        wanted = set(self.SecurityID_list)
+        return [x for x in self.plan.shard_SecurityIDs[k] if x in wanted] + [
+            x for x in self.SecurityID_list if x not in planned
+        ]
+
+    def run(self, source, return_state=False):
+        """
+        source: 消息或原始行(axsbe_file_raw)的可迭代对象，在路由进程中遍历；
+                spawn方式启动时须可pickle(如文件名构造的生成器需在fork下使用)
+        按输入顺序逐个产出重建快照；return_state=True时结束后各分片的MU见self.mus(没有标的的分片为None)
+        """
+        n = self.shard_nb
+        rings = [shard_ring() for _ in range(n)]
+        out_q = mp.Queue()
+        workers = []
+        for k in range(n):
+            SecurityID_list = self._shardSecurityIDs(k)
+            workers.append(
+                mp.Process(
+                    target=_work,
+                    args=(
+                        k,
+                        SecurityID_list,
+                        self.SecurityIDSource,
+                        self.instrument_type,
+                        self.mu_kwargs,
+                        rings[k],
+                        out_q,
+                        return_state,
+                    ),
+                    daemon=True,
+                )
+            )
+        router = mp.Process(
+            target=_route,
+            args=(
+                source,
+                self.SecurityIDSource,
+                n,
+                None if self.plan is None else self.plan.channel_shard,
+                0 if self.plan is None else self.plan.spare_shard,
+                self.batch_size,
+                rings,
+                out_q,
+            ),
+            daemon=True,
+        )
+        for p in workers:
+            p.start()
+        router.start()
+
+        done = [-1] * n  # 各分片已处理到的输入序号，结束后为None
+        heap = []  # (输入序号, 快照列表)，输入序号全局唯一
+        tails = [[] for _ in range(n)]
+        states = [None] * n
+        alive = n
+        try:
+            while alive:
+                shard, last, out, state = out_q.get()
+                if shard < 0:
+                    raise Exception(f"mu_shard failed:\n{out}")
+                if last is None:
+                    done[shard] = None
+                    tails[shard] = out
+                    states[shard] = state
+                    alive -= 1
+                else:
+                    done[shard] = last
+                    for item in out:
+                        heapq.heappush(heap, item)
+
+                # 所有未结束分片都处理过的序号以内，快照顺序已确定
+                marks = [x for x in done if x is not None]
+                watermark = min(marks) if marks else None
+                while heap and (watermark is None or heap[0][0] <= watermark):
+                    for snap in heapq.heappop(heap)[1]:
+                        yield snap
+            for tail in tails:
+                for snap in tail:
+                    yield snap
+        finally:
+            for p in [router] + workers:
+                if p.is_alive():
+                    p.terminate()
+                p.join()
+            for ring in rings:
+                ring.release()
+
+        if return_state:
+            self.mus = []
+            for buf in states:
+                if buf is None:  # 没有标的的分片
+                    self.mus.append(None)
+                    continue
+                mu = MU.__new__(MU)
+                mu.restore(buf)
+                self.mus.append(mu)
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+'''
+深交所合成行情：按简化的撮合规则生成一个交易日的逐笔委托/成交及快照，
+用于不依赖历史数据的一致性测试（不同容器实现之间、检查点恢复前后等的比对）
+'''
+
+import collections
+import random
+
+from tool.axsbe_base import SecurityIDSource_SZSE
+from tool.msg_util import (
+    ORDER_PRICE_OVERFLOW,
+    CYB_cage_lower,
+    CYB_cage_upper,
+    axsbe_exe,
+    axsbe_order,
+    axsbe_snap_stock,
+)
+
+SIM_DATE = 20230315
+SIM_CHANNELNO = 2011    # 逐笔通道号，快照通道号为其-1000
+
+
+class sim_security:
+    '''交易所侧的单只证券：可见价格档(价格->委托号队列)及笼子外的隐藏委托'''
+    def __init__(self, SecurityID, PrevClosePx, gem=False, no_limit=False, hidden_rate=0.12):
+        self.SecurityID = SecurityID
+        self.PrevClosePx = PrevClosePx   # 以分为单位
+        self.gem = gem                   # 创业板：有价格笼子
+        self.no_limit = no_limit         # 无涨跌幅限制（如上市首日）
+        self.hidden_rate = hidden_rate   # 连续竞价新委托落在笼子外的比例
+        if gem:
+            self.UpLimitPx = PrevClosePx * 12 // 10
+            self.DnLimitPx = PrevClosePx * 8 // 10
+        else:
+            self.UpLimitPx = PrevClosePx * 11 // 10
+            self.DnLimitPx = PrevClosePx * 9 // 10
+        self.bids = {}
+        self.asks = {}
+        self.orders = {}    # 委托号 -> [side, price, qty, hidden]
+        self.hidden = []    # 笼子外委托，按时间顺序
+        self.LastPx = 0
+        self.mid = PrevClosePx
+
+
+class market_sim:
+    def __init__(self, seed, securities):
+        self.r = random.Random(seed)
+        self.seq = 0
+        self.msgs = []
+        self.securities = securities
+        self.t = 0
+
+    def _ts(self):
+        return SIM_DATE * 1000000000 + self.t
+
+    ## 消息
+    def _order(self, s, side, price, qty, OrdType):
+        self.seq += 1
+        o = axsbe_order(SecurityIDSource_SZSE)
+        o.SecurityID = s.SecurityID
+        o.ChannelNo = SIM_CHANNELNO
+        o.ApplSeqNum = self.seq
+        o.TransactTime = self._ts()
+        o.Price = price * 100 if price is not None else 0
+        o.OrderQty = qty
+        o.Side = ord('1') if side == 0 else ord('2')
+        o.OrdType = ord(OrdType)
+        self.msgs.append(o)
+        return self.seq
+
+    def _exec(self, s, bid_seq, ask_seq, px, qty, cancel=False):
+        self.seq += 1
+        e = axsbe_exe(SecurityIDSource_SZSE)
+        e.SecurityID = s.SecurityID
+        e.ChannelNo = SIM_CHANNELNO
+        e.ApplSeqNum = self.seq
+        e.TransactTime = self._ts()
+        e.BidApplSeqNum = bid_seq
+        e.OfferApplSeqNum = ask_seq
+        e.LastPx = px * 100
+        e.LastQty = qty
+        e.ExecType = ord('4') if cancel else ord('F')
+        self.msgs.append(e)
+        if not cancel:
+            s.LastPx = px
+
+    def _cancel(self, s, seq):
+        side, _, qty, _ = s.orders[seq]
+        self._remove(s, seq)
+        self._exec(s, seq if side == 0 else 0, seq if side == 1 else 0, 0, qty, cancel=True)
+
+    def _snap(self, s, TradingPhaseCode, HHMMSSms):
+        snap = axsbe_snap_stock(SecurityIDSource_SZSE)
+        snap.SecurityID = s.SecurityID
+        snap.ChannelNo = SIM_CHANNELNO - 1000
+        snap.TransactTime = SIM_DATE * 1000000000 + HHMMSSms
+        snap.TradingPhaseCode = TradingPhaseCode
+        snap.PrevClosePx = s.PrevClosePx * 100
+        if s.no_limit:
+            snap.UpLimitPx = ORDER_PRICE_OVERFLOW
+            snap.DnLimitPx = 100
+        else:
+            snap.UpLimitPx = s.UpLimitPx * 100
+            snap.DnLimitPx = s.DnLimitPx * 100
+        snap.LastPx = s.LastPx * 100
+        self.msgs.append(snap)
+
+    ## 价格档
+    def _book(self, s, side):
+        return s.bids if side == 0 else s.asks
+
+    def _best(self, s, side):
+        book = self._book(s, side)
+        if not book:
+            return None
+        return max(book) if side == 0 else min(book)
+
+    def _rest(self, s, seq, side, price, qty):
+        s.orders[seq] = [side, price, qty, False]
+        self._book(s, side).setdefault(price, collections.deque()).append(seq)
+
+    def _remove(self, s, seq):
+        side, price, _, hidden = s.orders.pop(seq)
+        if hidden:
+            s.hidden.remove(seq)
+            return
+        book = self._book(s, side)
+        book[price].remove(seq)
+        if not book[price]:
+            del book[price]
+
+    def _match(self, s, seq, side, price, qty, max_levels=None, best_only=False):
+        '''主动成交，price=None为市价；返回未成交数量'''
+        book = self._book(s, 1 - side)
+        levels = 0
+        while qty and book:
+            px = self._best(s, 1 - side)
+            if price is not None and ((side == 0 and px > price) or (side == 1 and px < price)):
+                break
+            if max_levels is not None and levels >= max_levels:
+                break
+            q = book[px]
+            while qty and q:
+                resting = s.orders[q[0]]
+                traded = min(qty, resting[2])
+                if side == 0:
+                    self._exec(s, seq, q[0], px, traded)
+                else:
+                    self._exec(s, q[0], seq, px, traded)
+                qty -= traded
+                resting[2] -= traded
+                if resting[2] == 0:
+                    del s.orders[q.popleft()]
+            if not q:
+                del book[px]
+            levels += 1
+            if best_only:
+                break
+        return qty
+
+    ## 价格笼子
+    def _cage_refs(self, s):
+        ask = self._best(s, 1)
+        bid = self._best(s, 0)
+        last = s.LastPx or s.PrevClosePx
+        bid_ref = ask if ask is not None else (bid if bid is not None else last)
+        ask_ref = bid if bid is not None else (ask if ask is not None else last)
+        return bid_ref, ask_ref
+
+    def _out_of_cage(self, s, side, price):
+        if not s.gem:
+            return False
+        bid_ref, ask_ref = self._cage_refs(s)
+        if side == 0:
+            return price > CYB_cage_upper(bid_ref)
+        return price < CYB_cage_lower(ask_ref)
+
+    def _release_hidden(self, s):
+        '''基准价变化后，按价格优先、时间优先放出进入笼子的隐藏委托'''
+        released = True
+        while released:
+            released = False
+            for seq in sorted(s.hidden, key=lambda x: (s.orders[x][1] if s.orders[x][0] == 0 else -s.orders[x][1], x)):
+                side, price, qty, _ = s.orders[seq]
+                if not self._out_of_cage(s, side, price):
+                    s.hidden.remove(seq)
+                    del s.orders[seq]
+                    qty = self._match(s, seq, side, price, qty)
+                    if qty:
+                        self._rest(s, seq, side, price, qty)
+                    released = True
+                    break
+
+    ## 行为
+    def _qty(self):
+        return self.r.choice([1, 1, 1, 2, 3, 5, 10, 20, 50]) * 10000
+
+    def _price(self, s, spread):
+        px = s.mid + self.r.randint(-spread, spread)
+        if not s.no_limit:
+            px = max(s.DnLimitPx, min(s.UpLimitPx, px))
+        return max(px, 1)
+
+    def _callOrder(self, s, close):
+        if self.r.random() < 0.2 and s.orders:
+            self._cancel(s, self.r.choice(list(s.orders)))
+            return
+        side = self.r.randint(0, 1)
+        price = self._price(s, 15)
+        if s.no_limit and close:    # 无涨跌幅限制的收盘集合竞价：成交价上下10%
+            price = max((s.LastPx * 90 + 50) // 100, min((s.LastPx * 110 + 50) // 100, price))
+        qty = self._qty()
+        seq = self._order(s, side, price, qty, '2')
+        self._rest(s, seq, side, price, qty)
+
+    def _uncross(self, s):
+        '''集合竞价撮合：最大成交量 -> 最小剩余量 -> 最接近参考价'''
+        bids = s.bids
+        asks = s.asks
+        if not bids or not asks or max(bids) < min(asks):
+            return
+        ref = s.LastPx or s.PrevClosePx
+        best = None
+        for px in sorted(set(bids) | set(asks)):
+            bid_qty = sum(s.orders[x][2] for p, q in bids.items() if p >= px for x in q)
+            ask_qty = sum(s.orders[x][2] for p, q in asks.items() if p <= px for x in q)
+            key = (min(bid_qty, ask_qty), -abs(bid_qty - ask_qty), -abs(px - ref))
+            if best is None or key > best[0]:
+                best = (key, px)
+        px = best[1]
+        while bids and asks and max(bids) >= px and min(asks) <= px:
+            bid_px = max(bids)
+            ask_px = min(asks)
+            bid_seq = bids[bid_px][0]
+            ask_seq = asks[ask_px][0]
+            traded = min(s.orders[bid_seq][2], s.orders[ask_seq][2])
+            self._exec(s, bid_seq, ask_seq, px, traded)
+            for seq, book, p in ((bid_seq, bids, bid_px), (ask_seq, asks, ask_px)):
+                s.orders[seq][2] -= traded
+                if s.orders[seq][2] == 0:
+                    del s.orders[book[p].popleft()]
+                    if not book[p]:
+                        del book[p]
+
+    def _tradeOrder(self, s):
+        r = self.r.random()
+        side = self.r.randint(0, 1)
+        if r < 0.25 and s.orders:
+            self._cancel(s, self.r.choice(list(s.orders)))
+        elif r < 0.32 and self._book(s, 1 - side):
+            qty = self._qty() * self.r.choice([1, 2, 5])
+            seq = self._order(s, side, None, qty, '1')
+            if self.r.random() < 0.5:   # 最优五档即时成交剩余撤销
+                qty = self._match(s, seq, side, None, qty, max_levels=5)
+                if qty:
+                    self._exec(s, seq if side == 0 else 0, seq if side == 1 else 0, 0, qty, cancel=True)
+            else:                       # 对手方最优
+                px = self._best(s, 1 - side)
+                qty = self._match(s, seq, side, px, qty, best_only=True)
+                if qty:
+                    self._rest(s, seq, side, px, qty)
+        elif r < 0.36 and self._book(s, side):  # 本方最优
+            qty = self._qty()
+            seq = self._order(s, side, None, qty, 'U')
+            self._rest(s, seq, side, self._best(s, side), qty)
+        else:
+            price = self._price(s, 14 if s.gem else 10)
+            if s.gem and self.r.random() < s.hidden_rate:
+                off = s.mid * self.r.randint(20, 45) // 1000
+                price = s.mid + off if side == 0 else s.mid - off
+                if not s.no_limit:
+                    price = max(s.DnLimitPx, min(s.UpLimitPx, price))
+            qty = self._qty()
+            seq = self._order(s, side, price, qty, '2')
+            if self._out_of_cage(s, side, price):
+                s.orders[seq] = [side, price, qty, True]
+                s.hidden.append(seq)
+            else:
+                qty = self._match(s, seq, side, price, qty)
+                if qty:
+                    self._rest(s, seq, side, price, qty)
+        if s.gem:
+            self._release_hidden(s)
+        if self.r.random() < 0.05:
+            s.mid += self.r.choice([-1, 1])
+            if not s.no_limit:
+                s.mid = max(s.DnLimitPx + 5, min(s.UpLimitPx - 5, s.mid))
+
+    def _closeCallBegin(self, s):
+        '''收盘集合竞价开始：隐藏委托全部放出；无涨跌幅限制的，成交价上下10%之外的委托被剔除'''
+        lo = (s.LastPx * 90 + 50) // 100
+        hi = (s.LastPx * 110 + 50) // 100
+        for seq in list(s.hidden):
+            side, price, qty, _ = s.orders[seq]
+            s.hidden.remove(seq)
+            del s.orders[seq]
+            if s.no_limit and not lo <= price <= hi:
+                continue
+            self._rest(s, seq, side, price, qty)
+        if s.no_limit:
+            for seq in list(s.orders):
+                if not lo <= s.orders[seq][1] <= hi:
+                    self._remove(s, seq)
+
+    def _span(self, t0, t1, n, f):
+        for t in sorted(self.r.randint(t0, t1 - 1) // 10 * 10 for _ in range(n)):
+            self.t = t
+            f(self.r.choice(self.securities))
+
+    def run(self, n_open, n_am, n_pm, n_close):
+        for s in self.securities:
+            self.t = 83000000
+            self._snap(s, 0, 83000000)
+        self._span(91500000, 92459990, n_open, lambda s: self._callOrder(s, False))
+        self.t = 92500000
+        for s in self.securities:
+            self._uncross(s)
+        for s in self.securities:
+            self._snap(s, 3, 92520000)
+        self._span(93000000, 112959990, n_am, self._tradeOrder)
+        for s in self.securities:
+            self._snap(s, 3, 113020000)
+        self._span(130000000, 145659990, n_pm, self._tradeOrder)
+        self.t = 145700000
+        for s in self.securities:
+            self._closeCallBegin(s)
+        self._span(145700000, 145959990, n_close, lambda s: self._callOrder(s, True))
+        self.t = 150000000
+        for s in self.securities:
+            self._uncross(s)
+        for s in self.securities:
+            self._snap(s, 5, 150020000)
+        return self.msgs
+
+
+def sim_day(seed, kind='mb', n=(300, 2000, 2000, 200)):
+    '''
+    生成一个交易日的消息，返回(消息列表, 证券代码列表)
+    kind: mb=主板; gem=创业板(价格笼子); gem_nl=创业板无涨跌幅限制; mix=主板+创业板(含无涨跌幅限制)
+    n: 开盘集合竞价/上午/下午/收盘集合竞价的事件数
+    '''
+    r = random.Random(seed)
+    if kind == 'mb':
+        securities = [sim_security(1, 1000 + r.randint(0, 500)), sim_security(2, 500)]
+    elif kind == 'gem':
+        securities = [sim_security(300001, 2000 + r.randint(0, 500), gem=True)]
+    elif kind == 'gem_nl':
+        securities = [sim_security(301001, 3000, gem=True, no_limit=True, hidden_rate=0.01),
+                      sim_security(300002, 1500, gem=True, hidden_rate=0.01)]
+    else:
+        securities = [sim_security(1, 1000), sim_security(300001, 2000, gem=True, hidden_rate=0.01),
+                      sim_security(301001, 3000, gem=True, no_limit=True, hidden_rate=0.01)]
+    return market_sim(seed, securities).run(*n), [s.SecurityID for s in securities]
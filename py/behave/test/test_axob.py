@@ -406,7 +406,10 @@ def TEST_axob_rolling(date, instrument:int, n_max=500, rolling_gap=5,
         section = None
     else:
         section = pickle.load(open(f"log/rolling/{begin_section}.pkl",'rb'))
-        mu.load(section['save_data'])
+        if 'checkpoint' in section:
+            mu.restore(section['checkpoint'])
+        else:   # 旧格式的现场(save数据)，早期缺少的字段由load按AXOB_LOAD_DEFAULT/MU_LOAD_DEFAULT补齐，见TEST_mu_load_old_save
+            mu.load(section['save_data'])
         boc = section['boc']
         HHMMSSms = section['HHMMSSms']
         assert date==section['date'] and instrument==section['instrument'] and (n_max==0 or n_max>section['n'])
@@ -444,9 +447,8 @@ def TEST_axob_rolling(date, instrument:int, n_max=500, rolling_gap=5,
         else:
             if msg.HHMMSSms > HHMMSSms + rolling_gap*100000:    # step = gap * 1min
                 HHMMSSms = msg.HHMMSSms
-                save_data = mu.save()
                 section = {
-                    'save_data':save_data,
+                    'checkpoint':mu.checkpoint(snaps=True),   # 每个现场须可单独装载，用全量检查点；带快照缓存以继续比对行情快照
                     'date':date,
                     'instrument':instrument,
                     'n_max':n_max,
@@ -494,7 +496,10 @@ def TEST_mu_rolling(source_file, instrument_list, n_max=500, rolling_gap=5,
         skip_nb = 0
     else:
         section = pickle.load(open(f"log/rolling/{begin_section}.pkl",'rb'))
-        mu.load(section['save_data'])
+        if 'checkpoint' in section:
+            mu.restore(section['checkpoint'])
+        else:   # 旧格式的现场(save数据)，早期缺少的字段由load按AXOB_LOAD_DEFAULT/MU_LOAD_DEFAULT补齐，见TEST_mu_load_old_save
+            mu.load(section['save_data'])
         boc = section['boc']
         HHMMSSms = section['HHMMSSms']
         skip_nb = section['n']
@@ -521,9 +526,8 @@ def TEST_mu_rolling(source_file, instrument_list, n_max=500, rolling_gap=5,
         else:
             if msg.HHMMSSms > HHMMSSms + rolling_gap*100000:    # step = gap * 1min
                 HHMMSSms = msg.HHMMSSms
-                save_data = mu.save()
                 section = {
-                    'save_data':save_data,
+                    'checkpoint':mu.checkpoint(snaps=True),   # 每个现场须可单独装载，用全量检查点；带快照缓存以继续比对行情快照
                     'source_file':source_file,
                     'instrument_list':instrument_list,
                     'n_max':n_max,
@@ -0,0 +1,648 @@
+# -*- coding: utf-8 -*-
+'''
+不依赖历史数据的用例：以合成行情(market_sim)驱动，比对不同实现/恢复路径的输出
+'''
+
+from tool.axsbe_base import SecurityIDSource_SZSE, INSTRUMENT_TYPE, TPM
+from tool.test_util import *
+from behave.mu import *
+from behave.mu import MU_LOAD_DEFAULT
+from behave.axob import AXOB_LOAD_DEFAULT, CHANNEL_PAGE_BITS, TYPE, channel_order_map, channel_order_table, new_order_map, ob_order
+from behave.axob import level_node
+from behave.level_tree import new_level_tree
+from behave.mu_shard import plan_shards, scan_day, shard_runner
+from behave.test.market_sim import market_sim, sim_day, sim_security
+from tool.msg_util import msgs_to_batch
+import copy
+import heapq
+from itertools import accumulate
+import pickle
+import random
+
+
+def run_snaps(mu, msgs):
+    '''逐条处理msgs，返回期间生成的全部重建快照(文本)'''
+    snaps = []
+    mu.set_snap_sink(lambda snap: snaps.append(str(snap)))
+    for msg in msgs:
+        mu.onMsg(msg)
+    return snaps
+
+
+def book_state(mu):
+    '''各AXOB的订单(按容器顺序)、价格档及标量状态，用于比对两个MU'''
+    state = {}
+    for SecurityID, axob in mu.axobs.items():
+        scalars = axob._saveScalars()
+        scalars.pop('verifier')
+        if scalars['holding_order'] is not None:
+            scalars['holding_order'] = scalars['holding_order'].save()
+        state[SecurityID] = (
+            [order.save() for order in axob.order_map.values()],
+            [(l.price, l.qty) for l in axob.bid_level_tree.inorder_list_inc()],
+            [(l.price, l.qty) for l in axob.ask_level_tree.inorder_list_inc()],
+            scalars,
+        )
+    return state
+
+
+@timeit
+def TEST_mu_load_old_save(seed=3, kind='mb'):
+    '''
+    早期save数据(无LOAD_DEFAULT中的字段)的装载，即TEST_mu_rolling中旧格式现场的路径：
+    中途装载后继续处理，重建快照须与不中断的运行一致
+    '''
+    msgs, SecurityID_list = sim_day(seed, kind)
+    cut = len(msgs) // 2
+
+    mu = MU(SecurityID_list, SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK, order_store_type=ORDER_STORE_TYPE.DICT)
+    ref = run_snaps(mu, msgs)
+
+    mu = MU(SecurityID_list, SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK, order_store_type=ORDER_STORE_TYPE.ARRAY)
+    head = run_snaps(mu, msgs[:cut])
+    save_data = mu.save()
+    for attr in MU_LOAD_DEFAULT:
+        save_data.pop(attr)
+    for data in save_data['axobs'].values():
+        for attr in AXOB_LOAD_DEFAULT:
+            data.pop(attr)
+
+    mu = MU(SecurityID_list, SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK)
+    mu.load(save_data)
+    for axob in mu.axobs.values():
+        assert axob.order_store_type == ORDER_STORE_TYPE.DICT and not axob.level_queue
+        assert axob.level_tree_type == LEVEL_TREE_TYPE.SORTED
+        assert axob.verifier.policy == VERIFY_POLICY.FULL
+    tail = run_snaps(mu, msgs[cut:])
+    assert head + tail == ref, 'old save data resumed NG'
+    print(f'TEST_mu_load_old_save: {len(ref)} snaps OK')
+
+
+@timeit
+def TEST_mu_ckpt_delta(order_store_type=ORDER_STORE_TYPE.ARRAY, seed=3, kind='mb', steps=(0, 1, 10, 100, 1000)):
+    '''
+    全量+增量检查点链：副本依次恢复后与主MU状态一致，并可接着处理后续行情；
+    增量的大小只随其间变化的订单及价格档增长，不含随运行时间增长的快照缓存，与订单容器类型无关
+    '''
+    msgs, SecurityID_list = sim_day(seed, kind)
+    n = len(msgs) // 2
+    mu = MU(SecurityID_list, SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK, order_store_type=order_store_type)
+    for msg in msgs[:n]:
+        mu.onMsg(msg)
+
+    replica = MU.__new__(MU)
+    full = mu.checkpoint(delta=True)    # 尚无基准，退化为全量，可恢复到空对象上
+    replica.restore(full)
+    assert book_state(replica) == book_state(mu), 'full checkpoint NG'
+
+    ORDER_DELTA_SIZE = 36   # 增量中每个订单：op, applSeqNum, price, qty, side, type, traded, TransactTime
+    LEVEL_DELTA_SIZE = 16   # 增量中每个价格档：price, qty
+    empty = None
+    for step in steps:
+        for msg in msgs[n:n + step]:
+            mu.onMsg(msg)
+        n += step
+        delta = mu.checkpoint(delta=True)
+        replica.restore(delta)
+        assert book_state(replica) == book_state(mu), f'delta checkpoint after {step} msgs NG'
+        if empty is None:
+            empty = len(delta)
+        # 每条逐笔至多改变2个订单、2个价格档
+        assert len(delta) <= empty + step * 2 * (ORDER_DELTA_SIZE + LEVEL_DELTA_SIZE) + 64 * len(SecurityID_list), \
+            f'delta checkpoint after {step} msgs: {len(delta)} bytes NG'
+        print(f'TEST_mu_ckpt_delta({order_store_type.name}): {step} msgs -> {len(delta)} bytes')
+    assert empty * 20 < len(pickle.dumps(mu.save())), f'empty delta checkpoint {empty} bytes NG'
+    print(f'TEST_mu_ckpt_delta({order_store_type.name}): full={len(full)} bytes, save={len(pickle.dumps(mu.save()))} bytes')
+
+    # 副本接管：从最后一个增量继续处理，重建快照与主MU一致
+    tail = msgs[n:]
+    assert run_snaps(replica, tail) == run_snaps(mu, tail), 'replica resumed NG'
+
+
+@timeit
+def TEST_axob_close_call_range(order_store_type=ORDER_STORE_TYPE.ARRAY, level_queue=True):
+    '''
+    创业板无涨跌幅限制：进入收盘集合竞价时删除最近成交价上下10%之外的价格档，
+    档上的订单随之出簿(与委托队列一致，FULL自检)，其后的撤单按无效订单处理
+    '''
+    s = sim_security(301001, 3000, gem=True, no_limit=True)
+    sim = market_sim(0, [s])
+    sim.t = 83000000
+    sim._snap(s, 0, 83000000)
+    sim.t = 91500000
+    for side in (0, 1):
+        sim._rest(s, sim._order(s, side, 3000, 10000, '2'), side, 3000, 10000)
+    sim.t = 92500000
+    sim._uncross(s)
+    sim._snap(s, 3, 92520000)
+
+    sim.t = 93000000
+    far = []
+    for price in (2000, 2000, 2990):    # 2000低于收盘集合竞价的有效范围
+        seq = sim._order(s, 0, price, 10000, '2')
+        sim._rest(s, seq, 0, price, 10000)
+        if price == 2000:
+            far.append(seq)
+    sim._rest(s, sim._order(s, 1, 3010, 20000, '2'), 1, 3010, 20000)
+    sim._snap(s, 3, 113020000)
+
+    sim.t = 130000000
+    seq = sim._order(s, 0, 3010, 10000, '2')    # 最近成交价3010
+    sim._match(s, seq, 0, 3010, 10000)
+    sim.t = 145700000
+    sim._rest(s, sim._order(s, 0, 3000, 10000, '2'), 0, 3000, 10000)
+    sim.t = 145710000
+    sim._cancel(s, far[0])
+    sim.t = 150000000
+    sim._uncross(s)
+    sim._snap(s, 5, 150020000)
+
+    mu = MU([s.SecurityID], SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK,
+            order_store_type=order_store_type, level_queue=level_queue)
+    for msg in sim.msgs:
+        mu.onMsg(msg)
+    axob = mu.axobs[s.SecurityID]
+    assert 2000 not in axob.bid_level_tree
+    assert far[0] not in axob.order_map and far[0] not in axob.illegal_order_map
+    assert far[1] not in axob.order_map and far[1] in axob.illegal_order_map
+    if level_queue:
+        assert axob.order_map.queue(SIDE.BID, 2000) == []
+    print(f'TEST_axob_close_call_range: {order_store_type} level_queue={level_queue} OK')
+
+
+@timeit
+def TEST_axob_late_exec(order_store_type=ORDER_STORE_TYPE.DICT):
+    '''
+    全部成交出列后，迟到的成交及对该订单的撤单只记ERR，不抛异常、不改变订单及价格档
+    '''
+    s = sim_security(1, 3000)
+    sim = market_sim(0, [s])
+    sim.t = 83000000
+    sim._snap(s, 0, 83000000)
+    sim.t = 93000000
+    ask = sim._order(s, 1, 3000, 10000, '2')
+    sim._rest(s, ask, 1, 3000, 10000)
+    sim._rest(s, sim._order(s, 1, 3010, 10000, '2'), 1, 3010, 10000)
+    bid = sim._order(s, 0, 3000, 10000, '2')
+    sim._match(s, bid, 0, 3000, 10000)
+
+    mu = MU([s.SecurityID], SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK, order_store_type=order_store_type)
+    for msg in sim.msgs:
+        mu.onMsg(msg)
+    assert ask not in mu.axobs[s.SecurityID].order_map
+
+    state = lambda: book_state(mu)[s.SecurityID][:3]     # 订单及价格档；成交统计照常累计
+    before = state()
+    sim.msgs = []
+    sim._exec(s, bid, ask, 3000, 10000)     # 迟到的成交
+    sim._exec(s, 0, ask, 0, 10000, cancel=True)
+    for msg in sim.msgs:
+        mu.onMsg(msg)
+    assert state() == before, 'late exec/cancel book NG'
+    print(f'TEST_axob_late_exec: {order_store_type} OK')
+
+
+def check_order_stores(stores, refs):
+    '''各订单容器与对应的dict内容、迭代顺序一致'''
+    for ref, group in zip(refs, stores):
+        expect = [(k, v.save()) for k, v in ref.items()]
+        for store in group:
+            assert len(store) == len(ref), f'{type(store).__name__} size NG'
+            assert [(k, v.save()) for k, v in store.items()] == expect, f'{type(store).__name__} items NG'
+            assert list(store) == list(ref)
+            for applSeqNum in list(ref)[:10]:
+                assert applSeqNum in store and store[applSeqNum].save() == ref[applSeqNum].save()
+
+
+def random_order(r, applSeqNum):
+    order = ob_order.__new__(ob_order)
+    order.applSeqNum = applSeqNum
+    order.price = r.randint(1000, 1010)
+    order.qty = r.randint(1, 9) * 100
+    order.side = SIDE.BID if r.random() < 0.5 else SIDE.ASK
+    order.type = TYPE.LIMIT
+    order.traded = False
+    order.TransactTime = applSeqNum
+    return order
+
+
+def check_order_queues(table, arrival):
+    '''order_table(L3)按ApplSeqNum有序，各价格档委托队列与到达顺序一致'''
+    assert list(table) == sorted(arrival), 'order table order NG'
+    queues = {}
+    for order in arrival.values():
+        queues.setdefault((order.side, order.price), []).append(order.applSeqNum)
+    for (side, price), q in queues.items():
+        assert [o.applSeqNum for o in table.queue(side, price)] == q, f'{side} {price} queue NG'
+    assert sum(len(table.queue(side, price)) for side, price in queues) == len(table)
+
+
+@timeit
+def TEST_order_store(seed=1, n=50000, owner_nb=4, resting_nb=51):
+    '''
+    订单容器对照dict：随机插入/改量/出簿后内容及迭代顺序一致；
+    通道订单表中长期在簿的少量订单只占住所在的页，其余页随订单出簿释放
+    '''
+    r = random.Random(seed)
+    table = channel_order_table()
+    stores = [(new_order_map(ORDER_STORE_TYPE.ARRAY), new_order_map(ORDER_STORE_TYPE.ARRAY, True))]
+    for owner in range(owner_nb):
+        stores.append((channel_order_map(table, owner),))
+    refs = [{} for _ in stores]
+    resting = set(r.sample(range(1, n + 1), resting_nb))
+    for applSeqNum in range(1, n + 1):
+        if applSeqNum % 10000 == 0:
+            check_order_stores(stores, refs)
+        k = r.randrange(len(stores))
+        order = random_order(r, applSeqNum)
+        refs[k][applSeqNum] = order
+        for store in stores[k]:
+            store[applSeqNum] = order
+        k = r.randrange(len(stores))
+        if refs[k] and r.random() < 0.95:  # 成交或撤单，时间优先的订单多半先出簿
+            applSeqNum = next(iter(refs[k])) if r.random() < 0.7 else r.choice(list(refs[k]))
+            if applSeqNum in resting:
+                continue
+            if r.random() < 0.3:
+                refs[k][applSeqNum].qty -= 100
+                for store in stores[k]:
+                    store[applSeqNum].qty -= 100
+                    store[applSeqNum].traded = True
+                refs[k][applSeqNum].traded = True
+                if refs[k][applSeqNum].qty > 0:
+                    continue
+            order = refs[k].pop(applSeqNum)
+            for store in stores[k]:
+                assert store.pop(applSeqNum).save() == order.save()
+    check_order_stores(stores, refs)
+
+    for ref, group in zip(refs, stores):
+        for applSeqNum in [x for x in ref if x not in resting]:
+            ref.pop(applSeqNum)
+            for store in group:
+                store.pop(applSeqNum)
+    check_order_stores(stores, refs)
+    # 逆序到达插入有序位置；出簿过半后整理空槽位，委托队列链接随之重排
+    l3 = new_order_map(ORDER_STORE_TYPE.ARRAY, True)
+    arrival = {}
+    for applSeqNum in list(range(1000, 1400, 2)) + list(range(1399, 1000, -40)):
+        arrival[applSeqNum] = random_order(r, applSeqNum)
+        l3[applSeqNum] = arrival[applSeqNum]
+    check_order_queues(l3, arrival)
+    for applSeqNum in r.sample(list(arrival), 150):
+        assert l3.pop(applSeqNum).applSeqNum == arrival.pop(applSeqNum).applSeqNum
+    for applSeqNum in range(2000, 2010):
+        arrival[applSeqNum] = random_order(r, applSeqNum)
+        l3[applSeqNum] = arrival[applSeqNum]
+    assert len(l3.live) == len(l3) - 10 + 10, 'order l3 compact NG'
+    check_order_queues(l3, arrival)
+
+    live = {applSeqNum >> CHANNEL_PAGE_BITS for ref in refs[1:] for applSeqNum in ref}
+    assert set(table.pages) == live, f'channel order table pages={len(table.pages)} NG'
+    print(f'TEST_order_store: {n} orders, channel table pages={len(table.pages)} for {resting_nb} resting orders')
+
+
+def check_level_tree(tree, ref):
+    '''价格档容器与dict参照(price:qty)的内容及有序访问一致'''
+    name = type(tree).__name__
+    prices = sorted(ref)
+    assert len(tree) == len(ref), f'{name} size NG'
+    assert [(l.price, l.qty) for l in tree.inorder_list_inc()] == [(p, ref[p]) for p in prices], f'{name} inc NG'
+    assert [l.price for l in tree.inorder_list_dec()] == prices[::-1], f'{name} dec NG'
+    assert list(tree.inorder_pq_inc()) == [(p, ref[p]) for p in prices], f'{name} pq inc NG'
+    assert list(tree.inorder_pq_dec()) == [(p, ref[p]) for p in prices[::-1]], f'{name} pq dec NG'
+    if prices:
+        assert tree.locate_min().price == prices[0] and tree.locate_max().price == prices[-1]
+        assert tree.locate_min_pq() == (prices[0], ref[prices[0]]) and tree.locate_max_pq() == (prices[-1], ref[prices[-1]])
+    else:
+        assert tree.locate_min() is None and tree.locate_max() is None
+        assert tree.locate_min_pq() is None and tree.locate_max_pq() is None
+    for price in prices[:3] + prices[-3:] + [prices[len(prices) // 2]] if prices else []:
+        assert price in tree and tree[price].qty == tree.qty_of(price) == ref[price]
+        lower = [(p, ref[p]) for p in prices if p < price]
+        higher = [(p, ref[p]) for p in prices if p > price]
+        l = tree.locate_lower(price)
+        assert (l and (l.price, l.qty)) == tree.locate_lower_pq(price) == (lower[-1] if lower else None), \
+            f'{name} locate_lower({price}) NG'
+        l = tree.locate_higher(price)
+        assert (l and (l.price, l.qty)) == tree.locate_higher_pq(price) == (higher[0] if higher else None), \
+            f'{name} locate_higher({price}) NG'
+        assert list(tree.inorder_pq_inc(price + 1)) == higher and list(tree.inorder_pq_dec(price - 1)) == lower[::-1], \
+            f'{name} inorder_pq from {price} NG'
+
+
+@timeit
+def TEST_level_tree(seed=1, n=20000, price_lo=1000, price_hi=1100):
+    '''
+    SORTED/DENSE/HASH价格档容器对照dict：随机增删档、增减数量(含价格带外的价格)后内容及有序访问一致；
+    SORTED的dict接口(popitem/copy/|=/fromkeys/pickle)保持价格数组同步
+    '''
+    r = random.Random(seed)
+    trees = [new_level_tree(t, price_lo, price_hi) for t in LEVEL_TREE_TYPE]
+    ref = {}
+    for step in range(n):
+        price = r.randint(price_lo - 20, price_hi + 20)
+        x = r.random()
+        if price not in ref:
+            qty = r.randint(1, 9) * 100
+            ref[price] = qty
+            for tree in trees:
+                tree[price] = level_node(price, qty, 0)
+        elif x < 0.4:
+            ref[price] += 100
+            for tree in trees:
+                assert tree.add_qty(price, 100) == ref[price]
+        elif x < 0.7 and ref[price] > 100:
+            ref[price] -= 100
+            for tree in trees:
+                assert tree.sub_qty(price, 100) == ref[price]
+        elif x < 0.85:
+            qty = ref.pop(price)
+            for tree in trees:
+                assert tree.pop(price).qty == qty
+        elif x < 0.98:
+            ref.pop(price)
+            for tree in trees:
+                del tree[price]
+        else:
+            lo, hi = sorted((price, r.randint(price_lo - 20, price_hi + 20)))
+            removed = sorted(p for p in ref if lo <= p <= hi)
+            qty = sum(ref[p] for p in removed)
+            value = sum(p * ref[p] for p in removed)
+            for tree in trees:
+                assert tree.range_sum(lo, hi) == (qty, value)
+                nodes, q, v = tree.pop_range(lo, hi)
+                assert sorted(l.price for l in nodes) == removed and (q, v) == (qty, value)
+            for p in removed:
+                ref.pop(p)
+        if step % 1000 == 0:
+            for tree in trees:
+                check_level_tree(tree, ref)
+    for tree in trees:
+        check_level_tree(tree, ref)
+
+    tree = trees[LEVEL_TREE_TYPE.SORTED.value]
+    for clone in (tree.copy(), copy.copy(tree), copy.deepcopy(tree), pickle.loads(pickle.dumps(tree))):
+        check_level_tree(clone, ref)
+    clone = tree.copy()
+    clone |= {price: level_node(price, 100, 0) for price in (price_lo - 50, price_hi + 50)}
+    check_level_tree(clone, {**ref, price_lo - 50: 100, price_hi + 50: 100})
+    check_level_tree(tree, ref)
+    while clone:
+        price, l = clone.popitem()
+        assert price == l.price == max(clone.prices + [price]) and price not in clone
+    check_level_tree(clone, {})
+    clone = type(tree).fromkeys([3, 1, 2], level_node(0, 0, 0))
+    assert clone.prices == [1, 2, 3]
+
+    # 价格带内增删档时前缀和随之维护，出现价格带外的价格档后不可用
+    trees = [new_level_tree(t, price_lo, price_hi) for t in LEVEL_TREE_TYPE]
+    ref = {}
+    for tree in trees:
+        assert tree.prefix_sum_ready()
+    for step in range(n // 10):
+        price = r.randint(price_lo, price_hi)
+        x = r.random()
+        for tree in trees:
+            if price not in ref:
+                tree[price] = level_node(price, 100, 0)
+            elif x < 0.4:
+                tree.add_qty(price, 100)
+            elif x < 0.7 and ref[price] > 100:
+                tree.sub_qty(price, 100)
+            elif x < 0.85:
+                tree.pop(price)
+            elif x < 0.95:
+                del tree[price]
+            else:
+                tree.pop_range(price, price + 5)
+        if price not in ref:
+            ref[price] = 100
+        elif x < 0.4:
+            ref[price] += 100
+        elif x < 0.7 and ref[price] > 100:
+            ref[price] -= 100
+        elif x < 0.95:
+            del ref[price]
+        else:
+            ref = {p: q for p, q in ref.items() if not price <= p <= price + 5}
+    acc = list(accumulate(ref.get(p, 0) for p in range(price_lo, price_hi + 1)))
+    for tree in trees:
+        assert tree.psum is not None and [tree.psum.prefix(i) for i in range(len(acc))] == acc, \
+            f'{type(tree).__name__} prefix sum NG'
+        tree[price_hi + 1] = level_node(price_hi + 1, 100, 0)
+        assert not tree.prefix_sum_ready(), f'{type(tree).__name__} prefix sum out of band NG'
+    print(f'TEST_level_tree: {n} ops, {len(ref)} levels OK')
+
+
+@timeit
+def TEST_call_match_prefix_sum(seed=3, kind='mb'):
+    '''
+    集合竞价虚拟撮合：SORTED/DENSE价格档的前缀和二分查找与逐档撮合结果一致，
+    且两种价格档容器的重建快照一致
+    '''
+    msgs, SecurityID_list = sim_day(seed, kind)
+    ref = None
+    for level_tree_type in (LEVEL_TREE_TYPE.SORTED, LEVEL_TREE_TYPE.DENSE):
+        mu = MU(SecurityID_list, SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK, level_tree_type=level_tree_type)
+        snaps = []
+        mu.set_snap_sink(lambda snap: snaps.append(str(snap)))
+        matched = 0
+        for msg in msgs:
+            mu.onMsg(msg)
+            axob = mu.axobs.get(msg.SecurityID)
+            if (
+                axob is None
+                or axob.TradingPhaseMarket not in (TPM.OpenCall, TPM.CloseCall)
+                or axob.bid_cage_upper_ex_min_level_qty
+                or axob.ask_cage_lower_ex_max_level_qty
+                or not axob.bid_level_tree.prefix_sum_ready()
+                or not axob.ask_level_tree.prefix_sum_ready()
+            ):
+                continue
+            walk = axob._callMatchWalk()
+            fast = axob._callMatchPrefixSum()
+            assert walk[1] == fast[1] and (walk[1] == 0 or walk == fast), \
+                f'{msg.SecurityID:06d} {level_tree_type.name} call match walk={walk} prefix_sum={fast} NG'
+            matched += walk[1] > 0
+        assert matched, f'{level_tree_type.name} no call match compared'
+        if ref is None:
+            ref = snaps
+        assert snaps == ref, f'{level_tree_type.name} snaps NG'
+        print(f'TEST_call_match_prefix_sum: {level_tree_type.name} {matched} call matches OK')
+
+
+@timeit
+def TEST_order_store_replay(order_store_type=ORDER_STORE_TYPE.ARRAY, level_queue=False, seed=3, kind='mix'):
+    '''
+    整日回放：各订单容器(ARRAY/CHANNEL，可带委托队列)的重建快照及收盘时的订单簿与DICT一致
+    '''
+    msgs, SecurityID_list = sim_day(seed, kind)
+    ref_mu = MU(SecurityID_list, SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK, order_store_type=ORDER_STORE_TYPE.DICT)
+    ref = run_snaps(ref_mu, msgs)
+
+    mu = MU(SecurityID_list, SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK,
+            order_store_type=order_store_type, level_queue=level_queue)
+    snaps = run_snaps(mu, msgs)
+    assert snaps == ref, f'{order_store_type} level_queue={level_queue} snaps NG'
+    state, ref_state = book_state(mu), book_state(ref_mu)
+    for SecurityID in state:
+        for attr in ('order_store_type', 'level_queue'):    # 仅这两个配置项不同
+            state[SecurityID][3].pop(attr)
+            ref_state[SecurityID][3].pop(attr)
+    assert state == ref_state, f'{order_store_type} level_queue={level_queue} book NG'
+    print(f'TEST_order_store_replay: {order_store_type} level_queue={level_queue} {len(ref)} snaps OK')
+
+
+@timeit
+def TEST_mu_batch(seed=3, kind='mix'):
+    '''
+    整日回放：逐笔按段打包走MU.onBatch，快照行情逐条走onMsg；重建快照、交易阶段及收盘订单簿与逐条处理一致
+    '''
+    msgs, SecurityID_list = sim_day(seed, kind)
+    ref_mu = MU(SecurityID_list, SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK)
+    ref = run_snaps(ref_mu, msgs)
+
+    mu = MU(SecurityID_list, SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK)
+    snaps = []
+    mu.set_snap_sink(lambda snap: snaps.append(str(snap)))
+    run = []
+    for msg in msgs + [None]:
+        if isinstance(msg, (axsbe_order, axsbe_exe)):
+            run.append(msg)
+            continue
+        if run:
+            mu.onBatch(msgs_to_batch(run))
+            run = []
+        if msg is not None:
+            mu.onMsg(msg)
+    assert snaps == ref, 'batch snaps NG'
+    assert book_state(mu) == book_state(ref_mu), 'batch book NG'
+    assert {k: c.TPM for k, c in mu.channel_map.items()} == {k: c.TPM for k, c in ref_mu.channel_map.items()}, 'batch TPM NG'
+    assert mu.msg_nb == ref_mu.msg_nb
+    print(f'TEST_mu_batch: {len(ref)} snaps OK')
+
+
+def apply_depth(mirror, updates):
+    '''按seq把depth_update应用到镜像{SecurityID: [seq, bid_bound, ask_bound, {(side, price): qty}]}'''
+    for u in updates:
+        m = mirror.setdefault(u.SecurityID, [0, 0, 0, {}])
+        assert u.full or u.seq == m[0] + 1, f'{u.SecurityID:06d} depth seq={u.seq} after {m[0]} NG'
+        if u.full:
+            m[3] = {}
+        levels = m[3]
+        for side, price, qty in zip(u.sides, u.prices, u.qtys):
+            if qty:
+                levels[(side, price)] = qty
+            else:
+                levels.pop((side, price))
+        m[0], m[1], m[2] = u.seq, u.bid_bound, u.ask_bound
+
+
+def check_depth(mirror, axob, level_nb=20):
+    '''镜像与订单簿的全部价格档一致；去掉笼子外的隐藏档后最优level_nb档与queryLevels一致'''
+    _, bid_bound, ask_bound, levels = mirror[axob.SecurityID]
+    price_out = axob.conv.price_out
+    book = {(SIDE.BID.value, price_out(l.price)): l.qty for l in axob.bid_level_tree.inorder_list_dec()}
+    book.update({(SIDE.ASK.value, price_out(l.price)): l.qty for l in axob.ask_level_tree.inorder_list_inc()})
+    assert levels == book, f'{axob.SecurityID:06d} depth mirror NG'
+    bids = sorted((p for s, p in levels if s == SIDE.BID.value and not (bid_bound and p >= bid_bound)), reverse=True)
+    asks = sorted(p for s, p in levels if s == SIDE.ASK.value and not (ask_bound and p <= ask_bound))
+    for side, prices in ((SIDE.BID, bids), (SIDE.ASK, asks)):
+        n, query_prices, query_qtys = axob.queryLevels(side, level_nb)
+        assert query_prices[:n] == prices[:level_nb], f'{axob.SecurityID:06d} {side} visible depth NG'
+        assert query_qtys[:n] == [levels[(side.value, p)] for p in prices[:level_nb]]
+
+
+@timeit
+def TEST_depth_mirror(seed=3, kind='mix'):
+    '''
+    全档发布：按depth_update维护的镜像在每条消息后与订单簿一致(含笼子外隐藏档的边界)；
+    中途从检查点恢复后以整簿重新开始
+    '''
+    msgs, SecurityID_list = sim_day(seed, kind)
+    cut = len(msgs) // 2
+    mu = MU(SecurityID_list, SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK, full_depth=True)
+    mirror = {}
+    restarted = set(SecurityID_list)
+    updates = 0
+    for i, msg in enumerate(msgs):
+        if i == cut:
+            buf = mu.checkpoint()
+            mu = MU.__new__(MU)
+            mu.restore(buf)
+            restarted = set()
+        mu.onMsg(msg)
+        axob = mu.axobs.get(msg.SecurityID)
+        if axob is None:
+            continue
+        depth = mu.fetchDepth(msg.SecurityID)
+        if msg.SecurityID not in restarted and depth:
+            assert depth[0].full, f'{msg.SecurityID:06d} depth after restore not full NG'
+            restarted.add(msg.SecurityID)
+        apply_depth(mirror, depth)
+        updates += len(depth)
+        check_depth(mirror, axob)
+    print(f'TEST_depth_mirror: {updates} depth updates OK')
+
+
+def sim_channels(days=((1, 'mb'), (1, 'gem_nl'), (4, 'mb'), (3, 'mix')), n=(100, 500, 500, 60)):
+    '''多个通道的合成行情：第j个sim_day的证券代码加10*j、通道号加j，按时间归并'''
+    streams = []
+    SecurityID_list = []
+    for j, (seed, kind) in enumerate(days):
+        msgs, ids = sim_day(seed, kind, n)
+        for msg in msgs:
+            msg.SecurityID += 10 * j
+            msg.ChannelNo += j
+        streams.append(msgs)
+        SecurityID_list += [x + 10 * j for x in ids]
+    return list(heapq.merge(*streams, key=lambda msg: msg.TransactTime)), SecurityID_list
+
+
+RAW_ORDER_FIELDS = ('MsgType', 'SecurityIDSource', 'SecurityID', 'ChannelNo', 'ApplSeqNum',
+                    'Price', 'OrderQty', 'Side', 'OrdType', 'TransactTime')
+RAW_EXE_FIELDS = ('MsgType', 'SecurityIDSource', 'SecurityID', 'ChannelNo', 'ApplSeqNum',
+                  'BidApplSeqNum', 'OfferApplSeqNum', 'LastPx', 'LastQty', 'ExecType', 'TransactTime')
+
+
+def raw_line(msg):
+    '''深交所逐笔转为axsbe_file的消息行，其它消息原样'''
+    if isinstance(msg, axsbe_order):
+        fields = RAW_ORDER_FIELDS
+    elif isinstance(msg, axsbe_exe):
+        fields = RAW_EXE_FIELDS
+    else:
+        return msg
+    return '//' + ' '.join(f'{k}={getattr(msg, k)}' for k in fields)
+
+
+@timeit
+def TEST_shard_runner(shard_nbs=(1, 2, 3)):
+    '''
+    按通道分片的多进程MU：重建快照的内容及顺序与单个MU一致，输入为原始行时亦同；
+    按前一日统计的分片计划运行(含计划外的标的)，结束时各分片的订单簿与单个MU一致
+    '''
+    msgs, SecurityID_list = sim_channels()
+    mu = MU(SecurityID_list, SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK)
+    ref = run_snaps(mu, msgs)
+    ref_state = book_state(mu)
+
+    for shard_nb in shard_nbs:
+        runner = shard_runner(SecurityID_list, SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK,
+                              shard_nb=shard_nb, batch_size=256)
+        assert [str(snap) for snap in runner.run(msgs)] == ref, f'{shard_nb} shards snaps NG'
+    raw = [raw_line(msg) for msg in msgs]  # 逐笔为原始行，由工作进程解码
+    assert [str(snap) for snap in runner.run(raw)] == ref, 'raw lines snaps NG'
+
+    stats = scan_day(msgs, SecurityIDSource_SZSE)
+    plan = plan_shards({k: v.save() for k, v in stats.items()}, 3, SecurityID_list[:-1])
+    runner = shard_runner(SecurityID_list, SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK, plan=plan.save())
+    assert [str(snap) for snap in runner.run(msgs, return_state=True)] == ref, 'planned shards snaps NG'
+    state = {}
+    for k, shard_mu in enumerate(runner.mus):
+        shard_state = book_state(shard_mu)
+        for SecurityID in plan.shard_SecurityIDs[k]:
+            state[SecurityID] = shard_state[SecurityID]
+    assert state == {k: ref_state[k] for k in SecurityID_list[:-1]}, 'planned shards book NG'
+    print(f'TEST_shard_runner: {len(msgs)} msgs, {len(ref)} snaps, shards={shard_nbs}\n{plan}')
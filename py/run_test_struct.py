@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import behave.test.test_struct as struct
+
+if not os.path.exists("log"):
+    os.makedirs("log")
+
+if __name__== '__main__':
+    myname = os.path.split(__file__)[1][:-3]
+
+    logger = logging.getLogger('main')
+    logger.setLevel(logging.WARNING)
+    fh = logging.FileHandler(f'log/{myname}.log', mode='w')    # 合成行情的快照不含价格档，比对失败的告警记入日志
+    fh.setFormatter(logging.Formatter('%(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(fh)
+
+    struct.TEST_mu_load_old_save()
+    for order_store_type in struct.ORDER_STORE_TYPE:
+        struct.TEST_mu_ckpt_delta(order_store_type)
+    struct.TEST_order_store()
+    struct.TEST_level_tree()
+    struct.TEST_call_match_prefix_sum()
+    for level_queue in (False, True):
+        struct.TEST_order_store_replay(struct.ORDER_STORE_TYPE.ARRAY, level_queue)
+    struct.TEST_order_store_replay(struct.ORDER_STORE_TYPE.CHANNEL)
+    struct.TEST_mu_batch()
+    for order_store_type in struct.ORDER_STORE_TYPE:
+        struct.TEST_axob_late_exec(order_store_type)
+    struct.TEST_depth_mirror()
+    struct.TEST_shard_runner()
+    for order_store_type, level_queue in [
+        (struct.ORDER_STORE_TYPE.ARRAY, True),
+        (struct.ORDER_STORE_TYPE.ARRAY, False),
+        (struct.ORDER_STORE_TYPE.DICT, False),
+        (struct.ORDER_STORE_TYPE.CHANNEL, False),
+    ]:
+        struct.TEST_axob_close_call_range(order_store_type, level_queue)
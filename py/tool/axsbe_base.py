@@ -120,6 +120,25 @@ class TPM():
     def str(tpm):
         return TPM.TPM_str[tpm]
 
+    def at(HHMMSSms):
+        '''逐笔时戳(日内，ms)所在的市场交易阶段'''
+        if HHMMSSms < 91500000:
+            return TPM.Starting
+        elif HHMMSSms < 92500000: #逐笔委托的时戳不会等于925；只有逐笔成交会；而925的逐笔成交代表着开盘集合竞价结束。收盘集合竞价同理。
+            return TPM.OpenCall
+        elif HHMMSSms < 93000000:
+            return TPM.PreTradingBreaking
+        elif HHMMSSms < 113000000:
+            return TPM.AMTrading
+        elif HHMMSSms < 130000000:
+            return TPM.Breaking
+        elif HHMMSSms < 145700000:
+            return TPM.PMTrading
+        elif HHMMSSms < 150000000:
+            return TPM.CloseCall
+        else:
+            return TPM.Ending
+
 class TPI():
     # TradingPhase of Instrument，标的交易状态内部编码
     Normal = 0   #深圳/上海的原始值中，Normal和NoTrade是互相颠倒的；这里是深圳的值；上海1=Normal,0=NoTrade。
@@ -241,22 +260,7 @@ class axsbe_base(metaclass=abc.ABCMeta):
         t = self.HHMMSSms
         if t is None:
             return TPM.Starting
-        if t < 91500000:
-            return TPM.Starting
-        elif t < 92500000: #逐笔委托的时戳不会等于925；只有逐笔成交会；而925的逐笔成交代表着开盘集合竞价结束。收盘集合竞价同理。
-            return TPM.OpenCall
-        elif t < 93000000:
-            return TPM.PreTradingBreaking
-        elif t < 113000000:
-            return TPM.AMTrading
-        elif t < 130000000:
-            return TPM.Breaking
-        elif t < 145700000:
-            return TPM.PMTrading
-        elif t < 150000000:
-            return TPM.CloseCall
-        else:
-            return TPM.Ending
+        return TPM.at(t)
 
     @property
     def TradingPhase_str(self):
@@ -2,8 +2,19 @@
 
 import tool.axsbe_base as axsbe_base
 from tool.axsbe_base import TPM, TPI, TPC2, TPC3
+from array import array
 import struct
 
+SNAP_LEVEL_NB = 10  # 快照单边价格档数
+BID_LEVELS_BASE = 0  # levels中买方档位的起始下标
+ASK_LEVELS_BASE = SNAP_LEVEL_NB * 2  # levels中卖方档位的起始下标
+EMPTY_LEVELS = array('q', [0] * SNAP_LEVEL_NB * 4)
+
+# 字节流格式，档位按(Price,Qty)交错，与levels的存储顺序一致
+SZSE_SNAP_STRUCT = struct.Struct("<BBH9sHQB" + "qqqiiiiiiqiqii" + "iq" * SNAP_LEVEL_NB * 2 + "Qi")
+SSE_SNAP_STOCK_STRUCT = struct.Struct("<BBH9sHQB" + "Iqq" + "i" + "iiiiiqiq" + "I" + "iq" * SNAP_LEVEL_NB * 2 + "B3B")
+SSE_SNAP_BOND_STRUCT = struct.Struct("<BBH9sHQB" + "Iqq" + "iiiiiqiq" + "I" + "iq" * SNAP_LEVEL_NB * 2)
+
 class price_level:
     '''价格档位'''
     __slots__ = [
@@ -54,6 +65,49 @@ class price_level:
             setattr(self, attr, data[attr])
 
 
+class snap_levels:
+    '''
+    快照单边价格档的视图，接口同dict{档位:price_level}(下标/len/迭代/items)
+    数据存于快照的levels数组，读取时构造price_level，写入时拷贝Price/Qty
+    '''
+    __slots__ = ['levels', 'base']
+
+    def __init__(self, levels, base):
+        self.levels = levels
+        self.base = base
+
+    def __len__(self):
+        return SNAP_LEVEL_NB
+
+    def __iter__(self):
+        return iter(range(SNAP_LEVEL_NB))
+
+    def __contains__(self, i):
+        return 0 <= i < SNAP_LEVEL_NB
+
+    def __getitem__(self, i):
+        if not 0 <= i < SNAP_LEVEL_NB:
+            raise KeyError(i)
+        j = self.base + i * 2
+        return price_level(self.levels[j], self.levels[j + 1])
+
+    def __setitem__(self, i, level):
+        if not 0 <= i < SNAP_LEVEL_NB:
+            raise KeyError(i)
+        j = self.base + i * 2
+        self.levels[j] = level.Price
+        self.levels[j + 1] = level.Qty
+
+    def keys(self):
+        return range(SNAP_LEVEL_NB)
+
+    def values(self):
+        return [self[i] for i in range(SNAP_LEVEL_NB)]
+
+    def items(self):
+        return [(i, self[i]) for i in range(SNAP_LEVEL_NB)]
+
+
 class axsbe_snap_stock(axsbe_base.axsbe_base):
     __slots__ = [
         'SecurityIDSource',
@@ -79,8 +133,7 @@ class axsbe_snap_stock(axsbe_base.axsbe_base):
         'AskWeightSize',            #SH-BOND.TotalOfferQty
         'UpLimitPx',                #SZ
         'DnLimitPx',                #SZ
-        'bid',
-        'ask',
+        'levels',                   #买卖各SNAP_LEVEL_NB档，按(Price,Qty)交错存放，买方在前；通过bid/ask访问
 
         'TradingPhaseCodePack',     #SH-STOCK
 
@@ -109,8 +162,7 @@ class axsbe_snap_stock(axsbe_base.axsbe_base):
         self.UpLimitPx = 0
         self.DnLimitPx = 0
 
-        self.bid = dict(zip(range(0, 10), [price_level(0, 0)] * 10))
-        self.ask = dict(zip(range(0, 10), [price_level(0, 0)] * 10))
+        self.levels = EMPTY_LEVELS[:]
 
         self.TradingPhaseCodePack = 0
 
@@ -120,6 +172,38 @@ class axsbe_snap_stock(axsbe_base.axsbe_base):
         self._source = source
 
 
+    @property
+    def bid(self):
+        return snap_levels(self.levels, BID_LEVELS_BASE)
+
+    @bid.setter
+    def bid(self, levels):
+        '''levels: {档位:price_level}，缺少的档位填0'''
+        self._set_levels(BID_LEVELS_BASE, levels)
+
+    @property
+    def ask(self):
+        return snap_levels(self.levels, ASK_LEVELS_BASE)
+
+    @ask.setter
+    def ask(self, levels):
+        self._set_levels(ASK_LEVELS_BASE, levels)
+
+    def set_levels(self, bid, ask):
+        '''bid/ask: 单边档位序列，按(Price,Qty)交错，长度SNAP_LEVEL_NB*2'''
+        levels = array('q', bid)
+        levels.extend(ask)
+        self.levels = levels
+
+    def _set_levels(self, base, levels):
+        for i in range(SNAP_LEVEL_NB):
+            if i in levels:
+                self.levels[base + i * 2] = levels[i].Price
+                self.levels[base + i * 2 + 1] = levels[i].Qty
+            else:
+                self.levels[base + i * 2] = 0
+                self.levels[base + i * 2 + 1] = 0
+
     def load_dict(self, dict:dict):
         '''从字典加载字段'''
         #公共头
@@ -179,64 +263,41 @@ class axsbe_snap_stock(axsbe_base.axsbe_base):
         else:
             raise Exception(f'Not support SecurityIDSource={self.SecurityIDSource}')
 
+    def _same_key(self):
+        '''is_same比较的标量字段；不比较时戳，AskWeightPx单独比较'''
+        return (
+            self.MsgType,
+            self.SecurityIDSource,
+            self.ChannelNo,
+            self.TradingPhaseCode,   ## AXOB能构造出TPCode吗
+            self.SecurityID,
+            self.NumTrades,
+            self.TotalVolumeTrade,
+            self.TotalValueTrade,
+            self.PrevClosePx,
+            self.LastPx,
+            self.OpenPx,
+            self.HighPx,
+            self.LowPx,
+            self.BidWeightPx,
+            self.BidWeightSize,
+            self.AskWeightSize,
+            self.UpLimitPx,
+            self.DnLimitPx,
+        )
+
     def is_same(self, another):
+        '''用于比较模拟撮合和历史数据是否一致'''
         if not isinstance(another, axsbe_snap_stock):
             return False
-        '''用于比较模拟撮合和历史数据是否一致'''
-        MsgType_isSame = self.MsgType == another.MsgType
-        SecurityIDSource_isSame = self.SecurityIDSource == another.SecurityIDSource
-        ChannelNo_isSame = self.ChannelNo == another.ChannelNo
-        TradingPhaseCode_isSame = self.TradingPhaseCode == another.TradingPhaseCode   ## AXOB能构造出TPCode吗
-        SecurityID_isSame = self.SecurityID == another.SecurityID
-        NumTrades_isSame = self.NumTrades == another.NumTrades
-        TotalVolumeTrade_isSame = self.TotalVolumeTrade == another.TotalVolumeTrade
-        TotalValueTrade_isSame = self.TotalValueTrade == another.TotalValueTrade
-        PrevClosePx_isSame = self.PrevClosePx == another.PrevClosePx
-        LastPx_isSame = self.LastPx == another.LastPx
-        OpenPx_isSame = self.OpenPx == another.OpenPx
-        HighPx_isSame = self.HighPx == another.HighPx
-        LowPx_isSame = self.LowPx == another.LowPx
-        BidWeightPx_isSame = self.BidWeightPx == another.BidWeightPx
-        BidWeightSize_isSame = self.BidWeightSize == another.BidWeightSize
-        AskWeightPx_isSame = self.AskWeightPx == another.AskWeightPx if not self.AskWeightPx_uncertain and not another.AskWeightPx_uncertain else True  #任意一方加权价无法确定，则跳过
-        AskWeightSize_isSame = self.AskWeightSize == another.AskWeightSize
-        UpLimitPx_isSame = self.UpLimitPx == another.UpLimitPx
-        DnLimitPx_isSame = self.DnLimitPx == another.DnLimitPx
-        bid_isSame = True
-        for i in range(10):
-            if self.bid[i] != another.bid[i]:
-                bid_isSame = False
-                
-        ask_isSame = True
-        for i in range(10):
-            if self.ask[i] != another.ask[i]:
-                ask_isSame = False
-
-        # TransactTime_isSame = self.TransactTime == another.TransactTime   ## 不关心时戳是否一致
-
-        if  MsgType_isSame \
-            and SecurityIDSource_isSame \
-            and ChannelNo_isSame \
-            and TradingPhaseCode_isSame \
-            and PrevClosePx_isSame \
-            and SecurityID_isSame \
-            and NumTrades_isSame \
-            and TotalVolumeTrade_isSame \
-            and TotalValueTrade_isSame \
-            and LastPx_isSame \
-            and OpenPx_isSame \
-            and HighPx_isSame \
-            and LowPx_isSame \
-            and BidWeightPx_isSame \
-            and BidWeightSize_isSame \
-            and AskWeightPx_isSame \
-            and AskWeightSize_isSame \
-            and UpLimitPx_isSame \
-            and DnLimitPx_isSame \
-            and bid_isSame \
-            and ask_isSame :
-            return True
-        return False
+        if self.levels != another.levels or self._same_key() != another._same_key():
+            return False
+        # 任意一方加权价无法确定，则跳过
+        return (
+            self.AskWeightPx == another.AskWeightPx
+            or self.AskWeightPx_uncertain
+            or another.AskWeightPx_uncertain
+        )
 
     def is_like(self, another):
         '''10档一致，时戳接近；加权价格不一定一致，用于有丢包时比较'''
@@ -259,15 +320,7 @@ class axsbe_snap_stock(axsbe_base.axsbe_base):
         AskWeightSize_isSame = self.AskWeightSize == another.AskWeightSize
         UpLimitPx_isSame = self.UpLimitPx == another.UpLimitPx
         DnLimitPx_isSame = self.DnLimitPx == another.DnLimitPx
-        bid_isSame = True
-        for i in range(10):
-            if self.bid[i] != another.bid[i]:
-                bid_isSame = False
-                
-        ask_isSame = True
-        for i in range(10):
-            if self.ask[i] != another.ask[i]:
-                ask_isSame = False
+        levels_isSame = self.levels == another.levels
 
         # TransactTime_isSame = self.TransactTime == another.TransactTime
         ms_isSame = abs(self.ms, another.ms) < 500
@@ -289,8 +342,7 @@ class axsbe_snap_stock(axsbe_base.axsbe_base):
             and LowPx_isSame \
             and UpLimitPx_isSame \
             and DnLimitPx_isSame \
-            and bid_isSame \
-            and ask_isSame \
+            and levels_isSame \
             and ms_isSame:
             return True
         return False
@@ -535,204 +587,71 @@ class axsbe_snap_stock(axsbe_base.axsbe_base):
     @property
     def bytes_stream(self):
         '''将字段打包成字节流'''
+        SecurityID = ("%06u  "%self.SecurityID).encode('UTF-8')
         if self.SecurityIDSource == axsbe_base.SecurityIDSource_SZSE:
-            #SecurityIDSource=102
-            bin = struct.pack("<B", axsbe_base.SecurityIDSource_SZSE)
-            #MsgType=111
-            bin += struct.pack("<B", self.MsgType)
-            #MsgLen=352
-            bin += struct.pack("<H", 352)
-            #SecurityID=000997
-            bin += struct.pack("<9s", ("%06u  "%self.SecurityID).encode('UTF-8'))
-            #ChannelNo=1013
-            bin += struct.pack("<H", self.ChannelNo)
-            #ApplSeqNum=0
-            bin += struct.pack("<Q", 0)
-            #TradingPhase=83
-            bin += struct.pack("<B", self.TradingPhaseCode)
-            #NumTrades=0
-            bin += struct.pack("<q", self.NumTrades)
-            #TotalVolumeTrade=0
-            bin += struct.pack("<q", self.TotalVolumeTrade)
-            #TotalValueTrade=0
-            bin += struct.pack("<q", self.TotalValueTrade)
-            #PrevClosePx=184000
-            bin += struct.pack("<i", self.PrevClosePx)
-            #LastPx=0
-            bin += struct.pack("<i", self.LastPx)
-            #OpenPx=0
-            bin += struct.pack("<i", self.OpenPx)
-            #HighPx=0
-            bin += struct.pack("<i", self.HighPx)
-            #LowPx=0
-            bin += struct.pack("<i", self.LowPx)
-            #BidWeightPx=0
-            bin += struct.pack("<i", self.BidWeightPx)
-            #BidWeightSize=0
-            bin += struct.pack("<q", self.BidWeightSize)
-            #AskWeightPx=0
-            bin += struct.pack("<i", self.AskWeightPx)
-            #AskWeightSize=0
-            bin += struct.pack("<q", self.AskWeightSize)
-            #UpLimitPx=20240000
-            bin += struct.pack("<i", self.UpLimitPx)
-            #DnLimitPx=16560000
-            bin += struct.pack("<i", self.DnLimitPx)
-            #BidLevel[0].Price=0
-            #BidLevel[0].Qty=0
-            for i in range(10):
-                bin += struct.pack("<i", self.bid[i].Price)
-                bin += struct.pack("<q", self.bid[i].Qty)
-
-            #BidLevel[1].Price=0
-            #BidLevel[1].Qty=0
-            #BidLevel[2].Price=0
-            #BidLevel[2].Qty=0
-            #BidLevel[3].Price=0
-            #BidLevel[3].Qty=0
-            #BidLevel[4].Price=0
-            #BidLevel[4].Qty=0
-            #BidLevel[5].Price=0
-            #BidLevel[5].Qty=0
-            #BidLevel[6].Price=0
-            #BidLevel[6].Qty=0
-            #BidLevel[7].Price=0
-            #BidLevel[7].Qty=0
-            #BidLevel[8].Price=0
-            #BidLevel[8].Qty=0
-            #BidLevel[9].Price=0
-            #BidLevel[9].Qty=0
-            #AskLevel[0].Price=0
-            #AskLevel[0].Qty=0
-            for i in range(10):
-                bin += struct.pack("<i", self.ask[i].Price)
-                bin += struct.pack("<q", self.ask[i].Qty)
-            #AskLevel[1].Price=0
-            #AskLevel[1].Qty=0
-            #AskLevel[2].Price=0
-            #AskLevel[2].Qty=0
-            #AskLevel[3].Price=0
-            #AskLevel[3].Qty=0
-            #AskLevel[4].Price=0
-            #AskLevel[4].Qty=0
-            #AskLevel[5].Price=0
-            #AskLevel[5].Qty=0
-            #AskLevel[6].Price=0
-            #AskLevel[6].Qty=0
-            #AskLevel[7].Price=0
-            #AskLevel[7].Qty=0
-            #AskLevel[8].Price=0
-            #AskLevel[8].Qty=0
-            #AskLevel[9].Price=0
-            #AskLevel[9].Qty=0
-            #TransactTime=20190311083500000
-            bin += struct.pack("<Q", self.TransactTime)
-            #resv=
-            bin += struct.pack("<i", 0)
+            #公共头：SecurityIDSource, MsgType, MsgLen=352, SecurityID, ChannelNo, ApplSeqNum=0, TradingPhase
+            return SZSE_SNAP_STRUCT.pack(
+                axsbe_base.SecurityIDSource_SZSE, self.MsgType, 352, SecurityID, self.ChannelNo, 0, self.TradingPhaseCode,
+                self.NumTrades,
+                self.TotalVolumeTrade,
+                self.TotalValueTrade,
+                self.PrevClosePx,
+                self.LastPx,
+                self.OpenPx,
+                self.HighPx,
+                self.LowPx,
+                self.BidWeightPx,
+                self.BidWeightSize,
+                self.AskWeightPx,
+                self.AskWeightSize,
+                self.UpLimitPx,
+                self.DnLimitPx,
+                *self.levels,       #BidLevel[0..9], AskLevel[0..9]
+                self.TransactTime,
+                0,                  #resv
+            )
         elif self.SecurityIDSource == axsbe_base.SecurityIDSource_SSE:
-            #SecurityIDSource=102
-            bin = struct.pack("<B", axsbe_base.SecurityIDSource_SSE)
-            #MsgType=111
-            bin += struct.pack("<B", self.MsgType)
-
             if self.MsgType==axsbe_base.MsgType_snap_stock:
                 #MsgLen=336
-                bin += struct.pack("<H", 336)
-            elif self.MsgType==axsbe_base.MsgType_snap_sse_bond:
+                return SSE_SNAP_STOCK_STRUCT.pack(
+                    axsbe_base.SecurityIDSource_SSE, self.MsgType, 336, SecurityID, self.ChannelNo, 0, self.TradingPhaseCode,
+                    self.NumTrades,
+                    self.TotalVolumeTrade,
+                    self.TotalValueTrade,
+                    self.PrevClosePx,
+                    self.LastPx,
+                    self.OpenPx,
+                    self.HighPx,
+                    self.LowPx,
+                    self.BidWeightPx,
+                    self.BidWeightSize,
+                    self.AskWeightPx,
+                    self.AskWeightSize,
+                    self.TransactTime,  #DataTimeStamp
+                    *self.levels,       #BidLevel[0..9], AskLevel[0..9]
+                    self.TradingPhaseCodePack,
+                    0, 0, 0,            #resv
+                )
+            else:
                 #MsgLen=328
-                bin += struct.pack("<H", 328)
-
-            #SecurityID=000997
-            bin += struct.pack("<9s", ("%06u  "%self.SecurityID).encode('UTF-8'))
-            #ChannelNo=1013
-            bin += struct.pack("<H", self.ChannelNo)
-            #ApplSeqNum=0
-            bin += struct.pack("<Q", 0)
-            #TradingPhase=83
-            bin += struct.pack("<B", self.TradingPhaseCode)
-            #NumTrades=0
-            bin += struct.pack("<I", self.NumTrades)
-            #TotalVolumeTrade=0
-            bin += struct.pack("<q", self.TotalVolumeTrade)
-            #TotalValueTrade=0
-            bin += struct.pack("<q", self.TotalValueTrade)
-            if self.MsgType==axsbe_base.MsgType_snap_stock:
-                #PrevClosePx=184000
-                bin += struct.pack("<i", self.PrevClosePx)
-            #LastPx=0
-            bin += struct.pack("<i", self.LastPx)
-            #OpenPx=0
-            bin += struct.pack("<i", self.OpenPx)
-            #HighPx=0
-            bin += struct.pack("<i", self.HighPx)
-            #LowPx=0
-            bin += struct.pack("<i", self.LowPx)
-            #BidWeightPx=0
-            bin += struct.pack("<i", self.BidWeightPx)
-            #BidWeightSize=0
-            bin += struct.pack("<q", self.BidWeightSize)
-            #AskWeightPx=0
-            bin += struct.pack("<i", self.AskWeightPx)
-            #AskWeightSize=0
-            bin += struct.pack("<q", self.AskWeightSize)
-            #DataTimeStamp=92501
-            bin += struct.pack("<I", self.TransactTime)
-            #BidLevel[0].Price=0
-            #BidLevel[0].Qty=0
-            for i in range(10):
-                bin += struct.pack("<i", self.bid[i].Price)
-                bin += struct.pack("<q", self.bid[i].Qty)
-
-            #BidLevel[1].Price=0
-            #BidLevel[1].Qty=0
-            #BidLevel[2].Price=0
-            #BidLevel[2].Qty=0
-            #BidLevel[3].Price=0
-            #BidLevel[3].Qty=0
-            #BidLevel[4].Price=0
-            #BidLevel[4].Qty=0
-            #BidLevel[5].Price=0
-            #BidLevel[5].Qty=0
-            #BidLevel[6].Price=0
-            #BidLevel[6].Qty=0
-            #BidLevel[7].Price=0
-            #BidLevel[7].Qty=0
-            #BidLevel[8].Price=0
-            #BidLevel[8].Qty=0
-            #BidLevel[9].Price=0
-            #BidLevel[9].Qty=0
-            #AskLevel[0].Price=0
-            #AskLevel[0].Qty=0
-            for i in range(10):
-                bin += struct.pack("<i", self.ask[i].Price)
-                bin += struct.pack("<q", self.ask[i].Qty)
-            #AskLevel[1].Price=0
-            #AskLevel[1].Qty=0
-            #AskLevel[2].Price=0
-            #AskLevel[2].Qty=0
-            #AskLevel[3].Price=0
-            #AskLevel[3].Qty=0
-            #AskLevel[4].Price=0
-            #AskLevel[4].Qty=0
-            #AskLevel[5].Price=0
-            #AskLevel[5].Qty=0
-            #AskLevel[6].Price=0
-            #AskLevel[6].Qty=0
-            #AskLevel[7].Price=0
-            #AskLevel[7].Qty=0
-            #AskLevel[8].Price=0
-            #AskLevel[8].Qty=0
-            #AskLevel[9].Price=0
-            #AskLevel[9].Qty=0
-
-            if self.MsgType==axsbe_base.MsgType_snap_stock:
-                #TradingPhaseCodePack=69
-                bin += struct.pack("<B", self.TradingPhaseCodePack)
-                #resv=
-                bin += struct.pack("<3B", 0, 0 ,0)
+                return SSE_SNAP_BOND_STRUCT.pack(
+                    axsbe_base.SecurityIDSource_SSE, self.MsgType, 328, SecurityID, self.ChannelNo, 0, self.TradingPhaseCode,
+                    self.NumTrades,
+                    self.TotalVolumeTrade,
+                    self.TotalValueTrade,
+                    self.LastPx,
+                    self.OpenPx,
+                    self.HighPx,
+                    self.LowPx,
+                    self.BidWeightPx,
+                    self.BidWeightSize,
+                    self.AskWeightPx,
+                    self.AskWeightSize,
+                    self.TransactTime,  #DataTimeStamp
+                    *self.levels,       #BidLevel[0..9], AskLevel[0..9]
+                )
         else:
             raise Exception(f'Not support SecurityIDSource={self.SecurityIDSource}')
-        return bin
 
 
     def unpack_stream(self, bytes_i:bytes):
@@ -740,16 +659,11 @@ class axsbe_snap_stock(axsbe_base.axsbe_base):
         #公共头
         self.SecurityIDSource, self.MsgType, _, self.SecurityID, self.ChannelNo, _, self.TradingPhaseCode = struct.unpack("<BBH9sHQB", bytes_i[:24])
         self.SecurityID = int(self.SecurityID[:6])
+        levels_nb = SNAP_LEVEL_NB * 4
         #消息体
         if self.SecurityIDSource == axsbe_base.SecurityIDSource_SZSE:
-            unpack_token = "<qqqiiiiiiqiqii"
-            for i in range(10):
-                unpack_token += "iq"
-                self.ask[i] = price_level(0,0)
-            for i in range(10):
-                unpack_token += "iq"
-                self.bid[i] = price_level(0,0)
-            unpack_token += "Qi"
+            unpack_token = "<qqqiiiiiiqiqii" + "iq" * SNAP_LEVEL_NB * 2 + "Qi"
+            fields = struct.unpack(unpack_token, bytes_i[24:])
             self.NumTrades, \
             self.TotalVolumeTrade, \
             self.TotalValueTrade, \
@@ -763,48 +677,9 @@ class axsbe_snap_stock(axsbe_base.axsbe_base):
             self.AskWeightPx, \
             self.AskWeightSize, \
             self.UpLimitPx, \
-            self.DnLimitPx, \
-            self.bid[0].Price, \
-            self.bid[0].Qty, \
-            self.bid[1].Price, \
-            self.bid[1].Qty, \
-            self.bid[2].Price, \
-            self.bid[2].Qty, \
-            self.bid[3].Price, \
-            self.bid[3].Qty, \
-            self.bid[4].Price, \
-            self.bid[4].Qty, \
-            self.bid[5].Price, \
-            self.bid[5].Qty, \
-            self.bid[6].Price, \
-            self.bid[6].Qty, \
-            self.bid[7].Price, \
-            self.bid[7].Qty, \
-            self.bid[8].Price, \
-            self.bid[8].Qty, \
-            self.bid[9].Price, \
-            self.bid[9].Qty, \
-            self.ask[0].Price, \
-            self.ask[0].Qty, \
-            self.ask[1].Price, \
-            self.ask[1].Qty, \
-            self.ask[2].Price, \
-            self.ask[2].Qty, \
-            self.ask[3].Price, \
-            self.ask[3].Qty, \
-            self.ask[4].Price, \
-            self.ask[4].Qty, \
-            self.ask[5].Price, \
-            self.ask[5].Qty, \
-            self.ask[6].Price, \
-            self.ask[6].Qty, \
-            self.ask[7].Price, \
-            self.ask[7].Qty, \
-            self.ask[8].Price, \
-            self.ask[8].Qty, \
-            self.ask[9].Price, \
-            self.ask[9].Qty, \
-            self.TransactTime, _ =  struct.unpack(unpack_token, bytes_i[24:])
+            self.DnLimitPx = fields[:14]
+            self.levels = array('q', fields[14:14 + levels_nb])
+            self.TransactTime = fields[14 + levels_nb]
         elif self.SecurityIDSource == axsbe_base.SecurityIDSource_SSE:
             self.NumTrades, \
             self.TotalVolumeTrade, \
@@ -815,14 +690,8 @@ class axsbe_snap_stock(axsbe_base.axsbe_base):
                 self.PrevClosePx, =  struct.unpack('<i', bytes_i[44:48])
                 comm_base = 48
 
-            unpack_token = "<iiiiiqiqi"
-            for i in range(10):
-                unpack_token += "iq"
-                self.ask[i] = price_level(0,0)
-            for i in range(10):
-                unpack_token += "iq"
-                self.bid[i] = price_level(0,0)
-
+            unpack_token = "<iiiiiqiqi" + "iq" * SNAP_LEVEL_NB * 2
+            fields = struct.unpack(unpack_token, bytes_i[comm_base:comm_base+284])
             self.LastPx, \
             self.OpenPx, \
             self.HighPx, \
@@ -831,47 +700,8 @@ class axsbe_snap_stock(axsbe_base.axsbe_base):
             self.BidWeightSize, \
             self.AskWeightPx, \
             self.AskWeightSize, \
-            self.TransactTime, \
-            self.bid[0].Price, \
-            self.bid[0].Qty, \
-            self.bid[1].Price, \
-            self.bid[1].Qty, \
-            self.bid[2].Price, \
-            self.bid[2].Qty, \
-            self.bid[3].Price, \
-            self.bid[3].Qty, \
-            self.bid[4].Price, \
-            self.bid[4].Qty, \
-            self.bid[5].Price, \
-            self.bid[5].Qty, \
-            self.bid[6].Price, \
-            self.bid[6].Qty, \
-            self.bid[7].Price, \
-            self.bid[7].Qty, \
-            self.bid[8].Price, \
-            self.bid[8].Qty, \
-            self.bid[9].Price, \
-            self.bid[9].Qty, \
-            self.ask[0].Price, \
-            self.ask[0].Qty, \
-            self.ask[1].Price, \
-            self.ask[1].Qty, \
-            self.ask[2].Price, \
-            self.ask[2].Qty, \
-            self.ask[3].Price, \
-            self.ask[3].Qty, \
-            self.ask[4].Price, \
-            self.ask[4].Qty, \
-            self.ask[5].Price, \
-            self.ask[5].Qty, \
-            self.ask[6].Price, \
-            self.ask[6].Qty, \
-            self.ask[7].Price, \
-            self.ask[7].Qty, \
-            self.ask[8].Price, \
-            self.ask[8].Qty, \
-            self.ask[9].Price, \
-            self.ask[9].Qty =  struct.unpack(unpack_token, bytes_i[comm_base:comm_base+284])
+            self.TransactTime = fields[:9]
+            self.levels = array('q', fields[9:])
 
             if self.MsgType==axsbe_base.MsgType_snap_stock:
                 self.TradingPhaseCodePack, _, _, _ =  struct.unpack('4B', bytes_i[332:])
@@ -985,22 +815,23 @@ class axsbe_snap_stock(axsbe_base.axsbe_base):
         '''save/load 用于保存/加载测试时刻'''
         data = {}
         for attr in self.__slots__:
-            value = getattr(self, attr)
-            if attr == 'bid' or attr == 'ask':
-                data[attr] = {}
-                for i in value:
-                    data[attr][i] = value[i].save()
+            if attr == 'levels':
+                # 保持按档位存price_level的格式
+                data['bid'] = {i: lv.save() for i, lv in self.bid.items()}
+                data['ask'] = {i: lv.save() for i, lv in self.ask.items()}
             else:
-                data[attr] = value
+                data[attr] = getattr(self, attr)
         return data
 
     def load(self, data):
         for attr in self.__slots__:
-            if attr == 'bid' or attr == 'ask':
-                v = {}
-                for i in data[attr]:
-                    v[i] = price_level(-1, -1)
-                    v[i].load(data[attr][i])
-                setattr(self, attr, v)
+            if attr == 'levels':
+                self.levels = EMPTY_LEVELS[:]
+                for side in ('bid', 'ask'):
+                    v = {}
+                    for i in data[side]:
+                        v[i] = price_level(-1, -1)
+                        v[i].load(data[side][i])
+                    setattr(self, side, v)
             else:
                 setattr(self, attr, data[attr])
@@ -11,6 +11,7 @@ import pandas as pd
 import numpy
 from decimal import Decimal
 import os
+import re
 
 #### 交易所 板块子类型
 class MARKET_SUBTYPE(Enum):
@@ -116,6 +117,108 @@ def dict_to_axsbe(s:dict):
         return None
 
 
+#### 批量逐笔：按字段的并列数组
+# 逐笔委托与逐笔成交共用Price/Qty两列（成交即LastPx/LastQty）；委托用Side/OrdType，成交用ExecType及买卖序号
+BATCH_DTYPE = numpy.dtype([
+    ('MsgType',         numpy.uint8),
+    ('SecurityID',      numpy.uint32),
+    ('ChannelNo',       numpy.uint16),
+    ('ApplSeqNum',      numpy.uint64),
+    ('TransactTime',    numpy.uint64),
+    ('Price',           numpy.int64),
+    ('Qty',             numpy.int64),
+    ('Side',            numpy.uint8),
+    ('OrdType',         numpy.uint8),
+    ('ExecType',        numpy.uint8),
+    ('BidApplSeqNum',   numpy.uint64),
+    ('OfferApplSeqNum', numpy.uint64),
+    ('OrderNo',         numpy.uint64),     #SH
+    ('BizIndex',        numpy.uint64),     #SH-STOCK
+    ('TradeMoney',      numpy.int64),      #SH-BOND
+])
+BATCH_FIELDS = BATCH_DTYPE.names
+
+BATCH_FIELD_DEFAULT = {   # dict形式的批次可缺省的列
+    'OrdType': 0,
+    'ExecType': 0,
+    'BidApplSeqNum': 0xffffffffffffffff,
+    'OfferApplSeqNum': 0xffffffffffffffff,
+    'OrderNo': 0,
+    'BizIndex': 0,
+    'TradeMoney': 0,
+}
+
+def msgs_to_batch(msgs):
+    '''将逐笔消息序列打包为numpy结构化数组(BATCH_DTYPE)；快照、状态等其它消息不入批次'''
+    rows = []
+    for msg in msgs:
+        if isinstance(msg, axsbe_order):
+            rows.append((msg.MsgType, msg.SecurityID, msg.ChannelNo, msg.ApplSeqNum, msg.TransactTime,
+                         msg.Price, getattr(msg, 'Qty', msg.OrderQty), msg.Side, msg.OrdType, 0,
+                         0xffffffffffffffff, 0xffffffffffffffff, msg.OrderNo, msg.BizIndex, 0))
+        elif isinstance(msg, axsbe_exe):
+            rows.append((msg.MsgType, msg.SecurityID, msg.ChannelNo, msg.ApplSeqNum, msg.TransactTime,
+                         msg.LastPx, msg.LastQty, 0, 0, msg.ExecType,
+                         msg.BidApplSeqNum, msg.OfferApplSeqNum, 0, msg.BizIndex, msg.TradeMoney))
+    return numpy.array(rows, dtype=BATCH_DTYPE)
+
+def _batch_column(batch, name, n):
+    '''取一列并转为python原生数值，避免numpy标量进入订单簿的算术与保存'''
+    try:
+        col = batch[name]
+    except (KeyError, ValueError):
+        return [BATCH_FIELD_DEFAULT[name]] * n
+    return col.tolist() if hasattr(col, 'tolist') else col
+
+def batch_columns(batch):
+    '''批次转为{字段名: python列表}，缺省列按BATCH_FIELD_DEFAULT补齐；供按行区间多次展开而不重复转换'''
+    n = len(_batch_column(batch, 'MsgType', 0))
+    return {f: _batch_column(batch, f, n) for f in BATCH_FIELDS}
+
+def batch_msgs(batch, SecurityIDSource, start=0, stop=None):
+    '''
+    逐行展开批次：batch为numpy结构化数组(BATCH_DTYPE)或{字段名:列}的字典，列可为list/array/ndarray。
+    每行复用同一个axsbe_order/axsbe_exe对象并清掉其时戳缓存，调用方处理完当前行前不得持有该对象。
+    start/stop: 只展开[start, stop)行；同一批次分段展开时先用batch_columns转换一次
+    '''
+    MsgType = _batch_column(batch, 'MsgType', 0)
+    n = len(MsgType) if stop is None else stop
+    (SecurityID, ChannelNo, ApplSeqNum, TransactTime, Price, Qty, Side, OrdType, ExecType,
+     BidApplSeqNum, OfferApplSeqNum, OrderNo, BizIndex, TradeMoney) = [_batch_column(batch, f, n) for f in BATCH_FIELDS[1:]]
+
+    order = axsbe_order(SecurityIDSource)
+    exe = axsbe_exe(SecurityIDSource)
+    order_types = frozenset(axsbe_base.MsgTypes_order)
+    exe_types = frozenset(axsbe_base.MsgTypes_exe)
+    for i in range(start, n):
+        t = MsgType[i]
+        if t in order_types:
+            msg = order
+            msg.Price = Price[i]
+            msg.OrderQty = msg.Qty = Qty[i]     #上海债券撤单用Qty
+            msg.Side = Side[i]
+            msg.OrdType = OrdType[i]
+            msg.OrderNo = OrderNo[i]
+        elif t in exe_types:
+            msg = exe
+            msg.LastPx = Price[i]
+            msg.LastQty = Qty[i]
+            msg.ExecType = ExecType[i]
+            msg.BidApplSeqNum = BidApplSeqNum[i]
+            msg.OfferApplSeqNum = OfferApplSeqNum[i]
+            msg.TradeMoney = TradeMoney[i]
+        else:
+            raise Exception(f'Not support batch MsgType={t}')
+        msg.MsgType = t
+        msg.SecurityID = SecurityID[i]
+        msg.ChannelNo = ChannelNo[i]
+        msg.ApplSeqNum = ApplSeqNum[i]
+        msg.TransactTime = TransactTime[i]
+        msg.BizIndex = BizIndex[i]
+        msg._tick = msg._HHMMSSms = msg._ms = None
+        yield msg
+
+
 def axsbe_file(fileName, skip_nb=0):
     with open(fileName, 'r') as f:
         nb = 0
@@ -134,6 +237,42 @@ def axsbe_file(fileName, skip_nb=0):
                     pass
                     # 11, 12
 
+def axsbe_file_raw(fileName, skip_nb=0):
+    '''同axsbe_file，但不解码，产出消息行原文；由消费方用line_header取消息头、axsbe_line解码'''
+    with open(fileName, 'r') as f:
+        nb = 0
+        while True:
+            l = f.readline()
+            if not l:
+                break
+            if l[:2] == '//':
+                nb += 1
+                if nb<=skip_nb:
+                    continue
+                yield l.lstrip()
+
+def axsbe_line(line):
+    '''解码一行，不支持的消息类型返回None'''
+    return dict_to_axsbe(str_to_dict(line))
+
+MSG_TYPE_CLASS = {}     # MsgType : 消息类，同dict_to_axsbe
+MSG_TYPE_CLASS.update((t, axsbe_order) for t in axsbe_base.MsgTypes_order)
+MSG_TYPE_CLASS.update((t, axsbe_exe) for t in axsbe_base.MsgTypes_exe)
+MSG_TYPE_CLASS.update((t, axsbe_snap_stock) for t in axsbe_base.MsgTypes_snap)
+MSG_TYPE_CLASS.update((t, axsbe_status) for t in axsbe_base.MsgTypes_headerOnly)
+
+_LINE_MSGTYPE = re.compile(r'\bMsgType=(\d+)')
+_LINE_CHANNELNO = re.compile(r'\bChannelNo=(\d+)')
+
+def line_header(line):
+    '''只解析消息行的MsgType和ChannelNo，返回(消息类, ChannelNo)；不支持的消息类型返回(None, 0)'''
+    m = _LINE_MSGTYPE.search(line)
+    cls = None if m is None else MSG_TYPE_CLASS.get(int(m.group(1)))
+    if cls is None:
+        return None, 0
+    m = _LINE_CHANNELNO.search(line)
+    return cls, 0 if m is None else int(m.group(1))
+
 def extract_security(src_file, dst_file, security_list:list):
     dst_dir, _ = os.path.split(os.path.abspath(dst_file))
     if not os.path.exists(dst_dir):